@@ -0,0 +1,112 @@
+"""
+Averaging of frames and lines in the image provider.
+
+Averaging in the process of the provider means that only the averaged
+frames cross the process boundary: with 30 frames averaged, 30 times
+fewer images are queued, copied and notified in the application.
+
+The modes are:
+    'none':     every frame is emitted
+    'mean':     the mean of count frames is emitted every count frames
+    'running':  a running (Kalman) average, emitted with every frame: the
+                cumulative mean of the frames until count frames, then an
+                exponential average with a weight of 1/count for the new
+                frame.
+"""
+
+from __future__ import annotations
+
+from typing import Optional
+
+import numpy as np
+
+averaging_modes = ("none", "mean", "running")
+
+
+def accumulator_dtype(dtype) -> np.dtype:
+    """
+    Integer frames are summed exactly in integers large enough for
+    thousands of frames, floating-point frames in at least float32.
+    """
+    dtype = np.dtype(dtype)
+    if dtype.kind in "ui":
+        return np.result_type(dtype, np.uint32)
+    return np.result_type(dtype, np.float32)
+
+
+def mean_from_sum(total: np.ndarray, count: int, dtype) -> np.ndarray:
+    mean = total / count
+    if np.dtype(dtype).kind in "ui":
+        np.rint(mean, out=mean)
+    return mean.astype(dtype)
+
+
+def average_lines(frame: np.ndarray, n_lines: int) -> np.ndarray:
+    """
+    The mean of each group of n_lines consecutive lines, for a scan that
+    repeats every line n_lines times.
+    """
+    if n_lines == 1:
+        return frame
+    height = frame.shape[0] // n_lines
+    lines = frame[: height * n_lines].reshape(
+        (height, n_lines) + frame.shape[1:]
+    )
+    total = lines.sum(axis=1, dtype=accumulator_dtype(frame.dtype))
+    return mean_from_sum(total, n_lines, frame.dtype)
+
+
+class FrameAverager:
+    """
+    Accumulates the frames given to add(), which returns an averaged frame
+    (in the dtype of the frames) when there is one to emit, otherwise None.
+    The accumulation starts over if the shape or dtype of the frames
+    changes.
+    """
+
+    def __init__(self, mode: str = "none", count: int = 1, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if mode not in averaging_modes:
+            raise ValueError(
+                f"mode must be one of {averaging_modes}, got {mode}"
+            )
+        if count < 1:
+            raise ValueError("At least one frame must be averaged")
+        self.mode = mode
+        self.count = count
+        self.reset()
+
+    def reset(self):
+        self.accumulator = None
+        self.frames_accumulated = 0
+
+    def add(self, frame: np.ndarray) -> Optional[np.ndarray]:
+        if self.mode == "none" or self.count == 1:
+            return frame
+
+        if (
+            self.accumulator is None
+            or self.accumulator.shape != frame.shape
+            or self.dtype != frame.dtype
+        ):
+            self.dtype = frame.dtype
+            if self.mode == "running":
+                dtype = np.result_type(frame.dtype, np.float32)
+            else:
+                dtype = accumulator_dtype(frame.dtype)
+            self.accumulator = np.zeros(frame.shape, dtype=dtype)
+            self.frames_accumulated = 0
+
+        self.frames_accumulated += 1
+        if self.mode == "mean":
+            self.accumulator += frame
+            if self.frames_accumulated < self.count:
+                return None
+            mean = mean_from_sum(self.accumulator, self.count, frame.dtype)
+            self.accumulator.fill(0)
+            self.frames_accumulated = 0
+            return mean
+
+        weight = 1 / min(self.frames_accumulated, self.count)
+        self.accumulator += weight * (frame - self.accumulator)
+        return mean_from_sum(self.accumulator, 1, frame.dtype)
@@ -0,0 +1,187 @@
+"""
+Sample sources for the laser-scanning microscope.
+
+A digitizer delivers blocks of samples with the indices of the hsync and
+vsync triggers in each block, which is what FrameAssembler.push() takes.
+A DigitizerProcess runs a SyntheticDigitizer in its own process and writes
+the stream into a SampleRing, which is read like a digitizer: the
+acquisition pipeline can be profiled at the data rate of the scanner.
+"""
+
+from __future__ import annotations
+
+import time
+
+import numpy as np
+
+from pymicroscope.acquisition.frameassembler import ScanGeometry
+from pymicroscope.acquisition.samplering import SampleRing
+from pymicroscope.utils.terminable import TerminableProcess
+
+
+class SyntheticDigitizer:
+    """
+    A digitizer sampling a synthetic image at pixel_frequency. The image
+    (of the shape of the geometry) is placed at the active pixels of the
+    lines, the flyback samples are flyback_value. With realtime, read()
+    waits until the samples would have been acquired.
+
+    For a bidirectional geometry, the odd rows are sampled from right to
+    left and phase_offset pixels late, like a real scanner out of phase.
+    """
+
+    def __init__(
+        self,
+        geometry: ScanGeometry,
+        pixel_frequency: float = 20e6,
+        image: np.ndarray = None,
+        dtype=np.uint8,
+        flyback_value: int = 0,
+        realtime: bool = True,
+        phase_offset: float = 0.0,
+        noise: float = 0.0,
+        seed: int = None,
+        *args,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.geometry = geometry
+        self.pixel_frequency = pixel_frequency
+        self.dtype = np.dtype(dtype)
+        self.realtime = realtime
+
+        if image is None:
+            image = self.test_pattern(geometry.shape, self.dtype)
+        if image.shape != geometry.shape:
+            raise ValueError(
+                f"The image must have the shape {geometry.shape} of the frame"
+            )
+        self.image = image
+        self.phase_offset = phase_offset
+        self.noise = noise
+        self.rng = np.random.default_rng(seed)
+
+        lines = image
+        if geometry.bidirectional:
+            lines = image.copy()
+            lines[1::2] = self.reversed_lines(image[1::2], phase_offset)
+
+        # One frame of samples, as they come out of the digitizer
+        frame = np.full(
+            (geometry.lines_per_frame, geometry.samples_per_line),
+            flyback_value,
+            dtype=self.dtype,
+        )
+        frame[
+            geometry.lines_for_vsync :,
+            geometry.line_offset : geometry.line_offset + geometry.width,
+        ] = lines
+        self.frame_samples = frame.ravel()
+
+        self.sample_index = 0
+        self.start_time = None
+
+    @classmethod
+    def from_vms_controller(cls, vms_controller, width: int, **kwargs):
+        """
+        A digitizer with the timing configured on the VMS controller: its
+        pixel_frequency, with hsync_frequency lines per second.
+        """
+        geometry = ScanGeometry.from_vms_controller(vms_controller, width)
+        kwargs.setdefault("pixel_frequency", vms_controller.pixel_frequency)
+        return cls(geometry, **kwargs)
+
+    @staticmethod
+    def test_pattern(shape, dtype=np.uint8) -> np.ndarray:
+        """
+        Concentric rings, to see distortions of the scan.
+        """
+        height, width = shape
+        y, x = np.ogrid[:height, :width]
+        radius = np.hypot(x - width / 2, y - height / 2)
+        rings = (1 + np.cos(radius / 8)) / 2
+        maximum = np.iinfo(dtype).max if dtype.kind in "ui" else 1
+        return (rings * maximum).astype(dtype)
+
+    @staticmethod
+    def reversed_lines(rows: np.ndarray, phase_offset: float) -> np.ndarray:
+        """
+        The rows in the order they are sampled from right to left: once
+        flipped back, row(c + phase_offset) is read at column c.
+        """
+        columns = np.arange(rows.shape[1], dtype=float)
+        late = np.array(
+            [np.interp(columns + phase_offset, columns, row) for row in rows]
+        )
+        return np.rint(late[:, ::-1]).astype(rows.dtype)
+
+    def read(self, n_samples: int) -> tuple:
+        """
+        The next n_samples samples with the indices of the hsync and vsync
+        triggers among them.
+        """
+        start = self.sample_index
+        period = len(self.frame_samples)
+        samples = np.take(
+            self.frame_samples,
+            np.arange(start, start + n_samples) % period,
+        )
+
+        if self.noise > 0:
+            samples = self.add_noise(samples)
+
+        samples_per_line = self.geometry.samples_per_line
+        hsync = np.arange((-start) % samples_per_line, n_samples, samples_per_line)
+        vsync = np.arange((-start) % period, n_samples, period)
+        self.sample_index += n_samples
+
+        if self.realtime:
+            if self.start_time is None:
+                self.start_time = time.perf_counter() - start / self.pixel_frequency
+            acquired_time = self.start_time + self.sample_index / self.pixel_frequency
+            delay = acquired_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+        return samples, hsync, vsync
+
+    def add_noise(self, samples: np.ndarray) -> np.ndarray:
+        noisy = self.rng.standard_normal(len(samples), dtype=np.float32)
+        noisy *= self.noise
+        noisy += samples
+        if self.dtype.kind in "ui":
+            limits = np.iinfo(self.dtype)
+            np.rint(noisy, out=noisy)
+            np.clip(noisy, limits.min, limits.max, out=noisy)
+        return noisy.astype(self.dtype)
+
+
+class DigitizerProcess(TerminableProcess):
+    """
+    Writes the stream of a SyntheticDigitizer into the ring, in blocks of
+    block_size samples at the pixel_frequency of the digitizer (or as fast
+    as possible without realtime). The digitizer keyword arguments are
+    passed to SyntheticDigitizer, which is created in the process.
+    """
+
+    def __init__(
+        self,
+        ring: SampleRing,
+        block_size: int = 65536,
+        digitizer_kwargs: dict = None,
+        *args,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.ring = ring
+        self.block_size = block_size
+        self.digitizer_kwargs = digitizer_kwargs or {}
+
+    def run(self):
+        digitizer = SyntheticDigitizer(
+            self.ring.geometry, dtype=self.ring.dtype, **self.digitizer_kwargs
+        )
+        with self.syncing_context() as must_terminate_now:
+            while not must_terminate_now:
+                samples, hsync, vsync = digitizer.read(self.block_size)
+                self.ring.write(samples, hsync, vsync)
@@ -0,0 +1,155 @@
+"""
+Dark-frame and flat-field correction of the frames of a provider.
+
+A frame is corrected as (raw - dark) · gain, where dark is the mean of
+frames without light and gain = mean(flat - dark) / (flat - dark) is
+computed from the mean of frames of a uniform sample. The correction uses
+a preallocated float32 buffer and in-place ufuncs: correcting a frame does
+not allocate memory, so it keeps up with the frame rate of the provider.
+
+Calibrations depend on the provider and its configuration (size, exposure,
+gain...): CalibrationCache saves them on disk under a key computed from
+both, and keeps the ones already loaded in memory.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+from pathlib import Path
+
+import numpy as np
+
+
+class FlatFieldCalibration:
+    """
+    The dark frame and the gain map, as read-only float32 arrays of the
+    shape of the frames.
+    """
+
+    def __init__(self, dark: np.ndarray, gain: np.ndarray, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if dark.shape != gain.shape:
+            raise ValueError(
+                f"Dark frame {dark.shape} and gain map {gain.shape} differ"
+            )
+        self.dark = np.array(dark, dtype=np.float32)
+        self.gain = np.array(gain, dtype=np.float32)
+        self.dark.flags.writeable = False
+        self.gain.flags.writeable = False
+
+    @classmethod
+    def from_frames(
+        cls, dark: np.ndarray, flat: np.ndarray, min_signal: float = 1.0
+    ) -> FlatFieldCalibration:
+        """
+        The pixels with less than min_signal above the dark frame in the
+        flat frame (dead pixels) are left uncorrected (gain of 1).
+        """
+        signal = np.asarray(flat, dtype=np.float32) - np.asarray(
+            dark, dtype=np.float32
+        )
+        valid = signal >= min_signal
+        if not np.any(valid):
+            raise ValueError("The flat frame has no signal above the dark frame")
+
+        gain = np.ones_like(signal)
+        np.divide(signal[valid].mean(), signal, out=gain, where=valid)
+        return cls(dark, gain)
+
+    @property
+    def shape(self) -> tuple:
+        return self.dark.shape
+
+    def save(self, filepath) -> Path:
+        filepath = Path(filepath).expanduser()
+        filepath.parent.mkdir(parents=True, exist_ok=True)
+        with open(filepath, "wb") as file:
+            np.savez(file, dark=self.dark, gain=self.gain)
+        return filepath
+
+    @classmethod
+    def load(cls, filepath) -> FlatFieldCalibration:
+        with np.load(Path(filepath).expanduser()) as arrays:
+            return cls(arrays["dark"], arrays["gain"])
+
+
+class FlatFieldCorrector:
+    """
+    Applies a calibration to frames of its shape, of any dtype. The work
+    buffer is allocated once: correct() writes in the frame itself when
+    given out=frame, otherwise in an output buffer reused for every frame.
+    """
+
+    def __init__(self, calibration: FlatFieldCalibration, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.calibration = calibration
+        self.work = np.empty(calibration.shape, dtype=np.float32)
+        self.output = None
+
+    def correct(self, raw: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+        if raw.shape != self.calibration.shape:
+            raise ValueError(
+                f"Calibration is for frames of shape {self.calibration.shape}, got {raw.shape}"
+            )
+        if out is None:
+            if self.output is None or self.output.dtype != raw.dtype:
+                self.output = np.empty(raw.shape, dtype=raw.dtype)
+            out = self.output
+
+        work = self.work
+        np.subtract(raw, self.calibration.dark, out=work)
+        np.multiply(work, self.calibration.gain, out=work)
+        if out.dtype.kind in "ui":
+            limits = np.iinfo(out.dtype)
+            np.clip(work, limits.min, limits.max, out=work)
+            np.rint(work, out=work)
+        np.copyto(out, work, casting="unsafe")
+        return out
+
+
+class CalibrationCache:
+    """
+    Calibrations saved as '<key>.npz' in the directory. The key identifies
+    the provider and its configuration, without the settings that do not
+    change the raw frames (averaging, the calibration itself).
+    """
+
+    ignored_settings = (
+        "averaging_mode",
+        "averaging_count",
+        "flat_field_calibration",
+    )
+
+    def __init__(
+        self, directory="~/.pymicroscope/calibrations", *args, **kwargs
+    ):
+        super().__init__(*args, **kwargs)
+        self.directory = Path(directory).expanduser()
+        self.calibrations = {}
+
+    @classmethod
+    def key(cls, provider_name: str, configuration: dict) -> str:
+        settings = {
+            name: value
+            for name, value in dict(configuration).items()
+            if name not in cls.ignored_settings
+        }
+        description = json.dumps(
+            [provider_name, settings], sort_keys=True, default=str
+        )
+        return hashlib.sha256(description.encode()).hexdigest()[:16]
+
+    def filepath(self, key: str) -> Path:
+        return self.directory / f"{key}.npz"
+
+    def store(self, key: str, calibration: FlatFieldCalibration) -> Path:
+        self.calibrations[key] = calibration
+        return calibration.save(self.filepath(key))
+
+    def load(self, key: str) -> FlatFieldCalibration | None:
+        calibration = self.calibrations.get(key)
+        if calibration is None and self.filepath(key).exists():
+            calibration = FlatFieldCalibration.load(self.filepath(key))
+            self.calibrations[key] = calibration
+        return calibration
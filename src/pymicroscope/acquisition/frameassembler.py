@@ -0,0 +1,228 @@
+"""
+Frame assembly for the laser-scanning microscope.
+
+The digitizer delivers a continuous stream of samples, in blocks that have
+nothing to do with the lines, with the sample indices of the hsync (start
+of a polygon facet, i.e. of a line) and vsync (start of a frame) triggers.
+FrameAssembler cuts the stream into lines at the hsync, keeps the active
+pixels of each line (the rest is the flyback between facets), drops the
+lines of the vertical flyback and writes the lines into preallocated frame
+buffers. Everything is done on whole blocks with NumPy: there is no Python
+loop over the pixels or the lines.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+
+
+class ScanGeometry:
+    """
+    The timing of the scan, in samples and lines.
+
+    Each line has samples_per_line samples (the pixel clock divided by the
+    hsync frequency), of which width samples starting at line_offset are
+    the image. Each frame has lines_per_frame lines, the first
+    lines_for_vsync are the vertical flyback. With bidirectional lines,
+    the odd rows of the image are acquired from right to left.
+    """
+
+    def __init__(
+        self,
+        width: int = 640,
+        height: int = 480,
+        samples_per_line: int = 1024,
+        line_offset: int = None,
+        lines_for_vsync: int = 6,
+        bidirectional: bool = False,
+        *args,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        if line_offset is None:
+            line_offset = (samples_per_line - width) // 2
+
+        if width <= 0 or height <= 0:
+            raise ValueError("The frame must have at least one pixel")
+        if line_offset < 0 or line_offset + width > samples_per_line:
+            raise ValueError(
+                f"{width} pixels from sample {line_offset} do not fit in a line of {samples_per_line} samples"
+            )
+
+        self.width = width
+        self.height = height
+        self.samples_per_line = samples_per_line
+        self.line_offset = line_offset
+        self.lines_for_vsync = lines_for_vsync
+        self.bidirectional = bidirectional
+
+    @classmethod
+    def from_vms_controller(cls, vms_controller, width: int, line_offset=None):
+        """
+        The geometry configured on the VMS controller.
+        """
+        samples_per_line = round(
+            vms_controller.pixel_frequency / vms_controller.hsync_frequency
+        )
+        lines_per_frame = vms_controller.lines_per_frame
+        lines_for_vsync = vms_controller.lines_for_vsync
+        return cls(
+            width=width,
+            height=lines_per_frame - lines_for_vsync,
+            samples_per_line=samples_per_line,
+            line_offset=line_offset,
+            lines_for_vsync=lines_for_vsync,
+        )
+
+    @property
+    def lines_per_frame(self) -> int:
+        return self.height + self.lines_for_vsync
+
+    @property
+    def samples_per_frame(self) -> int:
+        return self.lines_per_frame * self.samples_per_line
+
+    @property
+    def shape(self) -> tuple:
+        return (self.height, self.width)
+
+    def __eq__(self, other):
+        return isinstance(other, ScanGeometry) and vars(self) == vars(other)
+
+
+class FrameAssembler:
+    """
+    Assembles frames from blocks of samples with push(). The frames are
+    written into a ring of n_buffers preallocated buffers: a frame returned
+    by push() is overwritten n_buffers frames later, copy it to keep it.
+
+    Without vsync, a frame starts every lines_per_frame lines, counting
+    from the first hsync.
+    """
+
+    def __init__(
+        self,
+        geometry: ScanGeometry,
+        dtype=np.uint8,
+        n_buffers: int = 3,
+        *args,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.geometry = geometry
+        self.dtype = np.dtype(dtype)
+        self.buffers = np.zeros((n_buffers, *geometry.shape), dtype=self.dtype)
+        self.pixel_offsets = geometry.line_offset + np.arange(geometry.width)
+        self.reset()
+
+    def reset(self):
+        self.buffer_index = 0
+        self.line_number = None  # Unknown until the first hsync
+        self.carry = np.empty(0, dtype=self.dtype)
+        self.frames_assembled = 0
+        self.lines_assembled = 0
+
+    @property
+    def frame(self) -> np.ndarray:
+        """
+        The buffer being filled.
+        """
+        return self.buffers[self.buffer_index]
+
+    def line_numbers(self, starts, vsync) -> np.ndarray:
+        """
+        The line number (within its frame) of the lines starting at the
+        sample indices starts, or -1 for lines before the first vsync.
+        """
+        lines_per_frame = self.geometry.lines_per_frame
+        numbers = np.arange(len(starts)) + (self.line_number or 0)
+        numbers %= lines_per_frame
+
+        if vsync is not None and len(vsync) > 0:
+            first_lines = np.searchsorted(starts, vsync)
+            for index in first_lines:
+                numbers[index:] = np.arange(len(starts) - index)
+                numbers[index:] %= lines_per_frame
+            if self.line_number is None:
+                numbers[: first_lines[0]] = -1
+        elif vsync is not None and self.line_number is None:
+            numbers[:] = -1
+
+        return numbers
+
+    def push(self, samples, hsync, vsync=None) -> list[np.ndarray]:
+        """
+        Add a block of samples with the indices (in the block) of its hsync
+        and vsync triggers. Returns the frames completed by this block.
+
+        Without vsync (None), frames start every lines_per_frame lines from
+        the first hsync. With vsync (even empty), the lines before the first
+        vsync are dropped.
+        """
+        samples = np.asarray(samples, dtype=self.dtype)
+        hsync = np.asarray(hsync, dtype=np.int64)
+
+        # The incomplete line of the previous block continues here
+        shift = len(self.carry)
+        stream = np.concatenate((self.carry, samples)) if shift else samples
+        starts = hsync + shift
+        if shift > 0:
+            starts = np.concatenate(([0], starts))
+        if vsync is not None:
+            vsync = np.asarray(vsync, dtype=np.int64) + shift
+
+        self.carry = self.carry[:0]
+        if len(starts) == 0:
+            return []
+
+        numbers = self.line_numbers(starts, vsync)
+        line_end = starts + self.geometry.line_offset + self.geometry.width
+        n_complete = np.searchsorted(line_end, len(stream), side="right")
+
+        if n_complete < len(starts):
+            next_number = numbers[n_complete]
+            if next_number >= 0:
+                self.carry = stream[starts[n_complete] :].copy()
+        else:
+            next_number = (numbers[-1] + 1) % self.geometry.lines_per_frame
+            if numbers[-1] < 0:
+                next_number = -1
+        self.line_number = next_number if next_number >= 0 else None
+
+        if n_complete == 0:
+            return []
+
+        lines = np.take(
+            stream, starts[:n_complete, np.newaxis] + self.pixel_offsets
+        )
+        rows = numbers[:n_complete] - self.geometry.lines_for_vsync
+        rows[numbers[:n_complete] < 0] = -1
+        self.lines_assembled += n_complete
+        return self.write_lines(lines, rows)
+
+    def write_lines(self, lines, rows) -> list[np.ndarray]:
+        """
+        Write the lines at their rows (negative rows are dropped: vertical
+        flyback) and return the completed frames.
+        """
+        frames = []
+        last_row = self.geometry.height - 1
+        ends = np.flatnonzero(rows == last_row) + 1
+        start = 0
+        for end in ends:
+            self.write_segment(lines[start:end], rows[start:end])
+            frames.append(self.frame)
+            self.frames_assembled += 1
+            self.buffer_index = (self.buffer_index + 1) % len(self.buffers)
+            start = end
+
+        self.write_segment(lines[start:], rows[start:])
+        return frames
+
+    def write_segment(self, lines, rows):
+        visible = rows >= 0
+        lines, rows = lines[visible], rows[visible]
+        if self.geometry.bidirectional:
+            reversed_lines = rows % 2 == 1
+            lines[reversed_lines] = lines[reversed_lines, ::-1]
+        self.frame[rows] = lines
@@ -1,5 +1,6 @@
 import time
 import math
+from pathlib import Path
 from typing import Protocol, Optional, Union, Type, Any, Callable, Tuple, Generic, TypeVar
 
 import numpy as np
@@ -9,6 +10,8 @@ from dataclasses import dataclass
 from mytk import Dialog
 from pymicroscope.utils.terminable import run_loop, TerminableProcess
 from pymicroscope.utils.configurable import Configurable, ConfigurableProperty
+from pymicroscope.acquisition.averaging import FrameAverager, averaging_modes
+from pymicroscope.acquisition.flatfield import CalibrationCache, FlatFieldCorrector
 from pymicroscope.acquisition.vmsconfigdialog import VMSConfigDialog
 
 class Controllable:
@@ -33,8 +36,12 @@ class ImageProvider(TerminableProcess, Configurable):
     Abstract base class defining the interface for image providers.
 
     Provides a configurable image capture process with client support.
+    Subclasses set default_channels to the number of channels of their
+    source (1 for a monochrome detector).
     """
 
+    default_channels = 3
+
     def __init__(
         self, queue:Optional[Queue] = None, *args: Any, **kwargs: Any
     ) -> None:
@@ -65,10 +72,35 @@ class ImageProvider(TerminableProcess, Configurable):
             default_value=30,
         )
 
+        prop_channels = ConfigurableProperty(
+            name="channels",
+            default_value=self.default_channels,
+            min_value=1,
+        )
+        prop_averaging_mode = ConfigurableProperty(
+            name="averaging_mode",
+            default_value="none",
+            validate_fct=averaging_modes.__contains__,
+            value_type=str,
+        )
+        prop_averaging_count = ConfigurableProperty(
+            name="averaging_count",
+            default_value=1,
+            displayed_name="Frames to average",
+            min_value=1,
+        )
+
+        prop_flat_field_calibration = ConfigurableProperty(
+            name="flat_field_calibration",
+            default_value="",
+            displayed_name="Flat-field calibrations directory",
+            value_type=str,
+        )
+
         properties_description = kwargs.pop("properties_description", [])
-        properties_description.extend([prop_width, prop_height,prop_frame_rate])
+        properties_description.extend([prop_width, prop_height,prop_frame_rate, prop_channels, prop_averaging_mode, prop_averaging_count, prop_flat_field_calibration])
         
-        configuration = {"frame_rate":30, "channels":3, "size":(480, 640)}
+        configuration = {"frame_rate":30, "size":(480, 640)}
         configuration.update(kwargs.pop("configuration", {}))
         
         Configurable.__init__(self, properties_description=properties_description, configuration=configuration)
@@ -77,6 +109,10 @@ class ImageProvider(TerminableProcess, Configurable):
 
         self._is_running = Value('b', False)
         self._last_image = None
+        self._averager = None
+        self._corrector = None
+        self._calibration_cache = None
+        self._calibration_key = None
         self.image_queue = queue
     
     @property
@@ -132,6 +168,88 @@ class ImageProvider(TerminableProcess, Configurable):
         """
         pass
 
+    def frame_averager(self) -> FrameAverager:
+        """
+        The averager for the current averaging_mode and averaging_count,
+        created again (discarding the frames accumulated) when they change.
+        """
+        mode = self.configuration["averaging_mode"]
+        count = self.configuration["averaging_count"]
+        averager = self._averager
+        if averager is None or (averager.mode, averager.count) != (mode, count):
+            self._averager = FrameAverager(mode, count)
+        return self._averager
+
+    def flat_field_corrector(self) -> Optional[FlatFieldCorrector]:
+        """
+        The corrector for the calibration of the current configuration in
+        the flat_field_calibration directory (see CalibrationCache.key),
+        none without a directory or a calibration. It is resolved again
+        only when the configuration changes.
+        """
+        directory = self.configuration["flat_field_calibration"]
+        if not directory:
+            self._calibration_cache = None
+            self._calibration_key = None
+            self._corrector = None
+            return None
+
+        cache = self._calibration_cache
+        if cache is None or cache.directory != Path(directory).expanduser():
+            self._calibration_cache = cache = CalibrationCache(directory)
+            self._calibration_key = None
+
+        key = CalibrationCache.key(type(self).__name__, self.configuration)
+        if key != self._calibration_key:
+            self._calibration_key = key
+            self._corrector = None
+            calibration = cache.load(key)
+            if calibration is not None:
+                self._corrector = FlatFieldCorrector(calibration)
+        return self._corrector
+
+    def capture_averaged_image(self) -> np.ndarray:
+        """
+        Capture images until the averager emits one: with averaging, only
+        the averaged images leave the provider.
+        """
+        while True:
+            img_array = self.capture_image()
+            if img_array is None:
+                return None
+            averaged = self.average_image(img_array)
+            if averaged is not None:
+                return averaged
+
+    def average_image(self, img_array) -> Optional[np.ndarray]:
+        """
+        Add a captured image to the averager and return the averaged image
+        when there is one, corrected with the flat-field calibration, if
+        any (the correction is linear: correcting the average is correcting
+        every frame).
+        """
+        averaged = self.frame_averager().add(img_array)
+        if averaged is None:
+            return None
+
+        corrector = self.flat_field_corrector()
+        if corrector is not None and corrector.calibration.shape != averaged.shape:
+            self.log.warning(
+                f"Flat-field calibration is for frames of shape "
+                f"{corrector.calibration.shape}, not {averaged.shape}: "
+                f"frames are not corrected"
+            )
+            # Until the configuration changes: warned only once
+            self._corrector = corrector = None
+        if corrector is not None:
+            if averaged.base is None and averaged.flags.writeable:
+                # In place: the frame owns its memory (a view may be
+                # into a buffer that the source reuses)
+                corrector.correct(averaged, out=averaged)
+            else:
+                averaged = corrector.correct(averaged).copy()
+        return averaged
+
     def start_capture(self, configuration) -> None:
         """Mark the beginning of an image capture session."""
         with self._is_running.get_lock():
@@ -171,10 +289,21 @@ class ImageProvider(TerminableProcess, Configurable):
         with self.syncing_context() as must_terminate_now:
             while not must_terminate_now:
                 try:
+                    # One frame at a time under the lock: stop_capture() and
+                    # termination do not wait for a whole average
                     with self._is_running.get_lock():
-                        if self._is_running.value:
-                            img_array = self.capture_image()
-                            self.image_queue.put(img_array)
+                        if not self._is_running.value:
+                            # Do not average across capture sessions
+                            self._averager = None
+                            continue
+                        img_array = self.capture_image()
+
+                    if img_array is None:
+                        self.image_queue.put(None)
+                    else:
+                        averaged = self.average_image(img_array)
+                        if averaged is not None:
+                            self.image_queue.put(averaged)
                 except Exception as err:
                     self.log.error(f"Error in ImageProvider run loop : {err}")
         
@@ -1,22 +1,157 @@
 import numpy as np
 from typing import Any, Optional
 
-from pymicroscope.acquisition.imageprovider import ImageProvider, Controllable, Configurable
-    
-class ScanGeneratorService(Configurable):
-    pass
+from pymicroscope.acquisition.imageprovider import ImageProvider
+from pymicroscope.acquisition.frameassembler import ScanGeometry, FrameAssembler
+from pymicroscope.acquisition.digitizer import SyntheticDigitizer
+from pymicroscope.acquisition.resampling import LineResampler
+from pymicroscope.acquisition.phasecorrection import PhaseCorrector
+from pymicroscope.acquisition.averaging import average_lines
+from pymicroscope.utils.configurable import ConfigurableProperty
 
-class ImageAcquisitionService(Configurable):
-    pass
 
 class LSMImageProvider(ImageProvider):
+    """
+    Image provider for the polygon-scanning microscope: the sample stream of
+    the digitizer is assembled into frames by a FrameAssembler.
+
+    The digitizer can be a SampleRing filled by another process, whose
+    geometry must be the one of the configuration. Without a digitizer, a
+    SyntheticDigitizer is used. The geometry of the scan comes from the
+    configuration and the assembler is rebuilt when it changes. The lines are resampled to uniform pixels according to the
+    scan_model ('linear' for none, 'polygon' or 'sinusoidal'). With
+    bidirectional lines, the offset of the odd lines is estimated when the
+    geometry changes and corrected on every frame. With line_averaging,
+    the scanner repeats every line that many times and the repeated lines
+    are averaged before resampling. Frames are in the dtype of the
+    digitizer (uint16 for more than 8 sample_bits) until they leave the
+    provider, with a single channel unless more channels are configured.
+    """
+
+    default_channels = 1
+
     def __init__(
         self,
+        digitizer=None,
         *args: Any,
         **kwargs: Any,
     ) -> None:
+        properties = [
+            ConfigurableProperty("samples_per_line", 1024),
+            ConfigurableProperty("line_offset", 192, displayed_name="First pixel in line"),
+            ConfigurableProperty("lines_for_vsync", 6),
+            ConfigurableProperty("pixel_frequency", 20e6, value_type=float),
+            ConfigurableProperty("block_size", 65536, displayed_name="Samples per block"),
+            ConfigurableProperty("scan_model", "linear", value_type=str),
+            ConfigurableProperty("polygon_faces", 36),
+            ConfigurableProperty("bidirectional", 0, min_value=0, max_value=1),
+            ConfigurableProperty("sample_bits", 8, displayed_name="Bits per sample", min_value=1, max_value=16),
+            ConfigurableProperty("line_averaging", 1, displayed_name="Lines to average", min_value=1),
+            ConfigurableProperty("simulated_phase_offset", 0.0, value_type=float),
+            ConfigurableProperty("simulated_noise", 0.0, value_type=float),
+        ]
+
+        properties_description = kwargs.get('properties_description',[])
+        properties_description.extend(properties)
+        kwargs['properties_description'] = properties_description
+
         super().__init__(*args, **kwargs)
-        self.scan_generator = ScanGeneratorService()
-        self.image_acquisition_service = ImageAcquisitionService()
-        
-        
\ No newline at end of file
+
+        self.digitizer = digitizer
+        self.assembler: Optional[FrameAssembler] = None
+        self.phase_corrector = PhaseCorrector()
+
+    def scan_geometry(self) -> ScanGeometry:
+        return ScanGeometry(
+            width=self.width,
+            height=self.height * self.configuration["line_averaging"],
+            samples_per_line=self.configuration["samples_per_line"],
+            line_offset=self.configuration["line_offset"],
+            lines_for_vsync=self.configuration["lines_for_vsync"],
+            bidirectional=bool(self.configuration["bidirectional"]),
+        )
+
+    def sample_dtype(self) -> np.dtype:
+        if self.configuration["sample_bits"] <= 8:
+            return np.dtype(np.uint8)
+        return np.dtype(np.uint16)
+
+    def synthetic_digitizer(self, geometry, dtype) -> SyntheticDigitizer:
+        """
+        The test pattern with sample_bits significant bits, every line
+        repeated line_averaging times.
+        """
+        image = SyntheticDigitizer.test_pattern((self.height, self.width), dtype)
+        image >>= 8 * dtype.itemsize - self.configuration["sample_bits"]
+        return SyntheticDigitizer(
+            geometry,
+            image=np.repeat(image, self.configuration["line_averaging"], axis=0),
+            dtype=dtype,
+            pixel_frequency=self.configuration["pixel_frequency"],
+            phase_offset=self.configuration["simulated_phase_offset"],
+            noise=self.configuration["simulated_noise"],
+        )
+
+    def prepare_assembler(self) -> FrameAssembler:
+        geometry = self.scan_geometry()
+        dtype = self.sample_dtype()
+        digitizer = self.digitizer
+        if digitizer is None or (
+            isinstance(digitizer, SyntheticDigitizer)
+            and (digitizer.geometry != geometry or digitizer.dtype != dtype)
+        ):
+            self.digitizer = self.synthetic_digitizer(geometry, dtype)
+        elif digitizer.geometry != geometry:
+            # The samples of a real digitizer are never replaced
+            raise ValueError(
+                f"The digitizer scans {digitizer.geometry}, the configuration {geometry}"
+            )
+
+        assembler = self.assembler
+        if (
+            assembler is None
+            or assembler.geometry != geometry
+            or assembler.dtype != self.digitizer.dtype
+        ):
+            self.assembler = FrameAssembler(geometry, dtype=self.digitizer.dtype)
+        return self.assembler
+
+    def line_resampler(self) -> LineResampler:
+        """
+        The resampling tables are cached: this is cheap for a configuration
+        already used.
+        """
+        geometry = self.assembler.geometry
+        return LineResampler(
+            self.configuration["scan_model"],
+            geometry.width,
+            faces=self.configuration["polygon_faces"],
+            duty_cycle=geometry.width / geometry.samples_per_line,
+        )
+
+    def capture_image(self) -> np.ndarray:
+        """
+        Read blocks of samples until a frame is complete. If a block
+        completes several frames, the most recent is returned.
+        """
+        assembler = self.prepare_assembler()
+
+        frames = []
+        while len(frames) == 0:
+            samples, hsync, vsync = self.digitizer.read(self.configuration["block_size"])
+            frames = assembler.push(samples, hsync, vsync)
+
+        frame = frames[-1]
+        if assembler.geometry.bidirectional:
+            # The offset is in samples: corrected before resampling
+            frame = self.phase_corrector.correct(
+                frame, configuration_key=assembler.geometry
+            )
+        frame = average_lines(frame, self.configuration["line_averaging"])
+        frame = self.line_resampler().resample(frame)[:, :, np.newaxis]
+        if self.channels > 1:
+            frame = np.repeat(frame, self.channels, axis=2)
+        elif np.shares_memory(frame, assembler.buffers):
+            # The assembler overwrites its buffers with the next frames
+            frame = frame.copy()
+        return frame
@@ -0,0 +1,186 @@
+"""
+Phase correction of bidirectional scans.
+
+With bidirectional lines, the odd lines are acquired in the opposite
+direction and, once flipped, are offset by a fraction of a pixel to a few
+pixels relative to the even lines (delay of the detection chain, phase of
+the scanner). The offset is estimated by cross-correlating the even and
+odd lines with FFTs, on a decimated set of line pairs and a few frames,
+then applied to every frame as a vectorized interpolation of the odd
+lines. It is estimated again only when the configuration changes or when
+a periodic check detects a drift.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+
+
+def estimate_phase_offset(
+    frame: np.ndarray, max_shift: int = 8, decimation: int = 4
+) -> float:
+    """
+    The sub-pixel offset p such that odd_line(c) ≈ even_line(c + p).
+    """
+    spectrum = cross_spectrum(frame, decimation)
+    return offset_from_cross_spectrum(spectrum, frame.shape[1], max_shift)
+
+
+def cross_spectrum(frame: np.ndarray, decimation: int = 4) -> np.ndarray:
+    """
+    Sum over the line pairs (one out of decimation) of the cross spectrum
+    of the even and odd lines, zero-padded for a linear correlation. The
+    lines are differentiated first: the smooth background would otherwise
+    make a broad correlation peak.
+    """
+    if frame.ndim == 3:
+        frame = frame.mean(axis=2)
+    n_pairs = frame.shape[0] // 2
+    step = 2 * decimation
+    even = np.diff(frame[0 : 2 * n_pairs : step].astype(np.float32), axis=1)
+    odd = np.diff(frame[1 : 2 * n_pairs : step].astype(np.float32), axis=1)
+
+    n = 2 * even.shape[1]
+    spectrum = np.conj(np.fft.rfft(even, n=n)) * np.fft.rfft(odd, n=n)
+    return spectrum.sum(axis=0)
+
+
+def offset_from_cross_spectrum(
+    spectrum: np.ndarray, width: int, max_shift: int = 8
+) -> float:
+    n = 2 * (width - 1)
+    correlation = np.fft.irfft(spectrum, n=n)
+    shifts = np.arange(-max_shift, max_shift + 1)
+    # Divided by the overlap of the lines: unbiased correlation
+    values = correlation[shifts % n] / (width - 1 - np.abs(shifts))
+
+    peak = int(np.argmax(values))
+    shift = float(shifts[peak])
+    if 0 < peak < len(values) - 1:
+        # Parabola through the peak and its neighbours
+        left, center, right = values[peak - 1 : peak + 2]
+        curvature = left - 2 * center + right
+        if curvature != 0:
+            shift += 0.5 * (left - right) / curvature
+
+    # correlation(k) = Σ even(c) odd(c + k) peaks at k = -p
+    return -shift
+
+
+class PhaseCorrector:
+    """
+    Estimates the offset of the odd lines on the first n_estimation_frames
+    frames, then corrects every frame. Every check_interval frames, the
+    offset is measured on the frame: if it differs by more than
+    drift_threshold pixels, it is estimated again.
+    """
+
+    def __init__(
+        self,
+        max_shift: int = 8,
+        decimation: int = 4,
+        n_estimation_frames: int = 3,
+        check_interval: int = 100,
+        drift_threshold: float = 0.25,
+        *args,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.max_shift = max_shift
+        self.decimation = decimation
+        self.n_estimation_frames = n_estimation_frames
+        self.check_interval = check_interval
+        self.drift_threshold = drift_threshold
+
+        self.configuration_key = None
+        self.reset()
+
+    def reset(self):
+        """
+        Estimate the offset again, from the next frames.
+        """
+        self.offset = 0.0
+        self.is_estimated = False
+        self._spectrum = None
+        self._estimation_frames = 0
+        self._frames_since_check = 0
+        self._shift_table = None
+
+    def estimate(self, frame: np.ndarray):
+        spectrum = cross_spectrum(frame, self.decimation)
+        if self._spectrum is None:
+            self._spectrum = spectrum
+        else:
+            self._spectrum += spectrum
+        self._estimation_frames += 1
+
+        self.set_offset(
+            offset_from_cross_spectrum(
+                self._spectrum, frame.shape[1], self.max_shift
+            )
+        )
+        if self._estimation_frames >= self.n_estimation_frames:
+            self.is_estimated = True
+            self._spectrum = None
+
+    def check_drift(self, frame: np.ndarray) -> bool:
+        offset = estimate_phase_offset(frame, self.max_shift, self.decimation)
+        return abs(offset - self.offset) > self.drift_threshold
+
+    def set_offset(self, offset: float):
+        if offset != self.offset:
+            self._shift_table = None
+        self.offset = offset
+
+    def shift_table(self, width: int) -> tuple:
+        """
+        Indices and weights to read odd_line(c - offset).
+        """
+        if self._shift_table is None or len(self._shift_table[0]) != width:
+            positions = np.arange(width) - self.offset
+            left = np.floor(positions).astype(np.intp)
+            weight = (positions - left).astype(np.float32)
+            right = np.clip(left + 1, 0, width - 1)
+            left = np.clip(left, 0, width - 1)
+            self._shift_table = (left, right, weight)
+        return self._shift_table
+
+    def apply(self, frame: np.ndarray) -> np.ndarray:
+        """
+        A copy of the frame with the odd lines shifted by -offset.
+        """
+        corrected = frame.copy()
+        if self.offset == 0:
+            return corrected
+
+        left, right, weight = self.shift_table(frame.shape[1])
+        if frame.ndim == 3:
+            weight = weight[:, np.newaxis]
+        odd = frame[1::2]
+        shifted = odd[:, left] * (1 - weight) + odd[:, right] * weight
+        if np.issubdtype(frame.dtype, np.integer):
+            np.rint(shifted, out=shifted)
+        corrected[1::2] = shifted
+        return corrected
+
+    def correct(self, frame: np.ndarray, configuration_key=None) -> np.ndarray:
+        """
+        Correct the frame, estimating the offset if the configuration_key
+        (anything comparable describing the scan) changed, or if a drift
+        is detected.
+        """
+        if configuration_key != self.configuration_key:
+            self.configuration_key = configuration_key
+            self.reset()
+
+        if not self.is_estimated:
+            self.estimate(frame)
+        else:
+            self._frames_since_check += 1
+            if self._frames_since_check >= self.check_interval:
+                self._frames_since_check = 0
+                if self.check_drift(frame):
+                    self.reset()
+                    self.estimate(frame)
+
+        return self.apply(frame)
@@ -0,0 +1,162 @@
+"""
+Resampling of the lines of a nonlinear scan to uniform pixels.
+
+The digitizer samples at a constant rate but the beam does not move at a
+constant speed on the sample: a polygon scans a constant angle per sample,
+which a flat field maps to tan(angle), and a resonant scanner follows a
+sinusoid. Each scan model gives the position of the active samples of a
+line. The table (for each output pixel, the two samples around its
+position and their weights) is computed once per configuration and
+applied to whole frames as a single gather and multiply-add.
+"""
+
+from __future__ import annotations
+
+from collections import OrderedDict
+
+import numpy as np
+
+
+def linear_positions(n_samples: int, faces: int, duty_cycle: float):
+    return np.linspace(-1, 1, n_samples)
+
+
+def polygon_positions(n_samples: int, faces: int, duty_cycle: float):
+    """
+    A facet turns by 2π/faces and deflects the beam by twice that angle;
+    the active samples are the duty_cycle fraction of the facet, centered.
+    The position on a flat field is tan(angle).
+    """
+    half_angle = duty_cycle * 2 * np.pi / faces
+    return np.tan(np.linspace(-half_angle, half_angle, n_samples))
+
+
+def sinusoidal_positions(n_samples: int, faces: int, duty_cycle: float):
+    """
+    A resonant scanner: the active samples are the duty_cycle fraction of
+    the half period, centered on the fastest part of the sinusoid.
+    """
+    half_phase = duty_cycle * np.pi / 2
+    return np.sin(np.linspace(-half_phase, half_phase, n_samples))
+
+
+scan_models = {
+    "linear": linear_positions,
+    "polygon": polygon_positions,
+    "sinusoidal": sinusoidal_positions,
+}
+
+_tables: OrderedDict = OrderedDict()
+_max_tables = 16
+
+
+def resampling_table(
+    scan_model: str,
+    n_samples: int,
+    n_pixels: int,
+    faces: int = 36,
+    duty_cycle: float = 0.625,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    The (indices, weights) table, both of shape (n_pixels, 2): output pixel
+    p is samples[indices[p]] · weights[p]. Tables are cached by their
+    parameters and are read-only.
+    """
+    key = (scan_model, n_samples, n_pixels, faces, duty_cycle)
+    table = _tables.get(key)
+    if table is not None:
+        _tables.move_to_end(key)
+        return table
+
+    if scan_model not in scan_models:
+        raise ValueError(
+            f"scan_model must be one of {list(scan_models)}, got {scan_model}"
+        )
+    if n_samples < 2 or n_pixels < 1:
+        raise ValueError("At least 2 samples and 1 pixel are needed")
+
+    positions = scan_models[scan_model](n_samples, faces, duty_cycle)
+    pixels = np.linspace(positions[0], positions[-1], n_pixels)
+
+    left = np.searchsorted(positions, pixels, side="right") - 1
+    left = np.clip(left, 0, n_samples - 2)
+    right_weight = (pixels - positions[left]) / (
+        positions[left + 1] - positions[left]
+    )
+    right_weight = np.clip(right_weight, 0, 1)
+
+    indices = np.stack((left, left + 1), axis=1)
+    weights = np.stack((1 - right_weight, right_weight), axis=1).astype(
+        np.float32
+    )
+    indices.flags.writeable = False
+    weights.flags.writeable = False
+
+    table = (indices, weights)
+    _tables[key] = table
+    if len(_tables) > _max_tables:
+        _tables.popitem(last=False)
+    return table
+
+
+class LineResampler:
+    """
+    Resamples the lines of frames of shape (height, n_samples) to
+    (height, n_pixels) uniform pixels, in the dtype of the frames.
+    """
+
+    def __init__(
+        self,
+        scan_model: str,
+        n_samples: int,
+        n_pixels: int = None,
+        faces: int = 36,
+        duty_cycle: float = 0.625,
+        *args,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        if n_pixels is None:
+            n_pixels = n_samples
+        self.scan_model = scan_model
+        self.n_samples = n_samples
+        self.n_pixels = n_pixels
+        self.indices, self.weights = resampling_table(
+            scan_model, n_samples, n_pixels, faces, duty_cycle
+        )
+
+    @classmethod
+    def for_vms_controller(
+        cls, vms_controller, n_samples: int, n_pixels: int = None
+    ):
+        """
+        The polygon of the VMS controller, with the active samples taken
+        among its PixelsPerLine samples per facet.
+        """
+        parameters = vms_controller.default_other_parameters
+        return cls(
+            "polygon",
+            n_samples,
+            n_pixels,
+            faces=parameters["Number_Of_Faces_Of_Polygon"],
+            duty_cycle=n_samples / parameters["PixelsPerLine"],
+        )
+
+    @property
+    def is_identity(self) -> bool:
+        return self.scan_model == "linear" and self.n_pixels == self.n_samples
+
+    def resample(self, frame: np.ndarray) -> np.ndarray:
+        if frame.shape[1] != self.n_samples:
+            raise ValueError(
+                f"Lines of {self.n_samples} samples expected, got {frame.shape[1]}"
+            )
+        if self.is_identity:
+            return frame
+
+        resampled = np.einsum(
+            "hpk,pk->hp", frame[:, self.indices], self.weights
+        )
+        if np.issubdtype(frame.dtype, np.integer):
+            resampled = np.rint(resampled, out=resampled)
+        return resampled.astype(frame.dtype)
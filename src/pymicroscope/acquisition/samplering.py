@@ -0,0 +1,160 @@
+"""
+A ring of digitizer samples in shared memory.
+
+A producer (a digitizer card, or a DigitizerProcess for the synthetic
+source) writes blocks of samples with their hsync and vsync triggers, a
+consumer in another process reads them with the same read() as a
+digitizer. The triggers are stored as a marker byte per sample, so that a
+block read anywhere in the ring gets its own trigger indices.
+
+There is one producer and one consumer. The producer never waits: like a
+real digitizer, it overwrites the oldest samples if the consumer is too
+slow, and the consumer counts the overrun and skips to the oldest samples
+still available.
+"""
+
+from __future__ import annotations
+
+import time
+from multiprocessing import Value, shared_memory
+
+import numpy as np
+
+from pymicroscope.acquisition.frameassembler import ScanGeometry
+
+HSYNC = 1
+VSYNC = 2
+
+
+class SampleRing:
+    """
+    A ring of capacity samples (four frames of the geometry by default)
+    and their markers. The creator unlinks the shared memory, the other
+    processes only close it.
+    """
+
+    def __init__(
+        self,
+        geometry: ScanGeometry,
+        capacity: int = None,
+        dtype=np.uint8,
+        *args,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        if capacity is None:
+            capacity = 4 * geometry.samples_per_frame
+        if capacity <= 0:
+            raise ValueError("The capacity must be positive")
+
+        self.geometry = geometry
+        self.capacity = capacity
+        self.dtype = np.dtype(dtype)
+
+        self.shared_memory = shared_memory.SharedMemory(
+            create=True, size=capacity * (self.dtype.itemsize + 1)
+        )
+        self.is_owner = True
+        # Total samples written, its lock orders the writes and the reads
+        self._written = Value("q", 0)
+
+        self.samples_read = 0
+        self.overruns = 0
+        self.samples_lost = 0
+        self._map_buffers()
+
+    def _map_buffers(self):
+        buffer = self.shared_memory.buf
+        self.markers = np.ndarray((self.capacity,), np.uint8, buffer)
+        self.samples = np.ndarray(
+            (self.capacity,), self.dtype, buffer, offset=self.capacity
+        )
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["markers"]
+        del state["samples"]
+        state["is_owner"] = False
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._map_buffers()
+
+    @property
+    def samples_written(self) -> int:
+        return self._written.value
+
+    @property
+    def samples_available(self) -> int:
+        return self.samples_written - self.samples_read
+
+    def write(self, samples: np.ndarray, hsync=(), vsync=()):
+        """
+        Append the samples, with the indices of the triggers among them.
+        """
+        n_samples = len(samples)
+        if n_samples > self.capacity:
+            raise ValueError(
+                f"Block of {n_samples} samples larger than the ring ({self.capacity})"
+            )
+        markers = np.zeros(n_samples, dtype=np.uint8)
+        markers[np.asarray(hsync, dtype=np.intp)] |= HSYNC
+        markers[np.asarray(vsync, dtype=np.intp)] |= VSYNC
+
+        start = self._written.value % self.capacity
+        first = min(n_samples, self.capacity - start)
+        self.samples[start : start + first] = samples[:first]
+        self.samples[: n_samples - first] = samples[first:]
+        self.markers[start : start + first] = markers[:first]
+        self.markers[: n_samples - first] = markers[first:]
+
+        with self._written.get_lock():
+            self._written.value += n_samples
+
+    def read(self, n_samples: int, timeout: float = 1.0) -> tuple:
+        """
+        The next n_samples samples with the indices of the hsync and vsync
+        triggers among them, waiting for the producer up to timeout
+        seconds.
+        """
+        if n_samples > self.capacity:
+            raise ValueError(
+                f"Cannot read {n_samples} samples from a ring of {self.capacity}"
+            )
+
+        deadline = time.perf_counter() + timeout
+        while self.samples_available < n_samples:
+            if time.perf_counter() > deadline:
+                raise TimeoutError(
+                    f"{self.samples_available} samples available after {timeout} s, {n_samples} requested"
+                )
+            time.sleep(0.001)
+
+        self.skip_overwritten()
+        indices = np.arange(self.samples_read, self.samples_read + n_samples)
+        indices %= self.capacity
+        samples = np.take(self.samples, indices)
+        markers = np.take(self.markers, indices)
+        # Overwritten while copied: the block is inconsistent
+        if self.samples_written - self.samples_read > self.capacity:
+            self.overruns += 1
+        self.samples_read += n_samples
+
+        hsync = np.flatnonzero(markers & HSYNC)
+        vsync = np.flatnonzero(markers & VSYNC)
+        return samples, hsync, vsync
+
+    def skip_overwritten(self):
+        lost = self.samples_written - self.samples_read - self.capacity
+        if lost > 0:
+            self.overruns += 1
+            self.samples_lost += lost
+            self.samples_read += lost
+
+    def close(self):
+        self.markers = None
+        self.samples = None
+        self.shared_memory.close()
+        if self.is_owner:
+            self.shared_memory.unlink()
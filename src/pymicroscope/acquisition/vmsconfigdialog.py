@@ -1,5 +1,7 @@
 from mytk import *
 
+from pymicroscope.utils.thread_utils import call_when_done
+
 class VMSConfigDialog(Dialog):
     def __init__(self, vms_controller, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -17,26 +19,20 @@ class VMSConfigDialog(Dialog):
             self.scan_controls, row=0, column=0, pady=5, padx=10, sticky="w"
         )
 
+        # The registers are read on the I/O thread of the port: the fields
+        # are filled when they arrive (see registers_did_arrive)
+        initial_tmr1_reload_value = self.vms_controller.tmr1_reload_value
+        initial_polygone_rev_per_min = self.vms_controller.polygone_rev_per_min
+        initial_hsync_frequency = self.vms_controller.hsync_frequency
+        initial_pixel_frequency = 0
         if self.vms_controller.is_accessible:
-            initial_dac_start = self.vms_controller.dac_start
-            initial_dac_increment = self.vms_controller.dac_increment
-            initial_lines_per_frame = self.vms_controller.lines_per_frame
-            initial_lines_for_vsync = self.vms_controller.lines_for_vsync
-            initial_tmr1_reload_value = self.vms_controller.tmr1_reload_value
-            initial_polygone_rev_per_min = self.vms_controller.polygone_rev_per_min
-            initial_hsync_frequency = self.vms_controller.hsync_frequency
-            initial_vsync_frequency = self.vms_controller.vsync_frequency
             initial_pixel_frequency = self.vms_controller.pixel_frequency
-        else:
-            initial_dac_start = 0
-            initial_dac_increment = 0
-            initial_lines_per_frame = 0
-            initial_lines_for_vsync = 0
-            initial_tmr1_reload_value = self.vms_controller.tmr1_reload_value
-            initial_polygone_rev_per_min = self.vms_controller.polygone_rev_per_min
-            initial_hsync_frequency = self.vms_controller.hsync_frequency
-            initial_vsync_frequency = 0
-            initial_pixel_frequency = 0
+
+        initial_dac_start = 0
+        initial_dac_increment = 0
+        initial_lines_per_frame = 0
+        initial_lines_for_vsync = 0
+        initial_vsync_frequency = 0
 
         self.dac_start_entry = IntEntry(value=initial_dac_start, width=6)
         self.dac_start_entry.grid_into(
@@ -105,7 +101,8 @@ class VMSConfigDialog(Dialog):
         Label("VSync Frequency [Hz]").grid_into(
             self.scan_controls, row=4, column=2, pady=5, padx=10, sticky="w"
         )
-        Label(initial_vsync_frequency).grid_into(
+        self.vsync_frequency_label = Label(initial_vsync_frequency)
+        self.vsync_frequency_label.grid_into(
             self.scan_controls, row=4, column=3, pady=5, padx=10, sticky="w"
         )
 
@@ -118,37 +115,57 @@ class VMSConfigDialog(Dialog):
         )
 
         if self.vms_controller.is_accessible:
-            Label(self.vms_controller.build_info()).grid_into(
-                self.scan_controls,
-                row=5,
-                column=0,
-                columnspan=2,
-                pady=5,
-                padx=10,
-                sticky="w",
-            )
+            info = "Reading the VMS controller..."
         else:
-            Label("VMS controller serial port is not inaccessible").grid_into(
-                self.scan_controls,
-                row=5,
-                column=0,
-                columnspan=2,
-                pady=5,
-                padx=10,
-                sticky="w",
-            )
+            info = "VMS controller serial port is not inaccessible"
+        self.info_label = Label(info)
+        self.info_label.grid_into(
+            self.scan_controls,
+            row=5,
+            column=0,
+            columnspan=2,
+            pady=5,
+            padx=10,
+            sticky="w",
+        )
 
         self.scan_controls.is_enabled = self.vms_controller.is_accessible
-        self.dac_start_entry.is_enabled = self.vms_controller.is_accessible
-        self.dac_increment_entry.is_enabled = self.vms_controller.is_accessible
-        self.lines_per_frame_entry.is_enabled = (
-            self.vms_controller.is_accessible
-        )
-        self.lines_for_vsync_entry.is_enabled = (
-            self.vms_controller.is_accessible
-        )
-        self.apply_scan_parameters_button.is_enabled = self.vms_controller.is_accessible
-        
+        self.set_entries_enabled(False)
+
+        if self.vms_controller.is_accessible:
+            call_when_done(
+                self,
+                self.vms_controller.refresh_registers_async(),
+                self.registers_did_arrive,
+            )
+
+    def set_entries_enabled(self, is_enabled):
+        self.dac_start_entry.is_enabled = is_enabled
+        self.dac_increment_entry.is_enabled = is_enabled
+        self.lines_per_frame_entry.is_enabled = is_enabled
+        self.lines_for_vsync_entry.is_enabled = is_enabled
+        self.apply_scan_parameters_button.is_enabled = is_enabled
+
+    def registers_did_arrive(self, future):
+        try:
+            registers = future.result()
+        except Exception as err:
+            self.info_label.text = f"Unable to read the VMS controller: {err}"
+            return
+
+        # All the values below come from the register cache
+        self.dac_start_entry.value = registers["READ_DAC_START"][0]
+        self.dac_increment_entry.value = registers["READ_DAC_INCREMENT"][0]
+        self.lines_per_frame_entry.value = registers[
+            "READ_NUMBER_OF_LINES_PER_FRAME"
+        ][0]
+        self.lines_for_vsync_entry.value = registers[
+            "READ_NUMBER_OF_LINES_FOR_VSYNC"
+        ][0]
+        self.vsync_frequency_label.text = self.vms_controller.vsync_frequency
+        self.info_label.text = self.vms_controller.build_info()
+        self.set_entries_enabled(True)
+
     def user_clicked_apply_button(self, event, button):
         if not self.vms_controller.is_accessible:
             Dialog.showerror(
@@ -166,13 +183,12 @@ class VMSConfigDialog(Dialog):
 
         is_valid = self.vms_controller.parameters_are_valid(parameters)
         if all([value is None for value in is_valid.values()]):
-            self.vms_controller.dac_start = self.dac_start_entry.value
-            self.vms_controller.dac_increment = self.dac_increment_entry.value
-            self.vms_controller.lines_per_frame = (
-                self.lines_per_frame_entry.value
-            )
-            self.vms_controller.lines_for_vsync = (
-                self.lines_for_vsync_entry.value
+            # Written from the I/O thread of the port: the interface does
+            # not wait for the controller
+            call_when_done(
+                self,
+                self.vms_controller.send_commands_async(list(parameters.items())),
+                self.parameters_did_apply,
             )
         else:
             err_message = ""
@@ -182,3 +198,11 @@ class VMSConfigDialog(Dialog):
                     
 
             Dialog.showerror(title="Invalid parameters", message=err_message)
+
+    def parameters_did_apply(self, future):
+        error = future.exception()
+        if error is not None:
+            Dialog.showerror(
+                title="Unable to write the scan parameters",
+                message=f"The VMS controller did not accept the parameters: {error}",
+            )
@@ -4,14 +4,62 @@ import struct
 from serial.tools import list_ports
 import binascii
 import time
+from concurrent.futures import Future
 
+from pymicroscope.hardware.serialtransport import transport_for
+from pymicroscope.hardware.simulated import SimulatedVMSPort
 
 # CONTROLLER_SERIAL_PATH = "/dev/cu.USA19QW3d1P1.1"
 CONTROLLER_SERIAL_PATH = "/dev/cu.usbserial-A907SJ89"
 
 
+class CommandCodec:
+    """
+    The precompiled request and response structs of a controller command.
+    """
+
+    def __init__(self, name, command_dict):
+        self.name = name
+        self.command_code = command_dict["command_code"]
+        self.request = struct.Struct(command_dict["command_bytes_format"])
+        self.response = struct.Struct(command_dict["response_bytes_format"])
+        # The controller changes the value by itself (live inputs)
+        self.volatile = command_dict.get("volatile", False)
+
+    @property
+    def is_write(self):
+        return self.name.startswith("WRITE_")
+
+    @property
+    def is_cached(self):
+        """
+        The response of a READ_ command that only changes with its WRITE_
+        command, or never (identity of the controller).
+        """
+        return not self.is_write and not self.volatile
+
+    @property
+    def register(self):
+        """
+        The READ_ command whose value is changed by a WRITE_ command.
+        """
+        return self.name.replace("WRITE_", "READ_")
+
+    def encode(self, parameter=None):
+        if parameter is not None:
+            return self.request.pack(self.command_code, parameter)
+        return self.request.pack(self.command_code)
+
+    def decode(self, response_bytes):
+        if self.response.size == 0:
+            return None
+        return self.response.unpack(response_bytes)
+
+
 class VMSController:
-    def __init__(self):
+    def __init__(self, serial_path=CONTROLLER_SERIAL_PATH):
+        # "debug" for a simulated controller
+        self.serial_path = serial_path
         self.default_write_parameters = {
             "WRITE_DAC_START": 19200,
             "WRITE_DAC_INCREMENT": 32,
@@ -45,6 +93,7 @@ class VMSController:
                 "command_code": 0x7E,
                 "command_bytes_format": ">b",
                 "response_bytes_format": "B",
+                "volatile": True,
             },
             "READ_BUILD_TIME": {
                 "command_code": 0x6A,
@@ -110,13 +159,28 @@ class VMSController:
             },
         }
 
+        self.codecs = {
+            name: CommandCodec(name, command_dict)
+            for name, command_dict in self.commands.items()
+        }
+
+        # Responses of the READ_ commands, until the register is written.
+        # Volatile registers are always read from the controller.
+        self.register_cache = {}
+
         self.port = None
+        self.transport = None
         self.is_accessible = False
         
     def initialize(self):
-        self.port = serial.Serial(
-            CONTROLLER_SERIAL_PATH, baudrate=19200, timeout=3
-        )
+        if self.serial_path == "debug":
+            self.port = SimulatedVMSPort(self.commands)
+        else:
+            self.port = serial.Serial(
+                self.serial_path, baudrate=19200, timeout=3
+            )
+        # All traffic goes through the I/O thread of the port
+        self.transport = transport_for(self.port, retries=1)
 
         version = self.send_command("READ_FIRMWARE_VERSION")
         if version[0] != 4:
@@ -125,43 +189,140 @@ class VMSController:
         self.is_accessible = True
 
     def shutdown(self):
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
         if self.port is not None:
             self.port.close()
         self.is_accessible = False
+        self.register_cache.clear()
 
     def build_info(self):
-        fw = self.send_command("READ_FIRMWARE_VERSION")
-        cid = self.send_command("READ_CID")
-        cpn = self.send_command("READ_CPN")
-        serial_number = self.send_command("READ_SN")
-        build_time = self.send_command("READ_BUILD_TIME")
-        build_date = self.send_command("READ_BUILD_DATE")
+        info = self.read_registers(
+            [
+                "READ_FIRMWARE_VERSION",
+                "READ_CID",
+                "READ_CPN",
+                "READ_SN",
+                "READ_BUILD_TIME",
+                "READ_BUILD_DATE",
+            ]
+        )
+        fw = info["READ_FIRMWARE_VERSION"]
+        cid = info["READ_CID"]
+        cpn = info["READ_CPN"]
+        serial_number = info["READ_SN"]
+        build_time = info["READ_BUILD_TIME"]
+        build_date = info["READ_BUILD_DATE"]
         return f"VMS Controller: CID: {cid[0]}, CPN: {cpn[0]}, Serial #: {serial_number},\nFireware version: {fw[0]}.{fw[1]}.{fw[2]} [Build: {b''.join(build_date).decode()}, {b''.join(build_time).decode()}]\n"
 
     def send_command(self, command_name, parameter=None):
-        command_dict = self.commands[command_name]
+        return self.send_commands([(command_name, parameter)])[0]
 
-        command_code = command_dict["command_code"]
-        command_bytes_format = command_dict["command_bytes_format"]
+    def send_commands(self, commands):
+        """
+        Send the (command_name, parameter) commands in a single write and
+        read their concatenated responses at once: one round trip on the
+        serial port. Returns the unpacked response of each command (None
+        for writes). Reads of registers that are not volatile update the
+        register cache, writes invalidate it.
+        """
+        return self.send_commands_async(commands).result()
 
-        if parameter is not None:
-            payload = struct.pack(command_bytes_format, command_code, parameter)
-        else:
-            payload = struct.pack(command_bytes_format, command_code)
-
-        self.port.write(payload)
-        self.port.flush()
-
-        response_bytes_format = command_dict["response_bytes_format"]
-        bytes_returned = struct.calcsize(response_bytes_format)
-        unpacked_response = None
-        if bytes_returned != 0:
-            response_bytes = self.port.read(bytes_returned)
-            unpacked_response = struct.unpack(
-                response_bytes_format, response_bytes
+    def send_commands_async(self, commands) -> Future:
+        """
+        Same as send_commands(), without waiting: the transaction is
+        performed on the I/O thread of the port and the future gives the
+        responses.
+        """
+        codecs = [self.codecs[command_name] for command_name, _ in commands]
+        payload = b"".join(
+            codec.encode(parameter)
+            for codec, (_, parameter) in zip(codecs, commands)
+        )
+        bytes_returned = sum(codec.response.size for codec in codecs)
+
+        transaction = self.transport.submit(payload, bytes_returned)
+        future = Future()
+
+        def decode_responses(transaction):
+            try:
+                responses = self.decode_responses(codecs, transaction.result())
+            except Exception as err:
+                future.set_exception(err)
+            else:
+                future.set_result(responses)
+
+        transaction.add_done_callback(decode_responses)
+        return future
+
+    def decode_responses(self, codecs, response_bytes):
+        responses = []
+        offset = 0
+        for codec in codecs:
+            response = codec.decode(
+                response_bytes[offset : offset + codec.response.size]
             )
+            offset += codec.response.size
+
+            if codec.is_write:
+                self.register_cache.pop(codec.register, None)
+            elif codec.is_cached:
+                self.register_cache[codec.name] = response
+            responses.append(response)
+
+        return responses
+
+    def read_registers(self, command_names, use_cache=True):
+        """
+        The responses of the READ_ commands, by name. Those not in the
+        cache are read in a single transaction.
+        """
+        registers = {}
+        if use_cache:
+            for name in command_names:
+                response = self.register_cache.get(name)
+                if response is not None:
+                    registers[name] = response
+
+        missing = [name for name in command_names if name not in registers]
+        if len(missing) > 0:
+            responses = self.send_commands([(name, None) for name in missing])
+            registers.update(zip(missing, responses))
+
+        return {name: registers[name] for name in command_names}
+
+    def read_register(self, command_name):
+        return self.read_registers([command_name])[command_name]
+
+    def refresh_registers(self):
+        """
+        Read all the registers and information of the controller in a
+        single transaction, e.g. before showing them.
+        """
+        return self.refresh_registers_async().result()
+
+    def refresh_registers_async(self) -> Future:
+        """
+        Same as refresh_registers(), without waiting: the future gives the
+        registers by name.
+        """
+        names = [
+            name for name, codec in self.codecs.items() if not codec.is_write
+        ]
+        transaction = self.send_commands_async([(name, None) for name in names])
+        future = Future()
+
+        def registers_by_name(transaction):
+            try:
+                registers = dict(zip(names, transaction.result()))
+            except Exception as err:
+                future.set_exception(err)
+            else:
+                future.set_result(registers)
 
-        return unpacked_response
+        transaction.add_done_callback(registers_by_name)
+        return future
 
 
     def parameters_are_valid(self, parameters):
@@ -181,7 +342,7 @@ class VMSController:
 
     @property
     def lines_per_frame(self):
-        return self.send_command("READ_NUMBER_OF_LINES_PER_FRAME")[0]
+        return self.read_register("READ_NUMBER_OF_LINES_PER_FRAME")[0]
 
     @lines_per_frame.setter
     def lines_per_frame(self, value):
@@ -189,7 +350,7 @@ class VMSController:
 
     @property
     def lines_for_vsync(self):
-        return self.send_command("READ_NUMBER_OF_LINES_FOR_VSYNC")[0]
+        return self.read_register("READ_NUMBER_OF_LINES_FOR_VSYNC")[0]
 
     @lines_for_vsync.setter
     def lines_for_vsync(self, value):
@@ -197,7 +358,7 @@ class VMSController:
 
     @property
     def dac_start(self):
-        return self.send_command("READ_DAC_START")[0]
+        return self.read_register("READ_DAC_START")[0]
 
     @dac_start.setter
     def dac_start(self, value):
@@ -205,7 +366,7 @@ class VMSController:
 
     @property
     def dac_increment(self):
-        return self.send_command("READ_DAC_INCREMENT")[0]
+        return self.read_register("READ_DAC_INCREMENT")[0]
 
     @dac_increment.setter
     def dac_increment(self, value):
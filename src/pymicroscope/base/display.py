@@ -0,0 +1,132 @@
+"""
+Mapping of frames of any depth to 8-bit images for the screen.
+
+Frames keep the dtype and the channels of their provider everywhere in the
+application (8- or 16-bit integers, floating point, mono or RGB): they are
+only mapped to 8 bits at the edge, when a preview is displayed. Integer
+frames of up to 16 bits are mapped with a lookup table, computed again only
+when the display range changes, other frames with a vectorized scaling.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+from PIL import Image as PILImage
+
+
+def full_range(dtype) -> tuple:
+    """
+    The range of values of the dtype. Floating-point frames have no range:
+    like the averages of 8-bit frames, they are taken in [0, 255].
+    """
+    dtype = np.dtype(dtype)
+    if dtype.kind in "ui":
+        limits = np.iinfo(dtype)
+        return (int(limits.min), int(limits.max))
+    return (0.0, 255.0)
+
+
+class DisplayMapping:
+    """
+    Maps the range [low, high] to [0, 255], with an optional gamma. Without
+    low or high, the full range of the dtype is used. With auto_contrast,
+    the range is taken between the saturation and 100 - saturation
+    percentiles of every frame (on a decimated frame, for speed).
+    """
+
+    def __init__(
+        self,
+        low=None,
+        high=None,
+        auto_contrast: bool = False,
+        saturation: float = 0.1,
+        gamma: float = 1.0,
+        *args,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.low = low
+        self.high = high
+        self.auto_contrast = auto_contrast
+        self.saturation = saturation
+        self.gamma = gamma
+
+        self._table_key = None
+        self._table = None
+
+    def display_range(self, img_array: np.ndarray) -> tuple:
+        if self.auto_contrast:
+            step = max(1, int(np.sqrt(img_array.size / 65536)))
+            low, high = np.percentile(
+                img_array[::step, ::step],
+                (self.saturation, 100 - self.saturation),
+            )
+            if high <= low:
+                high = low + 1
+            return (low, high)
+
+        low, high = full_range(img_array.dtype)
+        if self.low is not None:
+            low = self.low
+        if self.high is not None:
+            high = self.high
+        return (low, high)
+
+    def is_identity(self, img_array: np.ndarray) -> bool:
+        return (
+            img_array.dtype == np.uint8
+            and not self.auto_contrast
+            and self.display_range(img_array) == (0, 255)
+            and self.gamma == 1.0
+        )
+
+    def scaled(self, values: np.ndarray, low, high) -> np.ndarray:
+        scaled = (values.astype(np.float32) - low) / (high - low)
+        np.clip(scaled, 0, 1, out=scaled)
+        if self.gamma != 1.0:
+            np.power(scaled, self.gamma, out=scaled)
+        scaled *= 255
+        return np.rint(scaled, out=scaled).astype(np.uint8)
+
+    def lookup_table(self, dtype, low, high) -> np.ndarray:
+        """
+        The 8-bit value of every value of the dtype.
+        """
+        key = (np.dtype(dtype), low, high, self.gamma)
+        if key != self._table_key:
+            values = np.arange(2 ** (8 * np.dtype(dtype).itemsize))
+            self._table = self.scaled(values, low, high)
+            self._table_key = key
+        return self._table
+
+    def to_display(self, img_array: np.ndarray) -> np.ndarray:
+        """
+        The frame as uint8, of the same shape.
+        """
+        if self.is_identity(img_array):
+            return img_array
+
+        low, high = self.display_range(img_array)
+        if img_array.dtype in (np.uint8, np.uint16):
+            table = self.lookup_table(img_array.dtype, low, high)
+            return np.take(table, img_array)
+        return self.scaled(img_array, low, high)
+
+
+def pil_image_for_display(
+    img_array: np.ndarray, mapping: DisplayMapping = None
+) -> PILImage.Image:
+    """
+    A grayscale image for mono frames (2D or one channel), an RGB image
+    with the first three channels otherwise.
+    """
+    if mapping is None:
+        mapping = DisplayMapping()
+    displayed = mapping.to_display(img_array)
+    if displayed.ndim == 3 and displayed.shape[2] < 3:
+        displayed = displayed[:, :, 0]
+    if displayed.ndim == 2:
+        return PILImage.fromarray(displayed, mode="L")
+    return PILImage.fromarray(
+        np.ascontiguousarray(displayed[:, :, :3]), mode="RGB"
+    )
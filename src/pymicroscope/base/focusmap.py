@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import numpy as np
+
+
+class FocusMap:
+    """
+    A model of the focus surface z(x, y) of a sample, fitted to the best
+    focus measured at a sparse set of points.
+
+    With method 'plane', a tilted plane is fitted by least squares (at least
+    3 points). With method 'spline', a thin-plate spline goes through the
+    points (or close to them when smoothing > 0) to follow wavy samples
+    (at least 3 non-collinear points). With fewer points, the surface is
+    flat at the mean focus.
+
+    Coordinates are in the same units as the MapController positions
+    (microsteps).
+    """
+
+    methods = ("plane", "spline")
+
+    def __init__(
+        self, method: str = "plane", smoothing: float = 0.0, *args, **kwargs
+    ):
+        super().__init__(*args, **kwargs)
+        if method not in self.methods:
+            raise ValueError(
+                f"method must be one of {self.methods}, got {method}"
+            )
+
+        self.method = method
+        self.smoothing = smoothing
+        self.points: list[tuple[float, float, float]] = []
+        self._model = None
+
+    def __len__(self):
+        return len(self.points)
+
+    def add_point(self, x: float, y: float, z: float):
+        """
+        Add the best focus z measured at (x, y).
+        """
+        self.points.append((float(x), float(y), float(z)))
+        self._model = None
+
+    def clear(self):
+        self.points = []
+        self._model = None
+
+    def fit(self):
+        if len(self.points) == 0:
+            raise ValueError("A focus map needs at least one focus point")
+
+        points = np.asarray(self.points, dtype=float)
+        xy, z = points[:, :2], points[:, 2]
+
+        # Work in normalized coordinates for a well-conditioned system
+        origin = xy.mean(axis=0)
+        scale = max(np.ptp(xy, axis=0).max(), 1e-12)
+        uv = (xy - origin) / scale
+
+        if len(points) < 3 or np.linalg.matrix_rank(self.affine_terms(uv)) < 3:
+            self._model = ("flat", origin, scale, z.mean())
+        elif self.method == "plane":
+            coefficients, *_ = np.linalg.lstsq(
+                self.affine_terms(uv), z, rcond=None
+            )
+            self._model = ("plane", origin, scale, coefficients)
+        else:
+            n = len(points)
+            system = np.zeros((n + 3, n + 3))
+            system[:n, :n] = self.kernel(uv, uv) + self.smoothing * np.eye(n)
+            system[:n, n:] = self.affine_terms(uv)
+            system[n:, :n] = self.affine_terms(uv).T
+            values = np.concatenate([z, np.zeros(3)])
+            weights = np.linalg.solve(system, values)
+            self._model = ("spline", origin, scale, (uv, weights))
+
+    @staticmethod
+    def affine_terms(uv: np.ndarray) -> np.ndarray:
+        return np.column_stack([np.ones(len(uv)), uv])
+
+    @staticmethod
+    def kernel(uv1: np.ndarray, uv2: np.ndarray) -> np.ndarray:
+        """
+        Thin-plate spline radial function r^2 log(r) between all points.
+        """
+        r2 = ((uv1[:, np.newaxis, :] - uv2[np.newaxis, :, :]) ** 2).sum(axis=2)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            values = 0.5 * r2 * np.log(r2)
+        return np.nan_to_num(values)
+
+    def z_at(self, x, y) -> np.ndarray | float:
+        """
+        Focus at (x, y). Accepts scalars or arrays of the same shape.
+        """
+        if self._model is None:
+            self.fit()
+
+        x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+        kind, origin, scale, parameters = self._model
+        uv = np.column_stack([x.ravel(), y.ravel()])
+        uv = (uv - origin) / scale
+
+        if kind == "flat":
+            z = np.full(len(uv), parameters)
+        elif kind == "plane":
+            z = self.affine_terms(uv) @ parameters
+        else:
+            centers, weights = parameters
+            n = len(centers)
+            z = self.kernel(uv, centers) @ weights[:n]
+            z += self.affine_terms(uv) @ weights[n:]
+
+        z = z.reshape(x.shape)
+        if z.ndim == 0:
+            return float(z)
+        return z
+
+    def residuals(self) -> np.ndarray:
+        """
+        Measured focus minus the model at every focus point.
+        """
+        points = np.asarray(self.points, dtype=float)
+        return points[:, 2] - self.z_at(points[:, 0], points[:, 1])
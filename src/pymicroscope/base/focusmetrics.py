@@ -0,0 +1,75 @@
+"""
+Sharpness metrics used to find the best focus.
+
+All metrics take a 2D array (use region_of_interest to extract a decimated
+grayscale region from a frame) and return a float that is larger when the
+image is sharper. They are vectorized with NumPy slicing so that a metric
+on a decimated region costs much less than acquiring the frame.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+
+
+def region_of_interest(
+    img_array: np.ndarray, roi=None, decimation: int = 1
+) -> np.ndarray:
+    """
+    Grayscale float32 region of a frame, keeping one pixel out of
+    'decimation' in each direction.
+
+    Args:
+        img_array: Frame of shape (height, width) or (height, width, channels).
+        roi: (top, left, height, width), or None for the whole frame.
+        decimation: Decimation factor.
+    """
+    if roi is not None:
+        top, left, height, width = roi
+        img_array = img_array[top : top + height, left : left + width]
+
+    img_array = img_array[::decimation, ::decimation]
+    if img_array.ndim == 3:
+        return img_array.mean(axis=2, dtype=np.float32)
+    return img_array.astype(np.float32)
+
+
+def variance_of_laplacian(image: np.ndarray) -> float:
+    """
+    Variance of the 4-neighbour Laplacian: sensitive to fine details.
+    """
+    laplacian = (
+        image[:-2, 1:-1]
+        + image[2:, 1:-1]
+        + image[1:-1, :-2]
+        + image[1:-1, 2:]
+        - 4 * image[1:-1, 1:-1]
+    )
+    return float(laplacian.var())
+
+
+def brenner_gradient(image: np.ndarray) -> float:
+    """
+    Mean squared difference between pixels two apart, in both directions.
+    """
+    d_rows = image[2:, :] - image[:-2, :]
+    d_columns = image[:, 2:] - image[:, :-2]
+    return float((d_rows**2).mean() + (d_columns**2).mean())
+
+
+def normalized_variance(image: np.ndarray) -> float:
+    """
+    Variance divided by the mean intensity: robust to changes of
+    illumination between frames.
+    """
+    mean = float(image.mean())
+    if mean == 0:
+        return 0.0
+    return float(image.var()) / mean
+
+
+focus_metrics = {
+    "laplacian": variance_of_laplacian,
+    "brenner": brenner_gradient,
+    "normalized_variance": normalized_variance,
+}
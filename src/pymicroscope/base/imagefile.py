@@ -0,0 +1,52 @@
+"""
+Saving frames without loss of depth.
+
+8-bit mono and RGB frames are saved as they are. Mono frames of higher
+depth are saved in the matching Pillow mode: 16-bit integers ('I;16'),
+32-bit integers ('I') or 32-bit floating point ('F'). Pillow has no mode
+for RGB of more than 8 bits: such frames are saved with one page per
+channel, which requires a multipage format (TIFF).
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+
+import numpy as np
+from PIL import Image as PILImage
+
+
+def pil_image_for_plane(plane: np.ndarray) -> PILImage.Image:
+    if plane.dtype in (np.uint8, np.uint16):
+        return PILImage.fromarray(np.ascontiguousarray(plane))
+    if plane.dtype == np.bool_:
+        return PILImage.fromarray(plane.astype(np.uint8))
+    if plane.dtype.kind in "ui":
+        return PILImage.fromarray(plane.astype(np.int32), mode="I")
+    return PILImage.fromarray(plane.astype(np.float32), mode="F")
+
+
+def pil_images_for_file(img_array: np.ndarray) -> list:
+    """
+    The pages to save for the frame: a single page when Pillow has a mode
+    for it, otherwise one page per channel.
+    """
+    if img_array.ndim == 2:
+        return [pil_image_for_plane(img_array)]
+    if img_array.shape[2] == 1:
+        return [pil_image_for_plane(img_array[:, :, 0])]
+    if img_array.dtype == np.uint8 and img_array.shape[2] in (3, 4):
+        mode = "RGB" if img_array.shape[2] == 3 else "RGBA"
+        return [PILImage.fromarray(np.ascontiguousarray(img_array), mode=mode)]
+    return [
+        pil_image_for_plane(img_array[:, :, channel])
+        for channel in range(img_array.shape[2])
+    ]
+
+
+def save_image(img_array: np.ndarray, filepath):
+    pages = pil_images_for_file(np.asarray(img_array))
+    if len(pages) == 1:
+        pages[0].save(Path(filepath))
+    else:
+        pages[0].save(Path(filepath), save_all=True, append_images=pages[1:])
@@ -1,15 +1,19 @@
 import math
 from typing import Tuple, Optional
 
+import numpy as np
 from mytk import Bindable
 
+from pymicroscope.base.focusmap import FocusMap
+
 
 class MapController(Bindable):
     """Controls tiled image acquisition over a sample area.
 
     Manages four corner positions that define the sample region, and generates
     a grid of (x, y, z) capture positions with configurable overlap for
-    stitched imaging and Z-stack acquisition.
+    stitched imaging and Z-stack acquisition. The sample region may be rotated
+    or skewed: all four corners are used.
 
     Coordinates are in microsteps. Use microstep_pixel to convert between
     pixel dimensions and physical stage positions.
@@ -18,6 +22,18 @@ class MapController(Bindable):
         device: The motion device used for positioning (e.g., SutterDevice).
     """
 
+    position_dtype = np.dtype(
+        [
+            ("x", np.float64),
+            ("y", np.float64),
+            ("z", np.float64),
+            ("tile_ix", np.int32),
+            ("tile_iy", np.int32),
+            ("tile_iz", np.int32),
+        ]
+    )
+    traversals = ("raster", "serpentine")
+
     def __init__(self, device, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.device = device
@@ -28,6 +44,7 @@ class MapController(Bindable):
         self.x_dimension = 1000
         self.y_dimension = 500
         self.overlap_fraction = 0.1
+        self.focus_map: Optional[FocusMap] = None
 
         self.parameters: dict[str, Optional[Tuple[float, float, float]]] = {
             "Upper left corner": None,
@@ -41,7 +58,7 @@ class MapController(Bindable):
         """True if all four corner positions have been defined."""
         return all(v is not None for v in self.parameters.values())
 
-    def create_positions_for_map(self) -> list[Tuple[float, float, float]]:
+    def create_positions_for_map(self, traversal: str = "raster") -> list[Tuple[float, float, float]]:
         """Generate a list of (x, y, z) capture positions covering the sample area.
 
         If all four corners are set, the grid spans the region defined by the
@@ -51,42 +68,236 @@ class MapController(Bindable):
         The overlap between adjacent images is controlled by overlap_fraction
         (default 0.1 = 10% overlap).
 
+        If a focus_map with focus points is set, the z-stack of every tile is
+        centered on the focus surface at the center of the tile instead of
+        starting at 0, so that fewer planes are needed on tilted or wavy
+        samples.
+
+        This is create_position_grid() as a list of tuples. Prefer the grid
+        for large maps.
+
         Returns:
             List of (x, y, z) tuples in microstep coordinates.
 
+        Raises:
+            ValueError: If microstep_pixel is zero or negative.
+        """
+        grid = self.create_position_grid(traversal=traversal)
+        return list(zip(grid["x"].tolist(), grid["y"].tolist(), grid["z"].tolist()))
+
+    def create_position_grid(self, traversal: str = "raster") -> np.ndarray:
+        """Generate the capture positions as a structured array.
+
+        The array has one record per tile with fields x, y, z (microsteps)
+        and the tile indices tile_ix, tile_iy, tile_iz. It is computed with
+        NumPy broadcasting, without a Python loop over the tiles.
+
+        When the four corners do not form an axis-aligned rectangle (rotated
+        or skewed sample), the tiles follow the quadrilateral: the grid is
+        mapped bilinearly from the lower left corner along the lower and
+        upper edges and along the left and right edges.
+
+        Args:
+            traversal: Order of the tiles, see reorder_grid().
+
+        Returns:
+            Structured array of dtype position_dtype.
+
         Raises:
             ValueError: If microstep_pixel is zero or negative.
         """
         if self.microstep_pixel <= 0:
             raise ValueError(f"microstep_pixel must be positive, got {self.microstep_pixel}")
 
-        positions_list = []
         step_factor = 1.0 - self.overlap_fraction
 
         x_image_dimension = self.x_dimension * self.microstep_pixel
         y_image_dimension = self.y_dimension * self.microstep_pixel
         z_image_dimension = self.z_range * self.microstep_pixel
 
-        if self.corners_are_set:
-            upper_left = self.parameters["Upper left corner"]
-            upper_right = self.parameters["Upper right corner"]
-            lower_right = self.parameters["Lower right corner"]
-
-            x_span = upper_right[0] - upper_left[0]
-            y_span = upper_right[1] - lower_right[1]
-
-            number_of_x_images = max(1, math.ceil(x_span / (step_factor * x_image_dimension)))
-            number_of_y_images = max(1, math.ceil(y_span / (step_factor * y_image_dimension)))
-        else:
-            number_of_x_images = 1
-            number_of_y_images = 1
-
-        for z in range(self.z_image_number):
-            z_position = z * z_image_dimension
-            for y in range(number_of_y_images):
-                y_position = y * y_image_dimension * step_factor
-                for x in range(number_of_x_images):
-                    x_position = x * x_image_dimension * step_factor
-                    positions_list.append((x_position, y_position, z_position))
-
-        return positions_list
+        number_of_x_images, number_of_y_images = self.number_of_images()
+        number_of_z_images = self.z_image_number
+
+        tile_iz, tile_iy, tile_ix = np.meshgrid(
+            np.arange(number_of_z_images),
+            np.arange(number_of_y_images),
+            np.arange(number_of_x_images),
+            indexing="ij",
+        )
+
+        grid = np.empty(tile_ix.size, dtype=self.position_dtype)
+        grid["tile_ix"] = tile_ix.ravel()
+        grid["tile_iy"] = tile_iy.ravel()
+        grid["tile_iz"] = tile_iz.ravel()
+
+        x, y = self.map_to_stage(
+            grid["tile_ix"] * x_image_dimension * step_factor,
+            grid["tile_iy"] * y_image_dimension * step_factor,
+        )
+        grid["x"] = x
+        grid["y"] = y
+        grid["z"] = grid["tile_iz"] * z_image_dimension
+
+        if self.focus_map is not None and len(self.focus_map) > 0:
+            # Planes centered on the focus surface, at the center of each
+            # tile. The focus points are in stage coordinates.
+            origin_x, origin_y = self.stage_origin()
+            grid["z"] -= (number_of_z_images - 1) / 2 * z_image_dimension
+            grid["z"] += self.focus_map.z_at(
+                origin_x + grid["x"] + x_image_dimension / 2,
+                origin_y + grid["y"] + y_image_dimension / 2,
+            )
+
+        return self.reorder_grid(grid, traversal)
+
+    @classmethod
+    def reorder_grid(cls, grid: np.ndarray, traversal: str = "raster") -> np.ndarray:
+        """Reorder a position grid for acquisition.
+
+        'raster' scans every row in the same direction, one z plane after
+        the other. 'serpentine' reverses every other row (and every other
+        plane) so that the stage never travels back across the whole map.
+
+        Args:
+            grid: Structured array from create_position_grid().
+            traversal: 'raster' or 'serpentine'.
+
+        Returns:
+            The reordered structured array.
+        """
+        if traversal not in cls.traversals:
+            raise ValueError(f"traversal must be one of {cls.traversals}, got {traversal}")
+
+        tile_ix, tile_iy, tile_iz = grid["tile_ix"], grid["tile_iy"], grid["tile_iz"]
+        if traversal == "serpentine":
+            y_reversed = tile_iz % 2 == 1
+            tile_iy = np.where(y_reversed, tile_iy.max(initial=0) - tile_iy, tile_iy)
+            x_reversed = tile_iy % 2 == 1
+            tile_ix = np.where(x_reversed, tile_ix.max(initial=0) - tile_ix, tile_ix)
+
+        return grid[np.lexsort((tile_ix, tile_iy, tile_iz))]
+
+    def corner_xy(self) -> Optional[np.ndarray]:
+        """The (x, y) of the lower left, lower right, upper left and upper
+        right corners, or None if they are not all set."""
+        if not self.corners_are_set:
+            return None
+
+        return np.array(
+            [
+                self.parameters[corner][:2]
+                for corner in (
+                    "Lower left corner",
+                    "Lower right corner",
+                    "Upper left corner",
+                    "Upper right corner",
+                )
+            ],
+            dtype=float,
+        )
+
+    def stage_origin(self) -> Tuple[float, float]:
+        """Stage (x, y) of the lower left corner, from which the grid
+        positions are measured: (0, 0) if the corners are not set."""
+        corners = self.corner_xy()
+        if corners is None:
+            return 0.0, 0.0
+        return float(corners[0][0]), float(corners[0][1])
+
+    def map_lengths(self) -> Tuple[float, float]:
+        """Lengths of the sample area along its x edges (lower and upper) and
+        its y edges (left and right), taking the longest of each pair."""
+        corners = self.corner_xy()
+        if corners is None:
+            return 0.0, 0.0
+
+        lower_left, lower_right, upper_left, upper_right = corners
+        x_length = max(
+            np.linalg.norm(lower_right - lower_left),
+            np.linalg.norm(upper_right - upper_left),
+        )
+        y_length = max(
+            np.linalg.norm(upper_left - lower_left),
+            np.linalg.norm(upper_right - lower_right),
+        )
+        return float(x_length), float(y_length)
+
+    def map_to_stage(self, distance_x, distance_y) -> Tuple[np.ndarray, np.ndarray]:
+        """Convert distances along the edges of the sample area to stage (x, y)
+        relative to the lower left corner.
+
+        For an axis-aligned rectangle this is the identity. Otherwise the
+        four corners define a bilinear mapping, so rotated and skewed areas
+        are covered.
+        """
+        distance_x = np.asarray(distance_x, dtype=float)
+        distance_y = np.asarray(distance_y, dtype=float)
+
+        corners = self.corner_xy()
+        x_length, y_length = self.map_lengths()
+        if corners is None or x_length == 0 or y_length == 0:
+            return distance_x, distance_y
+
+        lower_left, lower_right, upper_left, upper_right = corners
+        s = (distance_x / x_length)[..., np.newaxis]
+        t = (distance_y / y_length)[..., np.newaxis]
+        xy = (1 - t) * ((1 - s) * lower_left + s * lower_right) + t * (
+            (1 - s) * upper_left + s * upper_right
+        )
+        xy -= lower_left
+        return xy[..., 0], xy[..., 1]
+
+    def number_of_images(self) -> Tuple[int, int]:
+        """Number of tiles along x and y needed to cover the sample area."""
+        if not self.corners_are_set:
+            return 1, 1
+
+        step_factor = 1.0 - self.overlap_fraction
+        x_image_dimension = self.x_dimension * self.microstep_pixel
+        y_image_dimension = self.y_dimension * self.microstep_pixel
+
+        x_length, y_length = self.map_lengths()
+
+        number_of_x_images = max(1, math.ceil(x_length / (step_factor * x_image_dimension)))
+        number_of_y_images = max(1, math.ceil(y_length / (step_factor * y_image_dimension)))
+        return number_of_x_images, number_of_y_images
+
+    def focus_sample_positions(self, points_per_side: int = 3) -> list[Tuple[float, float]]:
+        """Generate a sparse grid of (x, y) positions where to measure focus.
+
+        The points span the centers of the map tiles, so that the focus map
+        interpolates rather than extrapolates. A plane needs 3 points, a
+        thin-plate spline on a wavy sample typically 9 to 25.
+
+        Unlike the grid positions, the points are stage coordinates (not
+        relative to the lower left corner), like the focus points recorded
+        from the position of the stage.
+
+        Args:
+            points_per_side: Number of points along x and along y.
+
+        Returns:
+            List of (x, y) tuples in microstep coordinates.
+        """
+        step_factor = 1.0 - self.overlap_fraction
+        x_image_dimension = self.x_dimension * self.microstep_pixel
+        y_image_dimension = self.y_dimension * self.microstep_pixel
+        number_of_x_images, number_of_y_images = self.number_of_images()
+
+        x_last = (number_of_x_images - 1) * x_image_dimension * step_factor
+        y_last = (number_of_y_images - 1) * y_image_dimension * step_factor
+
+        distance_y, distance_x = np.meshgrid(
+            np.linspace(0, y_last, min(points_per_side, number_of_y_images)),
+            np.linspace(0, x_last, min(points_per_side, number_of_x_images)),
+            indexing="ij",
+        )
+        x, y = self.map_to_stage(distance_x.ravel(), distance_y.ravel())
+        origin_x, origin_y = self.stage_origin()
+
+        return list(
+            zip(
+                (origin_x + x + x_image_dimension / 2).tolist(),
+                (origin_y + y + y_image_dimension / 2).tolist(),
+            )
+        )
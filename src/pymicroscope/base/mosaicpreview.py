@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+import math
+from threading import Lock
+
+import numpy as np
+from mytk import Window, Image
+from PIL import Image as PILImage, ImageTk
+
+from pymicroscope.base.display import DisplayMapping
+from pymicroscope.utils.thread_utils import is_main_thread
+
+
+class MosaicCanvas:
+    """
+    A preallocated, downsampled image of a whole map. Tiles are placed at
+    their position (in full resolution pixels) by keeping one pixel out of
+    'step' in each direction, and only the region covered by the tile is
+    written.
+
+    Args:
+        shape: (height, width) of the map in full resolution pixels.
+        step: Downsampling factor of the canvas.
+        channels: Number of channels of the tiles.
+        mapping: DisplayMapping of the tiles that are not 8-bit (the full
+            range of their dtype by default). It must not use
+            auto-contrast, so that all tiles are mapped alike.
+    """
+
+    def __init__(
+        self,
+        shape,
+        step: int = 1,
+        channels: int = 3,
+        mapping: DisplayMapping = None,
+        *args,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.step = max(1, int(step))
+        self.channels = channels
+        self.mapping = mapping
+        if mapping is None:
+            self.mapping = DisplayMapping()
+        self.array = np.zeros(
+            (
+                math.ceil(shape[0] / self.step),
+                math.ceil(shape[1] / self.step),
+                channels,
+            ),
+            dtype=np.uint8,
+        )
+
+    @classmethod
+    def for_positions(
+        cls,
+        positions,
+        tile_shape,
+        max_size: int = 800,
+        channels: int = 3,
+        mapping: DisplayMapping = None,
+    ) -> MosaicCanvas:
+        """
+        A canvas large enough for tiles of 'tile_shape' at every (top, left)
+        position, and no larger than max_size pixels on its largest side.
+        """
+        positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+        height = int(math.ceil(positions[:, 0].max())) + tile_shape[0]
+        width = int(math.ceil(positions[:, 1].max())) + tile_shape[1]
+        step = math.ceil(max(height, width) / max_size)
+        return cls(
+            (height, width), step=step, channels=channels, mapping=mapping
+        )
+
+    def place_tile(self, image: np.ndarray, top, left) -> tuple | None:
+        """
+        Write the image with its upper left corner at (top, left) in full
+        resolution pixels. Returns the changed region (top, left, bottom,
+        right) in canvas pixels, or None if the tile is outside the canvas.
+        """
+        image = np.asarray(image)
+        if image.ndim == 2:
+            image = image[:, :, np.newaxis]
+        top, left = int(round(top)), int(round(left))
+
+        # First canvas pixel inside the tile, and the tile pixel it samples
+        canvas_top = max(0, -(-top // self.step))
+        canvas_left = max(0, -(-left // self.step))
+        row0 = canvas_top * self.step - top
+        column0 = canvas_left * self.step - left
+
+        sampled = image[row0 :: self.step, column0 :: self.step]
+        canvas_bottom = min(self.array.shape[0], canvas_top + sampled.shape[0])
+        canvas_right = min(self.array.shape[1], canvas_left + sampled.shape[1])
+        if canvas_bottom <= canvas_top or canvas_right <= canvas_left:
+            return None
+
+        sampled = sampled[
+            : canvas_bottom - canvas_top, : canvas_right - canvas_left
+        ]
+        if sampled.dtype != np.uint8:
+            sampled = self.mapping.to_display(sampled)
+        if sampled.shape[2] == 1 and self.channels > 1:
+            sampled = np.repeat(sampled, self.channels, axis=2)
+
+        self.array[canvas_top:canvas_bottom, canvas_left:canvas_right] = (
+            sampled[:, :, : self.channels]
+        )
+        return (canvas_top, canvas_left, canvas_bottom, canvas_right)
+
+
+class MosaicPreview:
+    """
+    A window that shows the tiles of a map as they are acquired.
+
+    add_tile() can be called from the experiment thread: it only writes the
+    downsampled tile in the canvas and remembers the changed region. The
+    main thread calls refresh() periodically, which copies only the changed
+    regions to the displayed image, so that the acquisition is never
+    slowed down by the display and the whole mosaic is never redrawn.
+    """
+
+    def __init__(self, canvas: MosaicCanvas, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.canvas = canvas
+        self._lock = Lock()
+        self._pending_regions = []
+
+        height, width = canvas.array.shape[:2]
+        self.window = Window(
+            title="Map preview",
+            geometry=f"{width + 20}x{height + 20}+100+0",
+        )
+        pil_image = PILImage.fromarray(self.canvas_as_rgb(), mode="RGB")
+        self.image = Image(pil_image=pil_image)
+        self.image.grid_into(self.window, row=0, column=0, padx=10, pady=10)
+
+        self.photo_image = ImageTk.PhotoImage(image=pil_image)
+        self.image.widget.configure(image=self.photo_image)
+
+    def canvas_as_rgb(self, region=None) -> np.ndarray:
+        array = self.canvas.array
+        if region is not None:
+            top, left, bottom, right = region
+            array = array[top:bottom, left:right]
+
+        if array.shape[2] == 1:
+            return np.repeat(array, 3, axis=2)
+        return np.ascontiguousarray(array[:, :, :3])
+
+    def add_tile(self, image: np.ndarray, top, left):
+        region = self.canvas.place_tile(image, top, left)
+        if region is not None:
+            with self._lock:
+                self._pending_regions.append(region)
+
+    def refresh(self):
+        assert is_main_thread()
+
+        with self._lock:
+            regions = self._pending_regions
+            self._pending_regions = []
+
+        for region in regions:
+            top, left, _, _ = region
+            region_image = ImageTk.PhotoImage(
+                image=PILImage.fromarray(
+                    self.canvas_as_rgb(region), mode="RGB"
+                )
+            )
+            # Tk copies only the region into the displayed image
+            self.photo_image.tk.call(
+                str(self.photo_image),
+                "copy",
+                str(region_image),
+                "-to",
+                left,
+                top,
+            )
@@ -0,0 +1,326 @@
+"""
+Multiresolution pyramid of a mosaic, stored as chunks on disk.
+
+A pyramid is a directory with a 'pyramid.json' description and one
+sub-directory per level. Level 0 is full resolution and every level above
+is downsampled 2x from the one below. Each level is split in square chunks
+of chunk_size pixels saved as individual .npy files ('level-2/3_5.npy' is
+the chunk at row 3, column 5 of level 2). Chunks that were never written
+are empty (fill value).
+
+PyramidBuilder adds the tiles as they are acquired: it writes the level-0
+chunks they touch and recomputes only their parent chunks, up to the level
+that fits in a single chunk. When the mosaic grows enough to need new
+levels, these levels are built from all the chunks already written. PyramidReader reads only the chunks of the
+level appropriate for the zoom and for the visible region, so that browsing
+a very large mosaic never needs more than a screenful of data in memory.
+"""
+
+from __future__ import annotations
+
+import json
+import math
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+
+class PyramidBuilder:
+    """
+    Builds a pyramid incrementally, one tile at a time.
+
+    Args:
+        directory: Destination directory of the pyramid.
+        channels: Number of channels of the tiles.
+        dtype: Type of the tiles.
+        chunk_size: Size of the square chunks, in pixels.
+        fill_value: Value of the regions where no tile was added.
+    """
+
+    description_filename = "pyramid.json"
+
+    def __init__(
+        self,
+        directory,
+        channels: int = 3,
+        dtype=np.uint8,
+        chunk_size: int = 256,
+        fill_value=0,
+        *args,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.directory = Path(directory).expanduser()
+        self.channels = channels
+        self.dtype = np.dtype(dtype)
+        self.chunk_size = chunk_size
+        self.fill_value = fill_value
+        self.shape = (0, 0)
+
+        # An existing pyramid keeps growing (e.g. a map resumed after a
+        # crash): its chunks are already on disk.
+        filepath = self.directory / self.description_filename
+        if filepath.exists():
+            description = json.loads(filepath.read_text())
+            if (
+                description["channels"] != self.channels
+                or np.dtype(description["dtype"]) != self.dtype
+                or description["chunk_size"] != self.chunk_size
+            ):
+                raise ValueError(
+                    f"{self.directory} contains an incompatible pyramid"
+                )
+            self.shape = tuple(description["shape"])
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.write_description()
+
+    @property
+    def levels(self) -> int:
+        """
+        Number of levels so that the top level fits in a single chunk.
+        """
+        extent = max(self.shape[0], self.shape[1], 1)
+        return max(1, math.ceil(math.log2(extent / self.chunk_size)) + 1)
+
+    def write_description(self):
+        description = {
+            "shape": list(self.shape),
+            "channels": self.channels,
+            "dtype": self.dtype.str,
+            "chunk_size": self.chunk_size,
+            "fill_value": self.fill_value,
+            "levels": self.levels,
+        }
+        filepath = self.directory / self.description_filename
+        filepath.write_text(json.dumps(description, indent=2))
+
+    def chunk_path(self, level, row, column) -> Path:
+        return self.directory / f"level-{level}" / f"{row}_{column}.npy"
+
+    def empty_chunk(self) -> np.ndarray:
+        return np.full(
+            (self.chunk_size, self.chunk_size, self.channels),
+            self.fill_value,
+            dtype=self.dtype,
+        )
+
+    def read_chunk(self, level, row, column) -> np.ndarray:
+        filepath = self.chunk_path(level, row, column)
+        if filepath.exists():
+            return np.load(filepath)
+        return self.empty_chunk()
+
+    def write_chunk(self, level, row, column, chunk):
+        filepath = self.chunk_path(level, row, column)
+        filepath.parent.mkdir(parents=True, exist_ok=True)
+        np.save(filepath, chunk)
+
+    def written_chunks(self, level) -> set:
+        """
+        (row, column) of the chunks of a level that are on disk.
+        """
+        chunks = set()
+        for filepath in (self.directory / f"level-{level}").glob("*.npy"):
+            row, column = filepath.stem.split("_")
+            chunks.add((int(row), int(column)))
+        return chunks
+
+    def add_tile(self, image: np.ndarray, top: int, left: int):
+        """
+        Place the image with its upper left corner at (top, left) in
+        level-0 pixels and update the levels above.
+        """
+        image = np.asarray(image)
+        if image.ndim == 2:
+            image = image[:, :, np.newaxis]
+        if image.shape[2] != self.channels:
+            raise ValueError(
+                f"Tile has {image.shape[2]} channels, pyramid has {self.channels}"
+            )
+        top, left = int(round(top)), int(round(left))
+        if top < 0 or left < 0:
+            raise ValueError(
+                f"Tile position must be positive, got {(top, left)}"
+            )
+
+        height, width = image.shape[:2]
+        previous_levels = self.levels
+        self.shape = (
+            max(self.shape[0], top + height),
+            max(self.shape[1], left + width),
+        )
+
+        size = self.chunk_size
+        dirty = set()
+        for row in range(top // size, (top + height - 1) // size + 1):
+            for column in range(left // size, (left + width - 1) // size + 1):
+                r0 = max(top, row * size)
+                r1 = min(top + height, (row + 1) * size)
+                c0 = max(left, column * size)
+                c1 = min(left + width, (column + 1) * size)
+
+                chunk = self.read_chunk(0, row, column)
+                chunk[
+                    r0 - row * size : r1 - row * size,
+                    c0 - column * size : c1 - column * size,
+                ] = image[r0 - top : r1 - top, c0 - left : c1 - left]
+                self.write_chunk(0, row, column, chunk)
+                dirty.add((row, column))
+
+        for level in range(1, self.levels):
+            dirty = {(row // 2, column // 2) for row, column in dirty}
+            if level >= previous_levels:
+                # A new level: it must also cover the tiles added before
+                dirty = {
+                    (row // 2, column // 2)
+                    for row, column in self.written_chunks(level - 1)
+                }
+            for row, column in dirty:
+                self.write_chunk(
+                    level,
+                    row,
+                    column,
+                    self.downsampled_chunk(level, row, column),
+                )
+
+        self.write_description()
+
+    def downsampled_chunk(self, level, row, column) -> np.ndarray:
+        """
+        Average the 2 x 2 chunks below (level - 1) into one chunk.
+        """
+        size = self.chunk_size
+        block = np.empty((2 * size, 2 * size, self.channels), dtype=np.float32)
+        for d_row in (0, 1):
+            for d_column in (0, 1):
+                block[
+                    d_row * size : (d_row + 1) * size,
+                    d_column * size : (d_column + 1) * size,
+                ] = self.read_chunk(
+                    level - 1, 2 * row + d_row, 2 * column + d_column
+                )
+
+        chunk = block.reshape(size, 2, size, 2, self.channels).mean(
+            axis=(1, 3)
+        )
+        if np.issubdtype(self.dtype, np.integer):
+            np.rint(chunk, out=chunk)
+        return chunk.astype(self.dtype)
+
+
+class PyramidReader:
+    """
+    Reads regions of a pyramid written by PyramidBuilder, loading only the
+    chunks that are needed. Recently used chunks are kept in a small cache.
+    """
+
+    def __init__(self, directory, cache_size: int = 64, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.directory = Path(directory).expanduser()
+        self.cache_size = cache_size
+        self._cache: OrderedDict = OrderedDict()
+        self.reload()
+
+    def reload(self):
+        """
+        Read the description again (the pyramid may still be growing).
+        """
+        filepath = self.directory / PyramidBuilder.description_filename
+        description = json.loads(filepath.read_text())
+        self.shape = tuple(description["shape"])
+        self.channels = description["channels"]
+        self.dtype = np.dtype(description["dtype"])
+        self.chunk_size = description["chunk_size"]
+        self.fill_value = description["fill_value"]
+        self.levels = description["levels"]
+        self._cache.clear()
+
+    def level_shape(self, level) -> tuple[int, int]:
+        return (
+            math.ceil(self.shape[0] / 2**level),
+            math.ceil(self.shape[1] / 2**level),
+        )
+
+    def level_for_zoom(self, zoom: float) -> int:
+        """
+        Coarsest level that still has at least one pixel per screen pixel,
+        for a zoom in screen pixels per level-0 pixel.
+        """
+        if zoom >= 1:
+            return 0
+        level = int(math.floor(math.log2(1 / zoom)))
+        return min(level, self.levels - 1)
+
+    def chunk(self, level, row, column) -> np.ndarray:
+        key = (level, row, column)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        filepath = self.directory / f"level-{level}" / f"{row}_{column}.npy"
+        if filepath.exists():
+            chunk = np.load(filepath)
+        else:
+            chunk = np.full(
+                (self.chunk_size, self.chunk_size, self.channels),
+                self.fill_value,
+                dtype=self.dtype,
+            )
+
+        self._cache[key] = chunk
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return chunk
+
+    def read_region(self, level, top, left, height, width) -> np.ndarray:
+        """
+        Region of a level, in pixels of that level. Outside the mosaic, the
+        region is filled with the fill value.
+        """
+        region = np.full(
+            (height, width, self.channels), self.fill_value, dtype=self.dtype
+        )
+        size = self.chunk_size
+        bottom, right = top + height, left + width
+        first_row, first_column = max(top, 0) // size, max(left, 0) // size
+        for row in range(first_row, max(bottom - 1, 0) // size + 1):
+            for column in range(first_column, max(right - 1, 0) // size + 1):
+                r0 = max(top, row * size)
+                r1 = min(bottom, (row + 1) * size)
+                c0 = max(left, column * size)
+                c1 = min(right, (column + 1) * size)
+                if r1 <= r0 or c1 <= c0:
+                    continue
+                region[
+                    r0 - top : r1 - top, c0 - left : c1 - left
+                ] = self.chunk(level, row, column)[
+                    r0 - row * size : r1 - row * size,
+                    c0 - column * size : c1 - column * size,
+                ]
+        return region
+
+    def read_view(self, center, zoom: float, view_shape) -> np.ndarray:
+        """
+        The view_shape (height, width) image centered on 'center' (row,
+        column in level-0 pixels) at 'zoom' screen pixels per level-0 pixel.
+        """
+        level = self.level_for_zoom(zoom)
+        scale = zoom * 2**level  # screen pixels per pixel of the level
+        view_height, view_width = view_shape
+
+        height = max(1, math.ceil(view_height / scale))
+        width = max(1, math.ceil(view_width / scale))
+        top = int(round(center[0] / 2**level - height / 2))
+        left = int(round(center[1] / 2**level - width / 2))
+        region = self.read_region(level, top, left, height, width)
+
+        rows = np.minimum(
+            (np.arange(view_height) / scale).astype(int), height - 1
+        )
+        columns = np.minimum(
+            (np.arange(view_width) / scale).astype(int), width - 1
+        )
+        return region[rows[:, np.newaxis], columns[np.newaxis, :]]
@@ -0,0 +1,97 @@
+from mytk import Window, Image, Button
+from PIL import Image as PILImage
+from pathlib import Path
+import numpy as np
+
+from pymicroscope.base.pyramid import PyramidReader
+from pymicroscope.base.display import pil_image_for_display
+from pymicroscope.utils.thread_utils import is_main_thread
+
+
+class PyramidViewer:
+    """
+    A window to browse a mosaic pyramid. Only the chunks of the level that
+    matches the zoom and that are visible are read from disk.
+    """
+
+    def __init__(
+        self, directory: Path, view_shape=(600, 800), *args, **kwargs
+    ):
+        super().__init__(*args, **kwargs)
+        self.reader = PyramidReader(directory)
+        self.view_shape = view_shape
+
+        self.center = (self.reader.shape[0] / 2, self.reader.shape[1] / 2)
+        self.zoom = self.zoom_to_fit()
+
+        self.window = Window(
+            title=f"Map {Path(directory).name}", geometry="850x720+100+0"
+        )
+
+        array = np.zeros(view_shape + (3,), dtype=np.uint8)
+        self.image = Image(pil_image=PILImage.fromarray(array, mode="RGB"))
+        self.image.grid_into(
+            self.window, row=0, column=0, columnspan=7, padx=10, pady=10
+        )
+
+        buttons = [
+            ("Zoom in", self.user_clicked_zoom_in),
+            ("Zoom out", self.user_clicked_zoom_out),
+            ("←", self.user_clicked_left),
+            ("→", self.user_clicked_right),
+            ("↑", self.user_clicked_up),
+            ("↓", self.user_clicked_down),
+            ("Reload", self.user_clicked_reload),
+        ]
+        for column, (label, callback) in enumerate(buttons):
+            Button(label, user_event_callback=callback).grid_into(
+                self.window, row=1, column=column, padx=5, pady=5
+            )
+
+        self.update_view()
+
+    def zoom_to_fit(self) -> float:
+        height, width = self.reader.shape
+        if height == 0 or width == 0:
+            return 1.0
+        return min(
+            self.view_shape[0] / height, self.view_shape[1] / width, 1.0
+        )
+
+    def update_view(self):
+        assert is_main_thread()
+
+        array = self.reader.read_view(self.center, self.zoom, self.view_shape)
+        self.image.update_display(pil_image_for_display(array))
+
+    def pan(self, d_row, d_column):
+        # Pan by half a screen
+        self.center = (
+            self.center[0] + d_row * self.view_shape[0] / 2 / self.zoom,
+            self.center[1] + d_column * self.view_shape[1] / 2 / self.zoom,
+        )
+        self.update_view()
+
+    def user_clicked_zoom_in(self, event, button):
+        self.zoom *= 2
+        self.update_view()
+
+    def user_clicked_zoom_out(self, event, button):
+        self.zoom /= 2
+        self.update_view()
+
+    def user_clicked_left(self, event, button):
+        self.pan(0, -1)
+
+    def user_clicked_right(self, event, button):
+        self.pan(0, 1)
+
+    def user_clicked_up(self, event, button):
+        self.pan(-1, 0)
+
+    def user_clicked_down(self, event, button):
+        self.pan(1, 0)
+
+    def user_clicked_reload(self, event, button):
+        self.reader.reload()
+        self.update_view()
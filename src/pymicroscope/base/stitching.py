@@ -0,0 +1,469 @@
+"""
+Reconstruction of a mosaic from the tiles acquired by a MapController.
+
+The stage positions from MapController.create_positions_for_map() are only
+approximately right (backlash, calibration of microstep_pixel, drift), so
+the tiles are registered before blending:
+
+1. Every pair of adjacent tiles (tiles whose prior footprints overlap) is
+   registered with FFT phase correlation restricted to their overlap
+   region. Pairs are registered in a process pool, and a worker only loads
+   the two tiles of its pair.
+2. A global least-squares problem finds the tile positions that best agree
+   with all the pairwise offsets, regularized towards the stage positions.
+   It is solved with conjugate gradients on the tile graph, so memory is
+   proportional to the number of tiles and pairs.
+3. The tiles are blended with linear feathering into a mosaic written
+   chunk by chunk into a memory-mapped .npy file. Only the tiles touching
+   the current chunk are in memory, so the mosaic can be larger than RAM.
+
+Tiles are given as NumPy arrays or as file paths (.npy or any image format
+PIL can read). Paths are strongly recommended for large maps.
+"""
+
+from __future__ import annotations
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Optional, Union
+
+import numpy as np
+from PIL import Image as PILImage
+
+Tile = Union[np.ndarray, str, Path]
+
+
+def load_tile(tile: Tile) -> np.ndarray:
+    """
+    Return the tile as an array of shape (height, width, channels).
+    .npy files are memory-mapped, not read.
+    """
+    if isinstance(tile, np.ndarray):
+        array = tile
+    elif Path(tile).suffix == ".npy":
+        array = np.load(tile, mmap_mode="r")
+    else:
+        with PILImage.open(tile) as pil_image:
+            array = np.asarray(pil_image)
+
+    if array.ndim == 2:
+        array = array[:, :, np.newaxis]
+    return array
+
+
+def tile_shape(tile: Tile) -> tuple[int, int, int]:
+    if isinstance(tile, np.ndarray) or Path(tile).suffix == ".npy":
+        return load_tile(tile).shape
+
+    with PILImage.open(tile) as pil_image:
+        width, height = pil_image.size
+        channels = len(pil_image.getbands())
+    return (height, width, channels)
+
+
+def phase_correlation(
+    reference: np.ndarray, moving: np.ndarray
+) -> tuple[np.ndarray, float]:
+    """
+    Find the shift e (rows, columns) such that moving(u) ~ reference(u + e).
+
+    Both images are 2D and of the same shape. A Hann window limits the
+    edge effects of the FFT, and the peak is refined to sub-pixel precision
+    with a parabola on each axis.
+
+    Returns:
+        (shift, peak): the shift as a float array [d_row, d_column] and the
+        height of the normalized correlation peak (1 is a perfect match, ~0
+        means no correlation).
+    """
+    height, width = reference.shape
+    window = np.outer(np.hanning(height), np.hanning(width)).astype(np.float32)
+
+    a = (reference - reference.mean()) * window
+    b = (moving - moving.mean()) * window
+
+    cross_power = np.fft.rfft2(a) * np.conj(np.fft.rfft2(b))
+    cross_power /= np.abs(cross_power) + 1e-12
+    correlation = np.fft.irfft2(cross_power, s=(height, width))
+
+    peak_index = np.unravel_index(np.argmax(correlation), correlation.shape)
+    peak = float(correlation[peak_index])
+
+    shift = np.array(peak_index, dtype=float)
+    for axis, size in enumerate((height, width)):
+        before = list(peak_index)
+        after = list(peak_index)
+        before[axis] = (peak_index[axis] - 1) % size
+        after[axis] = (peak_index[axis] + 1) % size
+        c_before, c_after = (
+            correlation[tuple(before)],
+            correlation[tuple(after)],
+        )
+        denominator = c_before - 2 * peak + c_after
+        if denominator != 0:
+            shift[axis] += 0.5 * (c_before - c_after) / denominator
+
+    # Shifts past half the size wrap around to negative values
+    sizes = np.array((height, width))
+    shift = np.where(shift > sizes / 2, shift - sizes, shift)
+    return shift, peak
+
+
+def overlap_slices(
+    offset, shape
+) -> Optional[tuple[tuple[slice, slice], tuple[slice, slice]]]:
+    """
+    Regions of two tiles of the same shape that overlap when the second is
+    at 'offset' (rows, columns) from the first, or None if they don't.
+    """
+    (d_row, d_column), (height, width) = np.round(offset).astype(int), shape
+    row_start, row_end = max(0, d_row), min(height, height + d_row)
+    column_start, column_end = max(0, d_column), min(width, width + d_column)
+    if row_end - row_start < 2 or column_end - column_start < 2:
+        return None
+
+    first = (slice(row_start, row_end), slice(column_start, column_end))
+    second = (
+        slice(row_start - d_row, row_end - d_row),
+        slice(column_start - d_column, column_end - d_column),
+    )
+    return first, second
+
+
+def register_tile_pair(task) -> tuple[int, int, np.ndarray, float]:
+    """
+    Measure the offset (rows, columns) of tile j relative to tile i.
+
+    This runs in a worker process: task is (i, j, tile_i, tile_j,
+    prior_offset) and only these two tiles are loaded.
+    """
+    i, j, tile_i, tile_j, prior_offset = task
+    image_i = load_tile(tile_i)
+    image_j = load_tile(tile_j)
+
+    slices = overlap_slices(prior_offset, image_i.shape[:2])
+    if slices is None:
+        return i, j, np.asarray(prior_offset, dtype=float), 0.0
+
+    region_i, region_j = slices
+    crop_i = np.asarray(image_i[region_i], dtype=np.float32).mean(axis=2)
+    crop_j = np.asarray(image_j[region_j], dtype=np.float32).mean(axis=2)
+
+    shift, peak = phase_correlation(crop_i, crop_j)
+    return i, j, np.asarray(prior_offset, dtype=float) + shift, peak
+
+
+class TileStitcher:
+    """
+    Registers and blends the tiles of one z plane of a map.
+
+    Args:
+        tiles: Arrays or file paths, one per tile, all of the same shape.
+        positions: Prior (x, y) position of each tile in pixels, e.g. the
+            stage positions of create_positions_for_map() divided by
+            microstep_pixel. Only the first two coordinates are used.
+        max_workers: Size of the process pool used to register the pairs.
+            0 registers in the current process.
+        min_correlation: Pairs with a weaker correlation peak are ignored
+            (featureless overlaps) and the prior is trusted instead.
+        prior_weight: Weight of the stage positions relative to a perfectly
+            correlated pair in the global optimization.
+    """
+
+    def __init__(
+        self,
+        tiles: list[Tile],
+        positions,
+        max_workers: Optional[int] = None,
+        min_correlation: float = 0.05,
+        prior_weight: float = 1e-3,
+        *args,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        if len(tiles) != len(positions):
+            raise ValueError(
+                f"{len(tiles)} tiles were given for {len(positions)} positions"
+            )
+        if len(tiles) == 0:
+            raise ValueError("No tiles to stitch")
+
+        self.tiles = list(tiles)
+        # Internally, positions are (row, column) = (y, x)
+        self.prior_positions = np.asarray(positions, dtype=float)[
+            :, 1::-1
+        ].copy()
+        self.tile_shape = tile_shape(self.tiles[0])
+        self.max_workers = max_workers
+        self.min_correlation = min_correlation
+        self.prior_weight = prior_weight
+
+        self.pairs: Optional[np.ndarray] = None
+        self.offsets: Optional[np.ndarray] = None
+        self.correlations: Optional[np.ndarray] = None
+        self.positions: Optional[np.ndarray] = None
+
+    @classmethod
+    def from_map_controller(
+        cls, map_controller, tiles, positions=None, plane=0, **kwargs
+    ) -> TileStitcher:
+        """
+        Use the stage positions of the map (in microsteps) as the prior. The
+        tiles must be the ones of a single z plane, in the order of the
+        positions: by default, the tiles of the map at z index 'plane'.
+        """
+        if positions is None:
+            grid = map_controller.create_position_grid()
+            grid = grid[grid["tile_iz"] == plane]
+            positions = np.stack([grid["x"], grid["y"]], axis=1)
+        positions = np.asarray(positions, dtype=float)[:, :2]
+        return cls(tiles, positions / map_controller.microstep_pixel, **kwargs)
+
+    def adjacent_pairs(self) -> np.ndarray:
+        """
+        Pairs (i, j), i < j, of tiles whose prior footprints overlap.
+
+        Tiles are binned in cells the size of a tile, so overlapping tiles
+        are in the same or in neighbouring cells: no N x N matrix is built.
+        """
+        size = np.array(self.tile_shape[:2], dtype=float)
+        cells = np.floor(self.prior_positions / size).astype(np.int64)
+        cells -= cells.min(axis=0) - 1
+        n_columns = cells[:, 1].max() + 2
+        keys = cells[:, 0] * n_columns + cells[:, 1]
+
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+
+        pairs = []
+        for d_row in (-1, 0, 1):
+            for d_column in (-1, 0, 1):
+                neighbour_keys = keys + d_row * n_columns + d_column
+                start = np.searchsorted(sorted_keys, neighbour_keys, "left")
+                end = np.searchsorted(sorted_keys, neighbour_keys, "right")
+                counts = end - start
+
+                i = np.repeat(np.arange(len(keys)), counts)
+                first = np.repeat(start - np.cumsum(counts) + counts, counts)
+                j = order[first + np.arange(counts.sum())]
+                pairs.append(np.stack([i, j], axis=1))
+
+        pairs = np.concatenate(pairs)
+        pairs = pairs[pairs[:, 0] < pairs[:, 1]]
+
+        delta = np.abs(
+            self.prior_positions[pairs[:, 1]]
+            - self.prior_positions[pairs[:, 0]]
+        )
+        overlaps = np.all(delta < size, axis=1)
+        return pairs[overlaps]
+
+    def register(self):
+        self.pairs = self.adjacent_pairs()
+        tasks = (
+            (
+                i,
+                j,
+                self.tiles[i],
+                self.tiles[j],
+                self.prior_positions[j] - self.prior_positions[i],
+            )
+            for i, j in self.pairs
+        )
+
+        if self.max_workers == 0:
+            results = list(map(register_tile_pair, tasks))
+        else:
+            with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+                results = list(
+                    executor.map(register_tile_pair, tasks, chunksize=8)
+                )
+
+        self.offsets = np.array([result[2] for result in results]).reshape(
+            -1, 2
+        )
+        self.correlations = np.array([result[3] for result in results])
+
+    def optimize(self, max_iterations: int = 1000, tolerance: float = 1e-6):
+        """
+        Minimize sum_pairs w |p_j - p_i - offset|^2 + prior_weight
+        sum_tiles |p - prior|^2 with conjugate gradients.
+        """
+        if self.pairs is None:
+            self.register()
+
+        n_tiles = len(self.tiles)
+        valid = self.correlations >= self.min_correlation
+        i, j = self.pairs[valid, 0], self.pairs[valid, 1]
+        offsets = self.offsets[valid]
+        weights = self.correlations[valid]
+
+        def apply_normal_matrix(positions):
+            differences = weights[:, np.newaxis] * (
+                positions[i] - positions[j]
+            )
+            result = self.prior_weight * positions
+            for axis in range(2):
+                result[:, axis] += np.bincount(
+                    i, differences[:, axis], n_tiles
+                )
+                result[:, axis] -= np.bincount(
+                    j, differences[:, axis], n_tiles
+                )
+            return result
+
+        rhs = self.prior_weight * self.prior_positions
+        weighted_offsets = weights[:, np.newaxis] * offsets
+        for axis in range(2):
+            rhs[:, axis] += np.bincount(j, weighted_offsets[:, axis], n_tiles)
+            rhs[:, axis] -= np.bincount(i, weighted_offsets[:, axis], n_tiles)
+
+        positions = self.prior_positions.copy()
+        residual = rhs - apply_normal_matrix(positions)
+        direction = residual.copy()
+        residual_norm = np.sum(residual * residual, axis=0)
+        rhs_norm = max(np.sum(rhs * rhs), 1e-12)
+
+        for _ in range(max_iterations):
+            if residual_norm.sum() <= tolerance**2 * rhs_norm:
+                break
+            product = apply_normal_matrix(direction)
+            alpha = residual_norm / np.maximum(
+                np.sum(direction * product, axis=0), 1e-30
+            )
+            positions += alpha * direction
+            residual -= alpha * product
+            new_residual_norm = np.sum(residual * residual, axis=0)
+            direction = (
+                residual
+                + (new_residual_norm / np.maximum(residual_norm, 1e-30))
+                * direction
+            )
+            residual_norm = new_residual_norm
+
+        self.positions = positions - positions.min(axis=0)
+        return self.positions
+
+    @property
+    def mosaic_shape(self) -> tuple[int, int, int]:
+        if self.positions is None:
+            self.optimize()
+        corners = np.round(self.positions).astype(int)
+        height, width, channels = self.tile_shape
+        return (
+            int(corners[:, 0].max()) + height,
+            int(corners[:, 1].max()) + width,
+            channels,
+        )
+
+    def feather_weights(self) -> np.ndarray:
+        height, width = self.tile_shape[:2]
+        rows = np.minimum(np.arange(1, height + 1), np.arange(height, 0, -1))
+        columns = np.minimum(np.arange(1, width + 1), np.arange(width, 0, -1))
+        return np.outer(rows, columns).astype(np.float32)[:, :, np.newaxis]
+
+    def blend(
+        self,
+        filepath=None,
+        chunk_size: int = 2048,
+        cache_size: int = 64,
+        dtype=None,
+    ) -> np.ndarray:
+        """
+        Blend the registered tiles into the mosaic, chunk by chunk.
+
+        If filepath is given, the mosaic is a memory-mapped .npy file and
+        only one chunk and the tiles that touch it are held in memory.
+        Otherwise it is returned as an in-memory array.
+        """
+        if self.positions is None:
+            self.optimize()
+
+        shape = self.mosaic_shape
+        if dtype is None:
+            dtype = load_tile(self.tiles[0]).dtype
+
+        if filepath is not None:
+            mosaic = np.lib.format.open_memmap(
+                Path(filepath).expanduser(),
+                mode="w+",
+                dtype=dtype,
+                shape=shape,
+            )
+        else:
+            mosaic = np.zeros(shape, dtype=dtype)
+
+        corners = np.round(self.positions).astype(int)
+        height, width = self.tile_shape[:2]
+        weights = self.feather_weights()
+        cache: OrderedDict[int, np.ndarray] = OrderedDict()
+
+        def cached_tile(index):
+            if index in cache:
+                cache.move_to_end(index)
+            else:
+                cache[index] = np.asarray(
+                    load_tile(self.tiles[index]), dtype=np.float32
+                )
+                if len(cache) > cache_size:
+                    cache.popitem(last=False)
+            return cache[index]
+
+        is_integer = np.issubdtype(np.dtype(dtype), np.integer)
+        for row in range(0, shape[0], chunk_size):
+            row_end = min(row + chunk_size, shape[0])
+            in_band = np.nonzero(
+                (corners[:, 0] < row_end) & (corners[:, 0] + height > row)
+            )[0]
+
+            for column in range(0, shape[1], chunk_size):
+                column_end = min(column + chunk_size, shape[1])
+                touching = in_band[
+                    (corners[in_band, 1] < column_end)
+                    & (corners[in_band, 1] + width > column)
+                ]
+
+                chunk_shape = (row_end - row, column_end - column, shape[2])
+                accumulated = np.zeros(chunk_shape, dtype=np.float32)
+                total_weight = np.zeros(
+                    chunk_shape[:2] + (1,), dtype=np.float32
+                )
+
+                for index in touching:
+                    top, left = corners[index]
+                    r0, r1 = max(row, top), min(row_end, top + height)
+                    c0, c1 = max(column, left), min(column_end, left + width)
+                    tile_region = (
+                        slice(r0 - top, r1 - top),
+                        slice(c0 - left, c1 - left),
+                    )
+                    chunk_region = (
+                        slice(r0 - row, r1 - row),
+                        slice(c0 - column, c1 - column),
+                    )
+
+                    accumulated[chunk_region] += (
+                        cached_tile(index)[tile_region] * weights[tile_region]
+                    )
+                    total_weight[chunk_region] += weights[tile_region]
+
+                np.divide(
+                    accumulated,
+                    total_weight,
+                    out=accumulated,
+                    where=total_weight > 0,
+                )
+                if is_integer:
+                    np.rint(accumulated, out=accumulated)
+                mosaic[row:row_end, column:column_end] = accumulated
+
+        if isinstance(mosaic, np.memmap):
+            mosaic.flush()
+
+        return mosaic
+
+    def stitch(self, filepath=None, **kwargs) -> np.ndarray:
+        self.register()
+        self.optimize()
+        return self.blend(filepath, **kwargs)
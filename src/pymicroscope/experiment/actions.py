@@ -10,27 +10,65 @@ import platform
 from enum import Enum
 from mytk.notificationcenter import NotificationCenter
 import os
-from contextlib import suppress
+from contextlib import suppress, contextmanager
 from multiprocessing import Queue
+from queue import Empty, Full, Queue as TQueue
+from concurrent import futures
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from hardwarelibrary.motion import LinearMotionDevice
-from PIL import Image as PILImage
 from datetime import datetime
-from threading import Thread
+from threading import Thread, Lock, get_ident
 from mytk.notificationcenter import NotificationCenter
 from pymicroscope.app_notifications import MicroscopeAppNotification
+from pymicroscope.base.focusmetrics import focus_metrics, region_of_interest
+from pymicroscope.base.imagefile import save_image
+from pymicroscope.acquisition.averaging import accumulator_dtype, mean_from_sum
+from pymicroscope.acquisition.flatfield import FlatFieldCalibration
+from pymicroscope.hardware import asyncmotion
+from pymicroscope.hardware.devicestate import device_lock
+from pymicroscope.experiment.cancellation import (
+    CancellationToken,
+    ActionCancelled,
+    ActionTimeout,
+)
 
 
 class Action:
-    def __init__(self, source=None, *args, **kwargs):
+    """
+    Base class of all the actions of an experiment.
+
+    An action may have a timeout (in seconds) and is given a
+    CancellationToken when performed. Long actions must not block
+    indefinitely: they use self.sleep() or poll self.check_cancellation()
+    so that a cancelled experiment stops within one polling interval.
+    """
+
+    poll_interval = 0.01
+
+    def __init__(self, source=None, timeout: float = None, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.source = source
+        self.timeout = timeout
         self.output = None
         self.thread = None
         self.action_results = None
+        self.cancellation_token = CancellationToken()
+        self.wait_time = 0.0
+        self._deadline = None
 
-    def perform(self, results=None):
+    def perform(self, results=None, cancellation_token=None):
         start_time = time.time()
+        start_cpu_time = time.thread_time()
+        self.wait_time = 0.0
+
+        if cancellation_token is not None:
+            self.cancellation_token = cancellation_token
+        self._deadline = None
+        if self.timeout is not None:
+            self._deadline = start_time + self.timeout
+
+        self.check_cancellation()
 
         action_results = self.do_perform(results)
         if action_results is None:
@@ -38,6 +76,9 @@ class Action:
 
         action_results["start_time"] = start_time
         action_results["duration"] = time.time() - start_time
+        action_results["cpu_time"] = time.thread_time() - start_cpu_time
+        action_results["wait_time"] = self.wait_time
+        action_results["thread_id"] = get_ident()
 
         self.action_results = action_results
         return self.action_results
@@ -47,6 +88,58 @@ class Action:
             "You must implement the do_perform method in your class"
         )
 
+    def check_cancellation(self):
+        """
+        Raise ActionCancelled if the experiment was cancelled, or
+        ActionTimeout if the action ran past its timeout.
+        """
+        self.cancellation_token.raise_if_cancelled()
+        if self._deadline is not None and time.time() > self._deadline:
+            raise ActionTimeout(
+                f"{type(self).__name__} did not complete within {self.timeout} s"
+            )
+
+    @contextmanager
+    def waiting(self):
+        """
+        Count the time spent in this block as time blocked on frames or
+        devices (the 'wait_time' of the action results).
+        """
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            self.wait_time += time.time() - start_time
+
+    def remaining_time(self) -> float | None:
+        if self._deadline is None:
+            return None
+        return max(0, self._deadline - time.time())
+
+    def sleep(self, delay):
+        """
+        Sleep that returns as soon as the action is cancelled or times out.
+        """
+        remaining_time = self.remaining_time()
+        if remaining_time is not None:
+            delay = min(delay, remaining_time)
+
+        with self.waiting():
+            self.cancellation_token.wait(delay)
+        self.check_cancellation()
+
+    def wait_for(self, future):
+        """
+        Wait for a concurrent.futures.Future (e.g. a motion), returning its
+        result as soon as it is done, or raising if the action is cancelled
+        or times out first.
+        """
+        with self.waiting():
+            while not future.done():
+                self.check_cancellation()
+                futures.wait([future], timeout=self.poll_interval)
+        return future.result()
+
     def cleanup(self):
         pass
 
@@ -84,7 +177,7 @@ class ActionWait(Action):
         self.delay = delay
 
     def do_perform(self, results=None) -> dict[str, Any] | None:
-        time.sleep(self.delay)
+        self.sleep(self.delay)
 
 
 class ActionSound(Action):
@@ -132,7 +225,8 @@ class ActionMove(Action):
         self.device: LinearMotionDevice = linear_motion_device
 
     def do_perform(self, results=None) -> None:
-        self.device.moveInMicronsTo(self.position)
+        with self.waiting(), device_lock(self.device):
+            self.device.moveInMicronsTo(self.position)
 
 
 class ActionMoveBy(Action):
@@ -148,7 +242,8 @@ class ActionMoveBy(Action):
         self.device: LinearMotionDevice = linear_motion_device
 
     def do_perform(self, results=None) -> dict[str, Any] | None:
-        self.device.moveInMicronsBy(self.d_position)
+        with self.waiting(), device_lock(self.device):
+            self.device.moveInMicronsBy(self.d_position)
         return {"displacement": self.d_position}
     
 class ActionHome(Action):
@@ -162,7 +257,184 @@ class ActionHome(Action):
         self.device: LinearMotionDevice = linear_motion_device
 
     def do_perform(self, results=None) -> None:
-        self.device.home()
+        with self.waiting(), device_lock(self.device):
+            self.device.home()
+
+
+class ActionMoveAsync(Action):
+    """
+    Start moving to 'position' and return immediately. The motion
+    (a concurrent.futures.Future) is the output of the action; use
+    ActionWaitForMotion before anything that needs the device in place.
+    """
+
+    def __init__(
+        self,
+        position: tuple[int],
+        linear_motion_device: LinearMotionDevice,
+        *args,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.position: tuple[int] = position
+        self.device: LinearMotionDevice = linear_motion_device
+
+    def do_perform(self, results=None) -> dict[str, Any] | None:
+        self.output = asyncmotion.move_to(self.device, self.position)
+        return {"position": self.position}
+
+
+class ActionMoveToFocusAsync(ActionMoveAsync):
+    """
+    Start moving to 'position' with a z relative to the best focus found by
+    'source', an ActionAutofocus performed earlier (e.g. for the first
+    plane of a z-stack): z is source.output + z_offset. If the source was
+    not performed (skipped when resuming an experiment), the z of
+    'position' is used.
+    """
+
+    def __init__(
+        self,
+        position: tuple[int],
+        linear_motion_device: LinearMotionDevice,
+        source,
+        z_offset: float,
+        *args,
+        **kwargs,
+    ):
+        kwargs["source"] = source
+        super().__init__(position, linear_motion_device, *args, **kwargs)
+        self.z_offset = z_offset
+
+    def do_perform(self, results=None) -> dict[str, Any] | None:
+        position = self.position
+        if self.source.output is not None:
+            x, y = position[:2]
+            position = (x, y, self.source.output + self.z_offset)
+        self.output = asyncmotion.move_to(self.device, position)
+        return {"position": position}
+
+
+class ActionMoveByAsync(Action):
+    """
+    Start moving by 'd_position' and return immediately (see
+    ActionMoveAsync).
+    """
+
+    def __init__(
+        self,
+        d_position: list[int],
+        linear_motion_device: LinearMotionDevice,
+        *args,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.d_position: list[int] = d_position
+        self.device: LinearMotionDevice = linear_motion_device
+
+    def do_perform(self, results=None) -> dict[str, Any] | None:
+        self.output = asyncmotion.move_by(self.device, self.d_position)
+        return {"displacement": self.d_position}
+
+
+class ActionHomeAsync(Action):
+    """
+    Start homing and return immediately (see ActionMoveAsync).
+    """
+
+    def __init__(
+        self,
+        linear_motion_device: LinearMotionDevice,
+        *args,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.device: LinearMotionDevice = linear_motion_device
+
+    def do_perform(self, results=None) -> dict[str, Any] | None:
+        self.output = asyncmotion.home(self.device)
+
+
+class ActionWaitForMotion(Action):
+    """
+    Barrier: wait until all the motions requested for the device (or list
+    of devices) are complete. An error raised by a motion is raised here.
+    Cancelling stops waiting but cannot interrupt a motion in progress.
+    """
+
+    def __init__(self, linear_motion_device, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if isinstance(linear_motion_device, (list, tuple)):
+            self.devices = list(linear_motion_device)
+        else:
+            self.devices = [linear_motion_device]
+
+    def do_perform(self, results=None) -> dict[str, Any] | None:
+        for device in self.devices:
+            motion = asyncmotion.pending_motion(device)
+            if motion is not None:
+                self.wait_for(motion)
+
+
+class ActionCoordinatedMove(Action):
+    """
+    Move several devices at the same time and wait until all are in place,
+    e.g. the delay line and the sample stage at each point of a pump-probe
+    scan. 'moves' is a list of (linear_motion_device, position) pairs. The
+    step takes as long as the slowest move instead of the sum of all moves.
+    """
+
+    def __init__(self, moves, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.moves = [(device, tuple(position)) for device, position in moves]
+
+    @property
+    def devices(self) -> list:
+        return [device for device, _ in self.moves]
+
+    def do_perform(self, results=None) -> dict[str, Any] | None:
+        motions = asyncmotion.move_together(self.moves)
+        for motion in motions:
+            self.wait_for(motion)
+
+        return {"positions": [position for _, position in self.moves]}
+
+
+class ActionTrajectory(Action):
+    """
+    Move a device through waypoints on its motion thread (see
+    hardware.asyncmotion.stream_waypoints). With a blend_radius, a device
+    that can be retargeted while moving goes through the waypoints without
+    stopping. With wait=False, the action returns immediately and
+    ActionWaitForMotion is the barrier.
+    """
+
+    def __init__(
+        self,
+        waypoints,
+        linear_motion_device: LinearMotionDevice,
+        wait: bool = True,
+        blend_radius: float = 0.0,
+        *args,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        if len(waypoints) == 0:
+            raise ValueError("A trajectory needs at least one waypoint")
+        self.waypoints = [tuple(waypoint) for waypoint in waypoints]
+        self.device: LinearMotionDevice = linear_motion_device
+        self.wait = wait
+        self.blend_radius = blend_radius
+
+    def do_perform(self, results=None) -> dict[str, Any] | None:
+        motion = asyncmotion.stream_waypoints(
+            self.device, self.waypoints, blend_radius=self.blend_radius
+        )
+        self.output = motion
+        if self.wait:
+            self.wait_for(motion)
+
+        return {"waypoints": len(self.waypoints)}
 
 
 class ActionFunctionCall(Action):
@@ -206,23 +478,32 @@ class ActionAccumulate(Action):
             notification_name=MicroscopeAppNotification.new_image_received,
         )
 
-        if self.queue is None:
-            self.queue = results.get("save_queue")
-
-        if self.queue is None:
-            raise RuntimeError("No save queue available")
-
-        while len(img_arrays) < self.n_images:
-            img_array = self.queue.get()
-            img_arrays.append(img_array)
-            index = index + 1
-
-        NotificationCenter().remove_observer(
-            self, notification_name=MicroscopeAppNotification.new_image_received
-        )
-
-        self.queue.close()
-        self.queue.join_thread()
+        try:
+            if self.queue is None:
+                self.queue = results.get("save_queue")
+
+            if self.queue is None:
+                raise RuntimeError("No save queue available")
+
+            while len(img_arrays) < self.n_images:
+                self.check_cancellation()
+                try:
+                    with self.waiting():
+                        img_array = self.queue.get(timeout=self.poll_interval)
+                except Empty:
+                    continue
+                img_arrays.append(img_array)
+                index = index + 1
+        finally:
+            NotificationCenter().remove_observer(
+                self,
+                notification_name=MicroscopeAppNotification.new_image_received,
+            )
+
+            if self.queue is not None:
+                # Frames left in an aborted capture must not block the exit
+                self.queue.cancel_join_thread()
+                self.queue.close()
 
         self.output = img_arrays
         return {"captured_frames": img_arrays}
@@ -236,8 +517,10 @@ class ActionMean(Action):
     def do_perform(self, results=None) -> dict[str, Any] | None:
         img_arrays = self.source.output
 
-        stacked = np.stack(img_arrays).astype(np.float64)
-        mean_img = np.mean(stacked, axis=0)
+        # In the dtype of the images: no conversion to float64 and back
+        dtype = img_arrays[0].dtype
+        total = np.sum(img_arrays, axis=0, dtype=accumulator_dtype(dtype))
+        mean_img = mean_from_sum(total, len(img_arrays), dtype)
 
         self.output = mean_img
 
@@ -246,6 +529,7 @@ class ActionMean(Action):
 
 class ActionProviderRun(Action):
     def __init__(self, app, start, *args, **kwargs):
+        super().__init__(*args, **kwargs)
         self.app_ref = weakref.ref(app)
         self.start = start
 
@@ -267,6 +551,7 @@ class ActionPostNotification(Action):
         *args,
         **kwargs,
     ):
+        super().__init__(*args, **kwargs)
         self.name = notification_name
         self.object = notifying_object
         self.user_info = user_info
@@ -280,7 +565,9 @@ class ActionPostNotification(Action):
 
 
 class ActionSave(Action):
-    def __init__(self, source, root_dir=None, template=None, *args, **kwargs):
+    def __init__(
+        self, source, root_dir=None, template=None, params=None, *args, **kwargs
+    ):
         kwargs["source"] = source
         super().__init__(*args, **kwargs)
         self.root_dir = root_dir
@@ -291,21 +578,313 @@ class ActionSave(Action):
         if template is None:
             self.template = "Image-{date}-{time}-{i:03d}.tif"
 
+        # Extra fields for the template (e.g. 'wavelength')
+        self.params = params
+        if params is None:
+            self.params = {}
+
     def do_perform(self, results=None) -> dict[str, Any] | None:
         img_array = self.source.output
 
-        pil_image = PILImage.fromarray(img_array.astype(np.uint8), mode="RGB")
-
         now = datetime.now()
         date_str = now.strftime("%Y%m%d")
         time_str = now.strftime("%H%M%S")
         params = {"date": date_str, "time": time_str}
 
         params["i"] = "avg"
+        params.update(self.params)
         filepath = self.root_dir / Path(self.template.format(**params))
-        pil_image.save(filepath)
+        save_image(img_array, filepath)
 
         NotificationCenter().post_notification(MicroscopeAppNotification.did_save_file, notifying_object=self, user_info={'filepath':filepath, 'img_array':img_array})
 
         self.output = filepath
+        return {"filepath": filepath}
+
+
+class ActionFlatFieldCalibration(Action):
+    """
+    Compute a flat-field calibration from the mean dark frame and the mean
+    flat frame (the outputs of two ActionMean) and store it in the
+    CalibrationCache under 'key' (see CalibrationCache.key). The output is
+    the calibration file. A provider with the directory of the cache as its
+    flat_field_calibration uses it when its configuration has that key.
+    """
+
+    def __init__(self, dark_source, flat_source, cache, key, *args, **kwargs):
+        kwargs["source"] = flat_source
+        super().__init__(*args, **kwargs)
+        self.dark_source = dark_source
+        self.cache = cache
+        self.key = key
+
+    def do_perform(self, results=None) -> dict[str, Any] | None:
+        calibration = FlatFieldCalibration.from_frames(
+            self.dark_source.output, self.source.output
+        )
+        filepath = self.cache.store(self.key, calibration)
+
+        self.output = filepath
+        return {"filepath": filepath}
+
+
+class ActionAddToPyramid(Action):
+    """
+    Add the output image of the source action (e.g. an ActionMean) to a
+    PyramidBuilder at 'position' (top, left) in mosaic pixels, so the
+    pyramid grows while the map is acquired.
+    """
+
+    def __init__(self, builder, source, position, *args, **kwargs):
+        kwargs["source"] = source
+        super().__init__(*args, **kwargs)
+        self.builder = builder
+        self.position = position
 
+    def do_perform(self, results=None) -> dict[str, Any] | None:
+        img_array = self.source.output
+        top, left = self.position
+        self.builder.add_tile(img_array, top, left)
+
+        return {"pyramid": str(self.builder.directory), "position": self.position}
+
+
+class ActionAddToMosaic(Action):
+    """
+    Place the output image of the source action in a MosaicPreview at
+    'position' (top, left) in mosaic pixels. The preview only keeps a
+    downsampled copy and refreshes the display from the main thread.
+    """
+
+    def __init__(self, preview, source, position, *args, **kwargs):
+        kwargs["source"] = source
+        super().__init__(*args, **kwargs)
+        self.preview = preview
+        self.position = position
+
+    def do_perform(self, results=None) -> dict[str, Any] | None:
+        top, left = self.position
+        self.preview.add_tile(self.source.output, top, left)
+
+        return {"position": self.position}
+
+
+class ActionAutofocus(Action):
+    """
+    Find the z of best focus around the current position of the sample and
+    move there.
+
+    Each frame is reduced to a decimated grayscale region of interest and
+    scored with a sharpness metric from pymicroscope.base.focusmetrics
+    ('laplacian', 'brenner' or 'normalized_variance'). The 'coarse-to-fine'
+    search samples points_per_pass planes over z_range (± microns around
+    the current z), then repeats around the best plane with a step 2x
+    smaller until the step is below 'tolerance'. Planes already measured
+    are not imaged again, the metric of a frame is computed while the stage
+    moves to the next plane and a parabola through the best plane and its
+    neighbours refines the result. The 'golden' search needs fewer frames
+    but cannot overlap moves and computation since each plane depends on
+    the previous metric.
+
+    Frames received before the stage settled (settle_time after the move)
+    are discarded. With a focus_map, the best focus is added as a focus
+    point.
+    """
+
+    searches = ("coarse-to-fine", "golden")
+
+    def __init__(
+        self,
+        linear_motion_device: LinearMotionDevice,
+        z_range: float,
+        tolerance: float = 1.0,
+        metric: str = "laplacian",
+        search: str = "coarse-to-fine",
+        points_per_pass: int = 5,
+        roi=None,
+        decimation: int = 2,
+        settle_time: float = 0.0,
+        focus_map=None,
+        *args,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        if metric not in focus_metrics:
+            raise ValueError(
+                f"metric must be one of {tuple(focus_metrics)}, got {metric}"
+            )
+        if search not in self.searches:
+            raise ValueError(
+                f"search must be one of {self.searches}, got {search}"
+            )
+        if points_per_pass < 3:
+            raise ValueError("points_per_pass must be at least 3")
+
+        self.device: LinearMotionDevice = linear_motion_device
+        self.z_range = z_range
+        self.tolerance = tolerance
+        self.metric = metric
+        self.search = search
+        self.points_per_pass = points_per_pass
+        self.roi = roi
+        self.decimation = decimation
+        self.settle_time = settle_time
+        self.focus_map = focus_map
+
+        self.focus_values: dict[float, float] = {}
+        self._frames = TQueue(maxsize=1)
+        self._frames_lock = Lock()
+        self._frames_after = None
+        self._xy = None
+
+    def handle_new_image(self, notification):
+        img_array = notification.user_info["img_array"]
+        if img_array is None:
+            return
+
+        with self._frames_lock:
+            if self._frames_after is None or time.time() < self._frames_after:
+                return  # Exposed while the stage was moving
+            with suppress(Full):
+                self._frames.put_nowait(img_array)
+
+    def grab_frame(self) -> np.ndarray:
+        with self._frames_lock:
+            self._frames_after = time.time() + self.settle_time
+            with suppress(Empty):
+                self._frames.get_nowait()
+
+        while True:
+            self.check_cancellation()
+            try:
+                with self.waiting():
+                    return self._frames.get(timeout=self.poll_interval)
+            except Empty:
+                continue
+
+    def move_to(self, z):
+        x, y = self._xy
+        with device_lock(self.device):
+            self.device.moveInMicronsTo((x, y, z))
+
+    def measure(self, img_array) -> float:
+        image = region_of_interest(img_array, self.roi, self.decimation)
+        return focus_metrics[self.metric](image)
+
+    def sweep(self, z_values, executor):
+        """
+        Measure every plane, moving to the next plane while the metric of
+        the current frame is computed.
+        """
+        with self.waiting():
+            self.move_to(z_values[0])
+
+        for i, z in enumerate(z_values):
+            img_array = self.grab_frame()
+            next_move = None
+            if i + 1 < len(z_values):
+                next_move = executor.submit(self.move_to, z_values[i + 1])
+
+            self.focus_values[z] = self.measure(img_array)
+
+            if next_move is not None:
+                with self.waiting():
+                    next_move.result()
+
+    def evaluate(self, z) -> float:
+        with self.waiting():
+            self.move_to(z)
+        self.focus_values[z] = self.measure(self.grab_frame())
+        return self.focus_values[z]
+
+    def coarse_to_fine_search(self, z_min, z_max) -> float:
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            low, high = z_min, z_max
+            while True:
+                # Rounded so that planes of the previous pass are recognized
+                z_values = np.linspace(low, high, self.points_per_pass)
+                z_values = [round(float(z), 6) for z in z_values]
+                new_z_values = [
+                    z for z in z_values if z not in self.focus_values
+                ]
+                if len(new_z_values) > 0:
+                    self.sweep(new_z_values, executor)
+
+                step = z_values[1] - z_values[0]
+                best_z = max(self.focus_values, key=self.focus_values.get)
+                if step <= self.tolerance:
+                    break
+                low = max(best_z - step, z_min)
+                high = min(best_z + step, z_max)
+
+        return self.parabolic_refinement(best_z, step)
+
+    def parabolic_refinement(self, best_z, step) -> float:
+        below = round(best_z - step, 6)
+        above = round(best_z + step, 6)
+        if below not in self.focus_values or above not in self.focus_values:
+            return best_z
+
+        f_below = self.focus_values[below]
+        f_best = self.focus_values[best_z]
+        f_above = self.focus_values[above]
+        curvature = f_below - 2 * f_best + f_above
+        if curvature >= 0:
+            return best_z
+        return best_z + 0.5 * step * (f_below - f_above) / curvature
+
+    def golden_section_search(self, z_min, z_max) -> float:
+        inverse_phi = (np.sqrt(5) - 1) / 2
+        low, high = z_min, z_max
+        c = high - inverse_phi * (high - low)
+        d = low + inverse_phi * (high - low)
+        f_c, f_d = self.evaluate(c), self.evaluate(d)
+        while high - low > self.tolerance:
+            if f_c > f_d:
+                high, d, f_d = d, c, f_c
+                c = high - inverse_phi * (high - low)
+                f_c = self.evaluate(c)
+            else:
+                low, c, f_c = c, d, f_d
+                d = low + inverse_phi * (high - low)
+                f_d = self.evaluate(d)
+
+        return (low + high) / 2
+
+    def do_perform(self, results=None) -> dict[str, Any] | None:
+        with device_lock(self.device):
+            x, y, z = self.device.positionInMicrons()
+        self._xy = (x, y)
+        self.focus_values = {}
+
+        NotificationCenter().add_observer(
+            self,
+            method=self.handle_new_image,
+            notification_name=MicroscopeAppNotification.new_image_received,
+        )
+        try:
+            z_min, z_max = z - self.z_range, z + self.z_range
+            if self.search == "golden":
+                best_z = self.golden_section_search(z_min, z_max)
+            else:
+                best_z = self.coarse_to_fine_search(z_min, z_max)
+
+            with self.waiting():
+                self.move_to(best_z)
+        finally:
+            NotificationCenter().remove_observer(
+                self,
+                notification_name=MicroscopeAppNotification.new_image_received,
+            )
+            with self._frames_lock:
+                self._frames_after = None
+
+        if self.focus_map is not None:
+            self.focus_map.add_point(x, y, best_z)
+
+        self.output = best_z
+        return {
+            "best_z": best_z,
+            "focus_values": sorted(self.focus_values.items()),
+            "frames": len(self.focus_values),
+        }
@@ -0,0 +1,50 @@
+from __future__ import annotations
+
+from threading import Event
+
+
+class ActionCancelled(Exception):
+    """
+    Raised inside an action when its cancellation token was cancelled.
+    """
+
+
+class ActionTimeout(TimeoutError):
+    """
+    Raised inside an action when it runs past its timeout.
+    """
+
+
+class CancellationToken:
+    """
+    A token shared by an Experiment, its ExperimentSteps and their Actions to
+    request a cooperative stop.
+
+    Long actions do not sleep or block indefinitely: they wait on the token
+    (or poll it between short blocking calls) so that cancelling takes
+    effect within one polling interval.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._event = Event()
+        self.reason = None
+
+    def cancel(self, reason: str = None):
+        self.reason = reason
+        self._event.set()
+
+    @property
+    def is_cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def wait(self, timeout: float = None) -> bool:
+        """
+        Wait at most 'timeout' seconds, returning True as soon as the token
+        is cancelled.
+        """
+        return self._event.wait(timeout)
+
+    def raise_if_cancelled(self):
+        if self.is_cancelled:
+            raise ActionCancelled(self.reason)
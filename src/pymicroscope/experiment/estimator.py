@@ -0,0 +1,445 @@
+from __future__ import annotations
+
+import math
+import os
+import time
+import tempfile
+from typing import Any
+
+import numpy as np
+
+from pymicroscope.hardware import asyncmotion
+from pymicroscope.experiment.actions import (
+    Action,
+    ActionWait,
+    ActionMove,
+    ActionMoveBy,
+    ActionHome,
+    ActionAccumulate,
+    ActionMean,
+    ActionSave,
+    ActionAutofocus,
+    ActionMoveAsync,
+    ActionMoveByAsync,
+    ActionHomeAsync,
+    ActionWaitForMotion,
+    ActionCoordinatedMove,
+    ActionTrajectory,
+)
+
+
+class ExperimentEstimator:
+    """
+    Predicts the duration, the bytes written to disk and the peak memory of
+    an Experiment without touching the hardware.
+
+    Each action type has a cost model:
+        ActionMove, ActionMoveBy, ActionHome: distance / device speed + settle time
+        ActionAccumulate: n_images / frame_rate
+        ActionSave: frame bytes / disk bandwidth
+        ActionWait: its delay
+    Any other action uses the mean duration measured for its type during
+    calibration, or zero if it was never measured.
+
+    Positions are in microns, speeds in microns per second. Axes are assumed
+    to move simultaneously, so a move lasts as long as its longest axis.
+
+    Frames (and the mean computed from them) are kept by their actions until
+    the experiment cleans up at the end, so the peak memory is the memory
+    retained by all the steps performed so far.
+    """
+
+    def __init__(
+        self,
+        frame_shape=(480, 640, 3),
+        frame_dtype=np.uint8,
+        frame_rate=30,
+        disk_bandwidth=100e6,
+        default_speed=1000,
+        settle_time=0.0,
+        *args,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.frame_shape = tuple(frame_shape)
+        self.frame_dtype = np.dtype(frame_dtype)
+        self.frame_rate = frame_rate
+        self.disk_bandwidth = disk_bandwidth
+        self.default_speed = default_speed
+        self.settle_time = settle_time
+
+        self.device_speeds = {}
+        self.device_settle_times = {}
+        self.initial_positions = {}
+        self.measured_durations: dict[str, list[float]] = {}
+
+        self.cost_models = {
+            ActionWait: self.cost_wait,
+            ActionMove: self.cost_move,
+            ActionMoveBy: self.cost_move_by,
+            ActionHome: self.cost_home,
+            ActionAccumulate: self.cost_accumulate,
+            ActionMean: self.cost_mean,
+            ActionSave: self.cost_save,
+            ActionAutofocus: self.cost_autofocus,
+            ActionMoveAsync: self.cost_move_async,
+            ActionMoveByAsync: self.cost_move_async,
+            ActionHomeAsync: self.cost_move_async,
+            ActionWaitForMotion: self.cost_wait_for_motion,
+            ActionCoordinatedMove: self.cost_coordinated_move,
+            ActionTrajectory: self.cost_trajectory,
+        }
+
+    @property
+    def frame_bytes(self) -> int:
+        return int(np.prod(self.frame_shape)) * self.frame_dtype.itemsize
+
+    @property
+    def saved_frame_bytes(self) -> int:
+        """
+        Bytes of pixels in a file written by ActionSave: 8 and 16-bit
+        frames are saved in their dtype, other frames with 32 bits per
+        sample (see pymicroscope.base.imagefile).
+        """
+        itemsize = self.frame_dtype.itemsize
+        if self.frame_dtype not in (np.uint8, np.uint16, np.bool_):
+            itemsize = 4
+        return int(np.prod(self.frame_shape)) * itemsize
+
+    @staticmethod
+    def measure_disk_bandwidth(directory=None, size=32_000_000) -> float:
+        """
+        Write (and fsync) a temporary file of 'size' bytes and return the
+        measured bandwidth in bytes per second.
+        """
+        data = os.urandom(size)
+        with tempfile.NamedTemporaryFile(dir=directory) as file:
+            start_time = time.time()
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+            duration = time.time() - start_time
+
+        return size / max(duration, 1e-9)
+
+    def speed(self, device) -> float:
+        return self.device_speeds.get(device, self.default_speed)
+
+    def settle(self, device) -> float:
+        return self.device_settle_times.get(device, self.settle_time)
+
+    def motion_time(self, device, distance) -> float:
+        if distance == 0:
+            return 0.0
+        return distance / self.speed(device) + self.settle(device)
+
+    def current_position(self, device, positions, n_axes):
+        if device not in positions:
+            positions[device] = np.asarray(
+                self.initial_positions.get(device, (0,) * n_axes), dtype=float
+            )
+        return positions[device]
+
+    @staticmethod
+    def distance(start, end) -> float:
+        return float(np.max(np.abs(np.asarray(end, dtype=float) - start)))
+
+    def cost_wait(self, action, state) -> dict[str, Any]:
+        return {"duration": action.delay}
+
+    def cost_move(self, action, state) -> dict[str, Any]:
+        start = self.current_position(
+            action.device, state["positions"], len(action.position)
+        )
+        distance = self.distance(start, action.position)
+        state["positions"][action.device] = np.asarray(
+            action.position, dtype=float
+        )
+        return {
+            "duration": self.motion_time(action.device, distance),
+            "distance": distance,
+        }
+
+    def cost_move_by(self, action, state) -> dict[str, Any]:
+        start = self.current_position(
+            action.device, state["positions"], len(action.d_position)
+        )
+        distance = self.distance(0, action.d_position)
+        state["positions"][action.device] = start + np.asarray(
+            action.d_position, dtype=float
+        )
+        return {
+            "duration": self.motion_time(action.device, distance),
+            "distance": distance,
+        }
+
+    def cost_home(self, action, state) -> dict[str, Any]:
+        start = self.current_position(action.device, state["positions"], 1)
+        distance = self.distance(start, np.zeros_like(start))
+        state["positions"][action.device] = np.zeros_like(start)
+        return {
+            "duration": self.motion_time(action.device, distance),
+            "distance": distance,
+        }
+
+    def cost_move_async(self, action, state) -> dict[str, Any]:
+        """
+        An asynchronous motion takes no time for the experiment: it ends
+        (after the motions already requested for the device) while the
+        next actions are performed.
+        """
+        if isinstance(action, ActionMoveAsync):
+            cost = self.cost_move(action, state)
+        elif isinstance(action, ActionMoveByAsync):
+            cost = self.cost_move_by(action, state)
+        else:
+            cost = self.cost_home(action, state)
+
+        elapsed = state.get("elapsed", 0.0)
+        motion_ends = state.setdefault("motion_ends", {})
+        start = max(elapsed, motion_ends.get(action.device, elapsed))
+        motion_ends[action.device] = start + cost["duration"]
+
+        cost["duration"] = 0.0
+        return cost
+
+    def cost_wait_for_motion(self, action, state) -> dict[str, Any]:
+        elapsed = state.get("elapsed", 0.0)
+        motion_ends = state.get("motion_ends", {})
+        end = max(
+            [motion_ends.get(device, elapsed) for device in action.devices],
+            default=elapsed,
+        )
+        return {"duration": max(0.0, end - elapsed)}
+
+    def cost_coordinated_move(self, action, state) -> dict[str, Any]:
+        duration, distance = 0.0, 0.0
+        for device, position in action.moves:
+            start = self.current_position(
+                device, state["positions"], len(position)
+            )
+            device_distance = self.distance(start, position)
+            state["positions"][device] = np.asarray(position, dtype=float)
+            duration = max(duration, self.motion_time(device, device_distance))
+            distance = max(distance, device_distance)
+
+        return {"duration": duration, "distance": distance}
+
+    def cost_trajectory(self, action, state) -> dict[str, Any]:
+        start = self.current_position(
+            action.device, state["positions"], len(action.waypoints[0])
+        )
+        path = np.vstack([start, np.asarray(action.waypoints, dtype=float)])
+        segments = np.abs(np.diff(path, axis=0)).max(axis=1)
+        distance = float(segments.sum())
+        state["positions"][action.device] = path[-1]
+
+        if action.blend_radius > 0 and asyncmotion.can_retarget(action.device):
+            # Blended: the device settles once, at the end
+            duration = self.motion_time(action.device, distance)
+        else:
+            duration = sum(
+                self.motion_time(action.device, float(segment))
+                for segment in segments
+            )
+        if not action.wait:
+            elapsed = state.get("elapsed", 0.0)
+            motion_ends = state.setdefault("motion_ends", {})
+            start_time = max(elapsed, motion_ends.get(action.device, elapsed))
+            motion_ends[action.device] = start_time + duration
+            duration = 0.0
+
+        return {"duration": duration, "distance": distance}
+
+    def cost_accumulate(self, action, state) -> dict[str, Any]:
+        return {
+            "duration": action.n_images / self.frame_rate,
+            "memory": action.n_images * self.frame_bytes,
+        }
+
+    def cost_mean(self, action, state) -> dict[str, Any]:
+        # The mean is in the dtype of the frames
+        return {
+            "duration": self.measured_duration(action),
+            "memory": self.frame_bytes,
+        }
+
+    def cost_save(self, action, state) -> dict[str, Any]:
+        n_bytes = self.saved_frame_bytes
+        return {
+            "duration": n_bytes / self.disk_bandwidth,
+            "bytes_written": n_bytes,
+        }
+
+    def cost_autofocus(self, action, state) -> dict[str, Any]:
+        span = 2 * action.z_range
+        if action.search == "golden":
+            n_frames = 2 + math.ceil(
+                math.log(max(span / action.tolerance, 1)) / math.log(1.618)
+            )
+            step = span / 2
+        else:
+            # Each pass narrows the step by (points - 1) / 2 and reuses the
+            # best plane and its two neighbours
+            points = action.points_per_pass
+            step = span / (points - 1)
+            passes = 1 + math.ceil(
+                math.log(max(step / action.tolerance, 1))
+                / math.log(max((points - 1) / 2, 1.5))
+            )
+            n_frames = points + (passes - 1) * max(points - 3, 1)
+
+        frame_time = 1 / self.frame_rate + action.settle_time
+        return {
+            "duration": n_frames
+            * (frame_time + self.motion_time(action.device, step)),
+            "frames": n_frames,
+        }
+
+    def measured_duration(self, action) -> float:
+        durations = self.measured_durations.get(type(action).__name__)
+        if not durations:
+            return 0.0
+        return float(np.mean(durations))
+
+    def cost_model(self, action):
+        for ActionType in type(action).__mro__:
+            if ActionType in self.cost_models:
+                return self.cost_models[ActionType]
+        return None
+
+    def estimate_action(self, action: Action, state) -> dict[str, Any]:
+        cost_model = self.cost_model(action)
+        if cost_model is None:
+            cost = {"duration": self.measured_duration(action)}
+        else:
+            cost = cost_model(action, state)
+
+        cost.setdefault("bytes_written", 0)
+        cost.setdefault("memory", 0)
+        return cost
+
+    @staticmethod
+    def step_actions(step) -> list[Action]:
+        actions = []
+        for action_list in (
+            step.prepare_actions,
+            step.perform_actions,
+            step.finalize_actions,
+        ):
+            if action_list is not None:
+                actions.extend(action_list)
+        return actions
+
+    def estimate(self, experiment, skip_steps=None) -> dict[str, Any]:
+        """
+        Walk the experiment plan and return the predicted 'duration' (s),
+        'bytes_written', 'peak_memory' (bytes), the duration of each step in
+        'step_durations' and the total duration per action type in
+        'action_durations'.
+        """
+        if skip_steps is None:
+            skip_steps = set()
+
+        state = {"positions": {}, "elapsed": 0.0}
+        duration = 0.0
+        bytes_written = 0
+        retained_memory = 0
+        peak_memory = 0
+        step_durations = []
+        action_durations = {}
+
+        for i, step in enumerate(experiment.steps):
+            if i in skip_steps:
+                step_durations.append(0.0)
+                continue
+
+            step_duration = 0.0
+            for action in self.step_actions(step):
+                cost = self.estimate_action(action, state)
+                state["elapsed"] = duration + step_duration + cost["duration"]
+                step_duration += cost["duration"]
+                bytes_written += cost["bytes_written"]
+                retained_memory += cost["memory"]
+                peak_memory = max(peak_memory, retained_memory)
+
+                name = type(action).__name__
+                action_durations[name] = (
+                    action_durations.get(name, 0.0) + cost["duration"]
+                )
+
+            step_durations.append(step_duration)
+            duration += step_duration
+
+        return {
+            "duration": duration,
+            "bytes_written": bytes_written,
+            "peak_memory": peak_memory,
+            "step_durations": step_durations,
+            "action_durations": action_durations,
+        }
+
+    def calibrate(self, experiment):
+        """
+        Calibrate the cost models from an experiment that was performed:
+        every action keeps its 'duration' in action_results.
+        """
+        state = {"positions": {}}
+        motions = {}
+        n_frames, accumulate_duration = 0, 0.0
+        n_bytes, save_duration = 0, 0.0
+
+        for step in experiment.steps:
+            for action in self.step_actions(step):
+                cost = self.estimate_action(action, state)
+
+                if action.action_results is None:
+                    continue
+                duration = action.action_results["duration"]
+
+                if isinstance(action, (ActionMove, ActionMoveBy, ActionHome)):
+                    motions.setdefault(action.device, []).append(
+                        (cost["distance"], duration)
+                    )
+                elif isinstance(action, ActionAccumulate):
+                    n_frames += action.n_images
+                    accumulate_duration += duration
+                elif isinstance(action, ActionSave):
+                    if action.output is not None and os.path.exists(action.output):
+                        n_bytes += os.path.getsize(action.output)
+                    else:
+                        n_bytes += cost["bytes_written"]
+                    save_duration += duration
+                else:
+                    self.measured_durations.setdefault(
+                        type(action).__name__, []
+                    ).append(duration)
+
+        for device, samples in motions.items():
+            self.calibrate_motion(device, samples)
+
+        if accumulate_duration > 0:
+            self.frame_rate = n_frames / accumulate_duration
+
+        if save_duration > 0:
+            self.disk_bandwidth = n_bytes / save_duration
+
+    def calibrate_motion(self, device, samples):
+        """
+        Fit duration = distance / speed + settle_time to the moves measured
+        on a device.
+        """
+        samples = np.array([sample for sample in samples if sample[0] > 0])
+        if len(samples) == 0:
+            return
+
+        distances, durations = samples[:, 0], samples[:, 1]
+        if len(np.unique(distances)) >= 2:
+            slope, intercept = np.polyfit(distances, durations, 1)
+            if slope > 0:
+                self.device_speeds[device] = 1 / slope
+                self.device_settle_times[device] = max(0.0, intercept)
+                return
+
+        self.device_speeds[device] = distances.sum() / max(durations.sum(), 1e-9)
+        self.device_settle_times[device] = 0.0
@@ -1,10 +1,18 @@
 from __future__ import annotations
 
 import time
+from contextlib import suppress
 from enum import Enum
 from typing import Any
 from threading import Thread
 from pymicroscope.experiment.actions import Action, ActionFunctionCall
+from pymicroscope.experiment.journal import ExperimentJournal
+from pymicroscope.experiment.estimator import ExperimentEstimator
+from pymicroscope.experiment.cancellation import (
+    CancellationToken,
+    ActionCancelled,
+    ActionTimeout,
+)
 from mytk.notificationcenter import NotificationCenter
 
 
@@ -19,12 +27,16 @@ class ExperimentNotification(Enum):
         did_complete_experiment: The experiment has finished. 'total_steps', 'duration'
         will_start_experiment_step: A specific step is about to begin. 'total_steps' and 'current_step'
         did_complete_experiment_step: A specific step has completed. 'total_steps' and 'current_step'
+        did_skip_experiment_step: A step was already completed in the journal. 'current_step' and 'record'
+        did_abort_experiment: The experiment was cancelled or an action timed out. 'current_step' and 'reason'
     """
 
     will_start_experiment = "will_start_experiment"
     did_complete_experiment = "did_complete_experiment"
     will_start_experiment_step = "will_start_experiment_step"
     did_complete_experiment_step = "did_complete_experiment_step"
+    did_skip_experiment_step = "did_skip_experiment_step"
+    did_abort_experiment = "did_abort_experiment"
 
 
 class ExperimentStep:
@@ -41,7 +53,7 @@ class ExperimentStep:
         self.finalize_actions: list[Action] = finalize
         self.results = {}
 
-    def perform(self, results=None):
+    def perform(self, results=None, cancellation_token=None):
         NotificationCenter().post_notification(
             ExperimentNotification.will_start_experiment_step,
             notifying_object=self,
@@ -49,19 +61,25 @@ class ExperimentStep:
 
         if self.prepare_actions is not None:
             for i, action in enumerate(self.prepare_actions):
-                result = action.perform(results=self.results)
+                result = action.perform(
+                    results=self.results, cancellation_token=cancellation_token
+                )
                 if result is not None:
                     self.results[f"prepare-{i}"] = result
 
         if self.perform_actions is not None:
             for i, action in enumerate(self.perform_actions):
-                result = action.perform(results=self.results)
+                result = action.perform(
+                    results=self.results, cancellation_token=cancellation_token
+                )
                 if result is not None:
                     self.results[f"perform-{i}"] = result
 
         if self.finalize_actions is not None:
             for i, action in enumerate(self.finalize_actions):
-                result = action.perform(results=self.results)
+                result = action.perform(
+                    results=self.results, cancellation_token=cancellation_token
+                )
                 if result is not None:
                     self.results[f"finalize-{i}"] = result
 
@@ -96,15 +114,36 @@ class ExperimentStep:
 
 
 class Experiment:
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, journal: ExperimentJournal = None, **kwargs):
         self.results = {}
         self.steps: list[ExperimentStep] = []
+        self.journal = journal
+        self.cancellation_token = CancellationToken()
+        self.cleanup_actions: list[Action] = []
         self._thread = None
 
     def finalize(self):
         if self._thread is not None:
             self._thread.join()
 
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def cancel(self, reason: str = "Cancelled"):
+        """
+        Request a cooperative stop: the current action returns within one
+        polling interval, then the cleanup path runs.
+        """
+        self.cancellation_token.cancel(reason)
+
+    def add_cleanup_action(self, action: Action):
+        """
+        Actions always performed at the end, even if the experiment was
+        cancelled or failed (e.g. stop the camera, re-enable the interface).
+        """
+        self.cleanup_actions.append(action)
+
     def add_step(self, experiment_step):
         self.steps.append(experiment_step)
 
@@ -127,24 +166,80 @@ class Experiment:
             user_info=user_info,
         )
 
-        for i, step in enumerate(self.steps):
-            results = step.perform()
-            experiment_results[f"step-{i}"] = results
+        completed_steps = {}
+        if self.journal is not None:
+            completed_steps = self.journal.completed_steps()
+
+        try:
+            for i, step in enumerate(self.steps):
+                self.cancellation_token.raise_if_cancelled()
+
+                record = completed_steps.get(i)
+                if record is not None and self.journal.is_valid(record):
+                    NotificationCenter().post_notification(
+                        ExperimentNotification.did_skip_experiment_step,
+                        notifying_object=self,
+                        user_info={"current_step": i, "record": record},
+                    )
+                    experiment_results[f"step-{i}"] = record
+                    continue
+
+                results = step.perform(
+                    cancellation_token=self.cancellation_token
+                )
+                experiment_results[f"step-{i}"] = results
 
-        experiment_results["duration"] = time.time() - start_time
+                if self.journal is not None:
+                    self.journal.record_step(i, results)
 
-        user_info["duration"] = experiment_results["duration"]
-        NotificationCenter().post_notification(
-            ExperimentNotification.did_complete_experiment_step,
-            notifying_object=self,
-            user_info=user_info,
-        )
+            experiment_results["duration"] = time.time() - start_time
 
-        for step in self.steps:
-            step.cleanup()
+            user_info["duration"] = experiment_results["duration"]
+            NotificationCenter().post_notification(
+                ExperimentNotification.did_complete_experiment_step,
+                notifying_object=self,
+                user_info=user_info,
+            )
+        except (ActionCancelled, ActionTimeout) as err:
+            experiment_results["duration"] = time.time() - start_time
+            experiment_results["aborted"] = str(err)
+
+            NotificationCenter().post_notification(
+                ExperimentNotification.did_abort_experiment,
+                notifying_object=self,
+                user_info={"current_step": i, "reason": str(err)},
+            )
+        finally:
+            # Every cleanup must run, even if another one fails
+            for step in self.steps:
+                with suppress(Exception):
+                    step.cleanup()
+
+            for action in self.cleanup_actions:
+                with suppress(Exception):
+                    action.perform()
 
         return experiment_results
 
+    def dry_run(self, estimator=None) -> dict[str, Any]:
+        """
+        Walk the plan without touching the hardware and return the predicted
+        duration, bytes written and peak memory (see ExperimentEstimator).
+        Steps already completed in the journal are not counted.
+        """
+        if estimator is None:
+            estimator = ExperimentEstimator()
+
+        skip_steps = set()
+        if self.journal is not None:
+            skip_steps = {
+                i
+                for i, record in self.journal.completed_steps().items()
+                if self.journal.is_valid(record)
+            }
+
+        return estimator.estimate(self, skip_steps=skip_steps)
+
     def perform_in_background_thread(self):
         self._thread = Thread(target=self.perform)
         self._thread.start()
@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+import json
+import hashlib
+import time
+from pathlib import Path
+from typing import Any
+
+
+class ExperimentJournal:
+    """
+    Append-only log of the experiment steps that have completed.
+
+    Every completed step appends one JSON line with its index, the files it
+    produced and their checksums.  After a crash, an Experiment given the
+    same journal skips the steps already recorded, as long as their output
+    files are still on disk and unchanged.
+
+    A plan_id identifies the experiment plan (e.g. a hash of the map
+    positions): records written for another plan are ignored, so the same
+    journal file can be reused without resuming a different experiment.
+    """
+
+    def __init__(self, filepath, plan_id: str = None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.filepath = Path(filepath).expanduser()
+        self.plan_id = plan_id
+
+    @staticmethod
+    def checksum(filepath, chunk_size=1 << 20) -> str:
+        sha = hashlib.sha256()
+        with open(filepath, "rb") as file:
+            for chunk in iter(lambda: file.read(chunk_size), b""):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    @staticmethod
+    def files_from_results(results) -> list[Path]:
+        """
+        Find every 'filepath' recorded in (possibly nested) action results.
+        """
+        files = []
+        if isinstance(results, dict):
+            for key, value in results.items():
+                if key == "filepath" and value is not None:
+                    files.append(Path(value))
+                else:
+                    files.extend(ExperimentJournal.files_from_results(value))
+        return files
+
+    def record_step(self, step_index: int, results=None) -> dict[str, Any]:
+        files = self.files_from_results(results)
+        record = {
+            "plan_id": self.plan_id,
+            "step": step_index,
+            "completed_time": time.time(),
+            "files": [
+                {"path": str(path), "sha256": self.checksum(path)}
+                for path in files
+                if path.exists()
+            ],
+        }
+
+        self.filepath.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.filepath, "a", encoding="utf-8") as file:
+            file.write(json.dumps(record) + "\n")
+            file.flush()
+
+        return record
+
+    def records(self) -> list[dict[str, Any]]:
+        if not self.filepath.exists():
+            return []
+
+        records = []
+        with open(self.filepath, "r", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A crash during write leaves a truncated last line
+                    continue
+                if record.get("plan_id") == self.plan_id:
+                    records.append(record)
+        return records
+
+    def completed_steps(self) -> dict[int, dict[str, Any]]:
+        return {record["step"]: record for record in self.records()}
+
+    def is_valid(self, record) -> bool:
+        """
+        A step is considered done only if all its outputs are still intact.
+        """
+        for file_info in record.get("files", []):
+            path = Path(file_info["path"])
+            if not path.exists():
+                return False
+            if self.checksum(path) != file_info["sha256"]:
+                return False
+        return True
+
+    def last_completed_step(self) -> int | None:
+        steps = [
+            step
+            for step, record in self.completed_steps().items()
+            if self.is_valid(record)
+        ]
+        if len(steps) == 0:
+            return None
+        return max(steps)
+
+    def clear(self):
+        if self.filepath.exists():
+            self.filepath.unlink()
@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import Any
+
+
+class ExperimentProfiler:
+    """
+    Collects the timing of every action of a performed experiment.
+
+    Action.perform records for each action its wall time ('duration'), the
+    time blocked on frames or devices ('wait_time') and the CPU time of its
+    thread ('cpu_time').  The profiler gathers these values from all the
+    steps, exports them as a Chrome trace (open in chrome://tracing or
+    https://ui.perfetto.dev) and summarizes the totals per action type to
+    show whether an experiment is bound by motion, exposure, averaging or
+    disk.
+    """
+
+    phases = ("prepare", "perform", "finalize")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.records: list[dict[str, Any]] = []
+
+    @classmethod
+    def from_experiment(cls, experiment) -> ExperimentProfiler:
+        profiler = cls()
+        profiler.collect(experiment)
+        return profiler
+
+    def collect(self, experiment):
+        for step_index, step in enumerate(experiment.steps):
+            for phase in self.phases:
+                actions = getattr(step, f"{phase}_actions")
+                if actions is None:
+                    continue
+
+                for action in actions:
+                    results = action.action_results
+                    if results is None:
+                        continue  # not performed (skipped or cancelled)
+
+                    self.records.append(
+                        {
+                            "action": type(action).__name__,
+                            "step": step_index,
+                            "phase": phase,
+                            "start_time": results["start_time"],
+                            "duration": results["duration"],
+                            "wait_time": results.get("wait_time", 0.0),
+                            "cpu_time": results.get("cpu_time", 0.0),
+                            "thread_id": results.get("thread_id", 0),
+                        }
+                    )
+
+        self.records.sort(key=lambda record: record["start_time"])
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        """
+        Totals per action type: 'count', 'duration', 'wait_time',
+        'cpu_time' and 'fraction' of the total wall time of all actions.
+        """
+        totals = {}
+        for record in self.records:
+            total = totals.setdefault(
+                record["action"],
+                {"count": 0, "duration": 0.0, "wait_time": 0.0, "cpu_time": 0.0},
+            )
+            total["count"] += 1
+            total["duration"] += record["duration"]
+            total["wait_time"] += record["wait_time"]
+            total["cpu_time"] += record["cpu_time"]
+
+        all_actions_duration = sum(total["duration"] for total in totals.values())
+        for total in totals.values():
+            total["fraction"] = 0.0
+            if all_actions_duration > 0:
+                total["fraction"] = total["duration"] / all_actions_duration
+
+        return dict(
+            sorted(totals.items(), key=lambda item: item[1]["duration"], reverse=True)
+        )
+
+    def summary_table(self) -> str:
+        lines = [
+            f"{'Action':<24} {'Count':>7} {'Wall [s]':>10} {'Wait [s]':>10} {'CPU [s]':>10} {'% wall':>7}"
+        ]
+        for name, total in self.summary().items():
+            lines.append(
+                f"{name:<24} {total['count']:>7d} {total['duration']:>10.3f} "
+                f"{total['wait_time']:>10.3f} {total['cpu_time']:>10.3f} "
+                f"{100 * total['fraction']:>7.1f}"
+            )
+        return "\n".join(lines)
+
+    def trace_events(self) -> list[dict[str, Any]]:
+        """
+        Chrome trace 'complete' events (ph='X', times in microseconds): one
+        per step, with the actions of the step nested inside.
+        """
+        if len(self.records) == 0:
+            return []
+
+        origin = self.records[0]["start_time"]
+        events = []
+        steps = {}
+        for record in self.records:
+            start = record["start_time"] - origin
+            end = start + record["duration"]
+            events.append(
+                {
+                    "name": record["action"],
+                    "cat": record["phase"],
+                    "ph": "X",
+                    "ts": start * 1e6,
+                    "dur": record["duration"] * 1e6,
+                    "pid": 1,
+                    "tid": record["thread_id"],
+                    "args": {
+                        "step": record["step"],
+                        "wait_time": record["wait_time"],
+                        "cpu_time": record["cpu_time"],
+                    },
+                }
+            )
+
+            key = (record["step"], record["thread_id"])
+            step_start, step_end = steps.get(key, (start, end))
+            steps[key] = (min(step_start, start), max(step_end, end))
+
+        for (step, thread_id), (start, end) in steps.items():
+            events.append(
+                {
+                    "name": f"Step {step}",
+                    "cat": "step",
+                    "ph": "X",
+                    "ts": start * 1e6,
+                    "dur": (end - start) * 1e6,
+                    "pid": 1,
+                    "tid": thread_id,
+                    "args": {"step": step},
+                }
+            )
+
+        return events
+
+    def export_trace(self, filepath) -> Path:
+        filepath = Path(filepath).expanduser()
+        with open(filepath, "w", encoding="utf-8") as file:
+            json.dump(
+                {"traceEvents": self.trace_events(), "displayTimeUnit": "ms"},
+                file,
+            )
+        return filepath
@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import numpy as np
+from hardwarelibrary.motion import LinearMotionDevice
+
+from pymicroscope.experiment.actions import (
+    Action,
+    ActionAccumulate,
+    ActionFunctionCall,
+    ActionMean,
+    ActionMoveAsync,
+    ActionSave,
+    ActionWait,
+    ActionWaitForMotion,
+)
+from pymicroscope.experiment.experiments import Experiment, ExperimentStep
+from pymicroscope.plugins.delay_line import DelaysController
+
+
+class WavelengthSweep:
+    """
+    A spectral scan: one averaged image per wavelength, with the delay line
+    at the delay given by the calibration of the DelaysController.
+
+    The delay table is computed at once for all the wavelengths and the
+    points are visited in a single monotonic sweep of the delay line,
+    starting from the end closest to current_delay. Each step waits for the
+    delay line, lets it settle, captures the frames and then starts moving
+    to the next delay while the frames are averaged and saved.
+
+    If tune_laser is given, it is called with the wavelength at the
+    beginning of each step (e.g. to tune the laser).
+    """
+
+    point_dtype = np.dtype([("wavelength", np.float64), ("delay", np.float64)])
+
+    def __init__(
+        self,
+        wavelengths,
+        delays_controller: DelaysController,
+        delay_device: LinearMotionDevice,
+        n_images: int = 1,
+        settle_time: float = 0.0,
+        root_dir: Path = None,
+        template: str = "Sweep-{date}-{time}-{wavelength:.1f}nm.tif",
+        tune_laser=None,
+        current_delay: float = None,
+        *args,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        wavelengths = np.asarray(wavelengths, dtype=float).ravel()
+        if wavelengths.size == 0:
+            raise ValueError("A sweep needs at least one wavelength")
+
+        delays = delays_controller.delays_for_wavelengths(wavelengths)
+        order = delays_controller.sweep_order(delays, current_delay)
+
+        self.points = np.empty(len(order), dtype=self.point_dtype)
+        self.points["wavelength"] = wavelengths[order]
+        self.points["delay"] = delays[order]
+
+        self.delay_device = delay_device
+        self.n_images = n_images
+        self.settle_time = settle_time
+        self.root_dir = root_dir
+        self.template = template
+        self.tune_laser = tune_laser
+
+    def __len__(self):
+        return len(self.points)
+
+    @property
+    def travel(self) -> float:
+        """
+        Total travel of the delay line between the first and last points.
+        """
+        return float(np.abs(np.diff(self.points["delay"])).sum())
+
+    def move_to_point(self, index) -> Action:
+        return ActionMoveAsync(
+            position=(float(self.points["delay"][index]),),
+            linear_motion_device=self.delay_device,
+        )
+
+    def create_experiment(self, journal=None) -> Experiment:
+        experiment = Experiment(journal=journal)
+
+        for index, point in enumerate(self.points):
+            wavelength = float(point["wavelength"])
+
+            # Already started by the previous step, unless it was skipped
+            # (e.g. resumed from a journal): then this is the actual move.
+            prepare = [self.move_to_point(index)]
+            if self.tune_laser is not None:
+                prepare.append(
+                    ActionFunctionCall(self.tune_laser, fct_args=(wavelength,))
+                )
+
+            perform = [ActionWaitForMotion(self.delay_device)]
+            if self.settle_time > 0:
+                perform.append(ActionWait(self.settle_time))
+
+            capture = ActionAccumulate(n_images=self.n_images)
+            perform.append(capture)
+            if index + 1 < len(self.points):
+                # The delay line travels while this point is saved
+                perform.append(self.move_to_point(index + 1))
+
+            mean = ActionMean(source=capture)
+            save = ActionSave(
+                source=mean,
+                root_dir=self.root_dir,
+                template=self.template,
+                params={
+                    "wavelength": wavelength,
+                    "delay": float(point["delay"]),
+                },
+            )
+            perform.extend([mean, save])
+
+            experiment.add_step(
+                experiment_step=ExperimentStep(
+                    prepare=prepare, perform=perform
+                )
+            )
+
+        return experiment
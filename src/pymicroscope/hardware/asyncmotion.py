@@ -0,0 +1,174 @@
+"""
+Non-blocking motion for LinearMotionDevice.
+
+The drivers block until a motion is complete (KinesisDevice.doMoveTo waits
+with wait_move(), SutterDevice polls until the stage stops). Here every
+device gets its own worker thread: a motion is queued on that thread and a
+concurrent.futures.Future is returned immediately, so that the caller can
+do something else during the travel. Motions of the same device are
+performed in the order they were requested, motions of different devices
+run in parallel. A motion holds the device lock of hardware.devicestate, so
+that position polling never interleaves with it on the port.
+"""
+
+from __future__ import annotations
+
+import math
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock
+from weakref import WeakKeyDictionary
+
+from hardwarelibrary.motion import LinearMotionDevice
+
+from pymicroscope.hardware.devicestate import device_lock
+
+# Interval between two readings of the position while streaming waypoints,
+# and how long to wait for a waypoint before stopping there instead
+poll_interval = 0.002
+blend_stall_time = 0.25
+blend_timeout = 30.0
+
+_lock = Lock()
+_executors: WeakKeyDictionary = WeakKeyDictionary()
+_pending_motions: WeakKeyDictionary = WeakKeyDictionary()
+
+
+def motion_executor(device: LinearMotionDevice) -> ThreadPoolExecutor:
+    with _lock:
+        executor = _executors.get(device)
+        if executor is None:
+            executor = ThreadPoolExecutor(
+                max_workers=1,
+                thread_name_prefix=f"motion-{type(device).__name__}",
+            )
+            _executors[device] = executor
+        return executor
+
+
+def submit_motion(device: LinearMotionDevice, function, *args) -> Future:
+    def locked_motion():
+        with device_lock(device):
+            return function(*args)
+
+    executor = motion_executor(device)
+    with _lock:
+        future = executor.submit(locked_motion)
+        _pending_motions[device] = future
+    return future
+
+
+def move_to(device: LinearMotionDevice, position) -> Future:
+    return submit_motion(device, device.moveInMicronsTo, position)
+
+
+def move_by(device: LinearMotionDevice, displacement) -> Future:
+    return submit_motion(device, device.moveInMicronsBy, displacement)
+
+
+def home(device: LinearMotionDevice) -> Future:
+    return submit_motion(device, device.home)
+
+
+def move_together(moves) -> list[Future]:
+    """
+    Start the (device, position) moves at the same time. The devices move
+    concurrently; the futures complete when each device is in place.
+    """
+    return [move_to(device, position) for device, position in moves]
+
+
+def can_retarget(device: LinearMotionDevice) -> bool:
+    """
+    True if the device accepts a new target while moving.
+    """
+    return hasattr(device, "moveInMicronsToWithoutWaiting") and hasattr(
+        device, "waitUntilStopped"
+    )
+
+
+def wait_until_near(
+    device: LinearMotionDevice,
+    position,
+    radius: float,
+    timeout: float = None,
+    stall_time: float = None,
+) -> bool:
+    """
+    Wait until the device is within radius of position. Returns False if
+    the position has not changed for stall_time seconds (the device stopped
+    short of the radius) or after timeout seconds.
+    """
+    if timeout is None:
+        timeout = blend_timeout
+    if stall_time is None:
+        stall_time = blend_stall_time
+
+    start_time = time.monotonic()
+    previous, changed_time = None, start_time
+    while True:
+        current = tuple(device.positionInMicrons())
+        if math.dist(current, position) <= radius:
+            return True
+
+        now = time.monotonic()
+        if current != previous:
+            previous, changed_time = current, now
+        if now - changed_time > stall_time or now - start_time > timeout:
+            return False
+        time.sleep(poll_interval)
+
+
+def stream_waypoints(
+    device: LinearMotionDevice, waypoints, blend_radius: float = 0.0
+) -> Future:
+    """
+    Move the device through the waypoints, in order, on its worker thread:
+    the caller is not blocked. The future completes when the last waypoint
+    is reached, or fails with the error of the first waypoint that fails
+    (the waypoints after it are not attempted).
+
+    With a blend_radius (in microns) and a device that accepts a new target
+    while moving (moveInMicronsToWithoutWaiting() and waitUntilStopped()),
+    the device is retargeted to the next waypoint as soon as it is within
+    blend_radius of the current one (its position is polled): it goes
+    through the waypoints without stopping, cutting the corners by at most
+    blend_radius. blend_radius must be larger than the positioning
+    precision of the device: a device that stalls outside of it, or does
+    not reach it within blend_timeout, stops at the waypoint. Otherwise the
+    device stops at every waypoint.
+    """
+    waypoints = [tuple(waypoint) for waypoint in waypoints]
+    blends = blend_radius > 0 and can_retarget(device)
+
+    def stream():
+        for waypoint in waypoints[:-1]:
+            if blends:
+                device.moveInMicronsToWithoutWaiting(waypoint)
+                if not wait_until_near(device, waypoint, blend_radius):
+                    # Stalled or too slow: stop at the waypoint
+                    device.waitUntilStopped()
+            else:
+                device.moveInMicronsTo(waypoint)
+
+        if blends:
+            device.moveInMicronsToWithoutWaiting(waypoints[-1])
+            device.waitUntilStopped()
+        else:
+            device.moveInMicronsTo(waypoints[-1])
+
+    return submit_motion(device, stream)
+
+
+def pending_motion(device: LinearMotionDevice) -> Future | None:
+    """
+    The last motion requested for the device. Since the motions of a
+    device are performed in order, all motions are complete when it is.
+    """
+    with _lock:
+        return _pending_motions.get(device)
+
+
+def is_moving(device: LinearMotionDevice) -> bool:
+    future = pending_motion(device)
+    return future is not None and not future.done()
@@ -0,0 +1,178 @@
+"""
+Cached state of motion devices.
+
+Reading the position of a Sutter or Kinesis device is a round trip on its
+serial port. DeviceStateService polls every registered device from a single
+background thread and keeps the last position with its timestamp, so that
+the interface and the actions read the cache instead of waiting on the
+port. A read can require a position fresher than max_age seconds, in which
+case the device is queried directly.
+
+All accesses to a device port go through device_lock(device): the motions
+of hardware.asyncmotion and the motion actions hold it, and the poller
+skips a device whose lock is taken (it is moving, its cached position is
+simply older).
+"""
+
+from __future__ import annotations
+
+import time
+from enum import Enum
+from threading import Event, Lock, RLock, Thread
+from weakref import WeakKeyDictionary
+
+import numpy as np
+
+from mytk.notificationcenter import NotificationCenter
+
+_locks_lock = Lock()
+_device_locks: WeakKeyDictionary = WeakKeyDictionary()
+
+
+def device_lock(device) -> RLock:
+    """
+    The lock that serializes all communication with the device.
+    """
+    with _locks_lock:
+        lock = _device_locks.get(device)
+        if lock is None:
+            lock = RLock()
+            _device_locks[device] = lock
+        return lock
+
+
+class DeviceStateNotification(Enum):
+    """
+    Notifications posted by DeviceStateService, from its polling thread.
+
+    Attributes:
+        did_update_position: The position of a device changed. user_info: 'device', 'position' and 'timestamp'
+    """
+
+    did_update_position = "did_update_position"
+
+
+class DeviceStateService:
+    """
+    Polls the position of motion devices every poll_interval seconds in a
+    background thread and serves positions from a cache.
+
+    Each device is registered with the function that reads its position
+    (positionInMicrons() by default, position() for 1D devices).
+    """
+
+    def __init__(self, poll_interval: float = 0.2, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.poll_interval = poll_interval
+        self._readers = {}
+        self._cache = {}
+        self._lock = Lock()
+        self._quit = Event()
+        self._thread = None
+
+    def add_device(self, device, read_position=None):
+        if read_position is None:
+            read_position = device.positionInMicrons
+        with self._lock:
+            self._readers[device] = read_position
+
+    def remove_device(self, device):
+        with self._lock:
+            self._readers.pop(device, None)
+            self._cache.pop(device, None)
+
+    @property
+    def devices(self) -> list:
+        with self._lock:
+            return list(self._readers)
+
+    def cached_position(self, device) -> tuple | None:
+        """
+        The last (position, timestamp) read, or None.
+        """
+        with self._lock:
+            return self._cache.get(device)
+
+    def position(self, device, max_age: float = None):
+        """
+        The position of the device: the cached value if it was read less
+        than max_age seconds ago (any age if max_age is None), otherwise a
+        new read.
+        """
+        cached = self.cached_position(device)
+        if cached is not None:
+            position, timestamp = cached
+            if max_age is None or time.time() - timestamp <= max_age:
+                return position
+
+        return self.refresh(device)
+
+    def refresh(self, device, blocking: bool = True):
+        """
+        Read the position from the device and update the cache. When not
+        blocking and the device is busy (e.g. moving), return None.
+        """
+        with self._lock:
+            read_position = self._readers.get(device)
+        if read_position is None:
+            raise KeyError(f"{device} is not registered")
+
+        lock = device_lock(device)
+        if not lock.acquire(blocking=blocking):
+            return None
+        try:
+            position = read_position()
+        finally:
+            lock.release()
+
+        timestamp = time.time()
+        with self._lock:
+            previous = self._cache.get(device)
+            self._cache[device] = (position, timestamp)
+
+        # Positions can be NumPy arrays: != compares them element-wise
+        if previous is None or not np.array_equal(previous[0], position):
+            NotificationCenter().post_notification(
+                DeviceStateNotification.did_update_position,
+                notifying_object=self,
+                user_info={
+                    "device": device,
+                    "position": position,
+                    "timestamp": timestamp,
+                },
+            )
+        return position
+
+    def poll(self):
+        """
+        Refresh all the devices that are not busy.
+        """
+        for device in self.devices:
+            try:
+                self.refresh(device, blocking=False)
+            except Exception:
+                pass  # Unavailable devices keep their last position
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.is_running:
+            return
+        self._quit.clear()
+        self._thread = Thread(
+            target=self.run, name="DeviceStateService", daemon=True
+        )
+        self._thread.start()
+
+    def run(self):
+        while not self._quit.is_set():
+            self.poll()
+            self._quit.wait(self.poll_interval)
+
+    def stop(self):
+        self._quit.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -13,6 +13,8 @@ from pyftdi.ftdi import Ftdi #FIXME: should not be here.
 from mytk import *
 from pylablib.devices.Thorlabs import kinesis
 
+from pymicroscope.hardware.simulated import SimulatedKinesisMotor
+
 class KinesisDevice(LinearMotionDevice):
     #SERIAL_NUMBER = "83849018"
 
@@ -34,6 +36,11 @@ class KinesisDevice(LinearMotionDevice):
             return
 
     def doInitializeDevice(self):
+        if self.serialNumber == "debug":
+            self.thorlabs_device = SimulatedKinesisMotor()
+            self.thorlabs_device.open()
+            return
+
         available_devices = kinesis.KinesisDevice.list_devices()
         available_serial_numbers = [ device[0] for device in available_devices]
         
@@ -57,6 +64,9 @@ class KinesisDevice(LinearMotionDevice):
         position_tuple = super().position()
         return position_tuple[0]
 
+    def positionInMicrons(self) -> tuple:
+        return (self.position() / self.nativeStepsPerMicrons,)
+
     def doGetPosition(self) -> tuple:
         return (self.thorlabs_device.get_position(),)
 
@@ -74,6 +84,15 @@ class KinesisDevice(LinearMotionDevice):
         else:
             self.thorlabs_device.wait_move()
 
+    def moveInMicronsToWithoutWaiting(self, position):
+        """Set a new target without waiting: the motor is retargeted at once
+        if it is still moving (see asyncmotion.stream_waypoints)."""
+        native_position = position[0] * self.nativeStepsPerMicrons
+        self.thorlabs_device.move_to(position=native_position)
+
+    def waitUntilStopped(self):
+        self.thorlabs_device.wait_move()
+
     def doHome(self):
         self.thorlabs_device.move_to(position=0)
         if self.thorlabs_device.is_moving() is False:
@@ -0,0 +1,214 @@
+"""
+Serial transport shared by the device drivers.
+
+All the traffic of a port goes through a single I/O thread: a transaction
+(a payload to write and the number of bytes of the response) is queued and
+a concurrent.futures.Future is returned immediately, so that the caller
+(e.g. the Tk thread) never blocks on the port. Transactions are performed
+in order, with a timeout and a number of retries. asyncio code awaits
+transact_async() instead.
+
+The port is anything with write(), read(size) and flush(), like
+serial.Serial or the simulated ports of hardware.simulated. A short read
+is a timeout. transport_for(port) returns the transport of a port, so that
+all the drivers using a port share its thread.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from concurrent.futures import Future
+from queue import Queue
+from threading import Lock, Thread
+from weakref import WeakKeyDictionary
+
+
+class SerialTimeout(TimeoutError):
+    pass
+
+
+class PortMetrics:
+    """
+    Counters of a transport: latency is measured from the time a
+    transaction is queued to the time its response is received, and the
+    throughput over the time the port was busy.
+    """
+
+    def __init__(self):
+        self.transactions = 0
+        self.errors = 0
+        self.retries = 0
+        self.bytes_written = 0
+        self.bytes_read = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.busy_time = 0.0
+
+    @property
+    def mean_latency(self) -> float:
+        if self.transactions == 0:
+            return 0.0
+        return self.total_latency / self.transactions
+
+    @property
+    def throughput(self) -> float:
+        """
+        Bytes written and read per second of I/O.
+        """
+        if self.busy_time == 0:
+            return 0.0
+        return (self.bytes_written + self.bytes_read) / self.busy_time
+
+    def as_dict(self) -> dict:
+        return {
+            "transactions": self.transactions,
+            "errors": self.errors,
+            "retries": self.retries,
+            "bytes_written": self.bytes_written,
+            "bytes_read": self.bytes_read,
+            "mean_latency": self.mean_latency,
+            "max_latency": self.max_latency,
+            "throughput": self.throughput,
+        }
+
+
+class SerialTransaction:
+    def __init__(self, payload: bytes, response_size: int, retries: int):
+        self.payload = payload
+        self.response_size = response_size
+        self.retries = retries
+        self.future = Future()
+        self.queued_time = time.perf_counter()
+
+
+class SerialTransport:
+    """
+    One I/O thread performing the transactions of a port in order.
+    """
+
+    def __init__(self, port, name: str = None, retries: int = 0):
+        self.port = port
+        self.name = name or getattr(port, "port", None) or type(port).__name__
+        self.retries = retries
+        self.metrics = PortMetrics()
+        self._queue = Queue()
+        self._thread = Thread(
+            target=self.run, name=f"serial-{self.name}", daemon=True
+        )
+        self._thread.start()
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread.is_alive()
+
+    def submit(
+        self, payload: bytes, response_size: int = 0, retries: int = None
+    ) -> Future:
+        """
+        Queue a transaction. The future gives the response bytes, or raises
+        SerialTimeout when the response is incomplete after all retries.
+        """
+        if not self.is_running:
+            raise RuntimeError(f"The transport of {self.name} is closed")
+        if retries is None:
+            retries = self.retries
+        transaction = SerialTransaction(payload, response_size, retries)
+        self._queue.put(transaction)
+        return transaction.future
+
+    def transact(
+        self,
+        payload: bytes,
+        response_size: int = 0,
+        timeout: float = None,
+        retries: int = None,
+    ) -> bytes:
+        """
+        Perform a transaction and wait at most timeout seconds for it.
+        """
+        return self.submit(payload, response_size, retries).result(timeout)
+
+    async def transact_async(
+        self, payload: bytes, response_size: int = 0, retries: int = None
+    ) -> bytes:
+        return await asyncio.wrap_future(
+            self.submit(payload, response_size, retries)
+        )
+
+    def perform(self, transaction: SerialTransaction) -> bytes:
+        attempts = transaction.retries + 1
+        for attempt in range(attempts):
+            if attempt > 0:
+                self.metrics.retries += 1
+                reset_input_buffer = getattr(
+                    self.port, "reset_input_buffer", None
+                )
+                if reset_input_buffer is not None:
+                    reset_input_buffer()
+
+            start_time = time.perf_counter()
+            self.port.write(transaction.payload)
+            self.port.flush()
+            self.metrics.bytes_written += len(transaction.payload)
+
+            response = b""
+            if transaction.response_size > 0:
+                response = self.port.read(transaction.response_size)
+            self.metrics.bytes_read += len(response)
+            self.metrics.busy_time += time.perf_counter() - start_time
+
+            if len(response) == transaction.response_size:
+                return response
+
+        raise SerialTimeout(
+            f"Expected {transaction.response_size} bytes from {self.name}, received {len(response)}"
+        )
+
+    def run(self):
+        while True:
+            transaction = self._queue.get()
+            if transaction is None:
+                break
+            if not transaction.future.set_running_or_notify_cancel():
+                continue
+
+            try:
+                response = self.perform(transaction)
+            except Exception as err:
+                self.metrics.errors += 1
+                transaction.future.set_exception(err)
+                continue
+
+            latency = time.perf_counter() - transaction.queued_time
+            self.metrics.transactions += 1
+            self.metrics.total_latency += latency
+            self.metrics.max_latency = max(self.metrics.max_latency, latency)
+            transaction.future.set_result(response)
+
+    def close(self):
+        """
+        Stop the I/O thread once the queued transactions are done.
+        """
+        if self.is_running:
+            self._queue.put(None)
+            self._thread.join()
+        with _lock:
+            if _transports.get(self.port) is self:
+                del _transports[self.port]
+
+
+_lock = Lock()
+_transports: WeakKeyDictionary = WeakKeyDictionary()
+
+
+def transport_for(port, retries: int = 0) -> SerialTransport:
+    """
+    The transport of the port, created on first use.
+    """
+    with _lock:
+        transport = _transports.get(port)
+        if transport is None or not transport.is_running:
+            transport = SerialTransport(port, retries=retries)
+            _transports[port] = transport
+        return transport
@@ -0,0 +1,413 @@
+"""
+Simulated hardware with realistic timing.
+
+The simulated devices take as long as the real ones: a motion follows a
+trapezoidal velocity profile (limited by the acceleration and the maximum
+speed) and then settles, and every command pays the transfer time of its
+bytes on a serial link at the baud rate of the real device. Experiments,
+pipelining and motion overlap can therefore be benchmarked on any computer.
+
+    KinesisDevice(serialNumber="debug")  uses a SimulatedKinesisMotor
+    VMSController(serial_path="debug")   uses a SimulatedVMSPort
+    SimulatedLinearMotionDevice()        is a 3-axis stage (e.g. the Sutter)
+"""
+
+from __future__ import annotations
+
+import math
+import struct
+import time
+from threading import Lock
+
+from hardwarelibrary.motion.linearmotiondevice import LinearMotionDevice
+from hardwarelibrary.physicaldevice import debugClassIdVendor
+
+
+class MotionProfile:
+    """
+    Trapezoidal velocity profile: constant acceleration up to max_speed,
+    constant speed, constant deceleration, then settle_time before the
+    motion is complete. Short motions never reach max_speed (triangular
+    profile). Units are arbitrary but consistent (e.g. native steps and
+    seconds).
+    """
+
+    def __init__(
+        self,
+        max_speed: float,
+        acceleration: float,
+        settle_time: float = 0.0,
+        *args,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        if max_speed <= 0 or acceleration <= 0:
+            raise ValueError("max_speed and acceleration must be positive")
+        self.max_speed = max_speed
+        self.acceleration = acceleration
+        self.settle_time = settle_time
+
+    @property
+    def ramp_distance(self) -> float:
+        """
+        Distance travelled while accelerating to max_speed.
+        """
+        return self.max_speed**2 / (2 * self.acceleration)
+
+    def travel_time(self, distance: float) -> float:
+        """
+        Time to travel the distance, without the settle time.
+        """
+        distance = abs(distance)
+        if distance <= 2 * self.ramp_distance:
+            return 2 * math.sqrt(distance / self.acceleration)
+
+        ramp_time = self.max_speed / self.acceleration
+        cruise_time = (distance - 2 * self.ramp_distance) / self.max_speed
+        return 2 * ramp_time + cruise_time
+
+    def duration(self, distance: float) -> float:
+        return self.travel_time(distance) + self.settle_time
+
+    def travelled(self, distance: float, elapsed: float) -> float:
+        """
+        Distance covered after elapsed seconds on a motion of the given
+        (unsigned) distance.
+        """
+        distance = abs(distance)
+        total = self.travel_time(distance)
+        if elapsed >= total:
+            return distance
+        if elapsed <= 0:
+            return 0.0
+
+        peak_time = min(self.max_speed / self.acceleration, total / 2)
+        peak_speed = self.acceleration * peak_time
+        if elapsed <= peak_time:
+            return self.acceleration * elapsed**2 / 2
+
+        remaining = total - elapsed
+        if remaining <= peak_time:
+            return distance - self.acceleration * remaining**2 / 2
+
+        return peak_speed * peak_time / 2 + peak_speed * (elapsed - peak_time)
+
+
+class SerialLink:
+    """
+    Latency of a serial link: each byte takes bits_per_byte bits (start,
+    8 data bits, stop) at the baud rate, plus a fixed turnaround time for
+    the device to process a command.
+    """
+
+    def __init__(
+        self,
+        baudrate: int = 19200,
+        bits_per_byte: int = 10,
+        turnaround_time: float = 0.0,
+        *args,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.baudrate = baudrate
+        self.bits_per_byte = bits_per_byte
+        self.turnaround_time = turnaround_time
+
+    def transfer_time(self, n_bytes: int) -> float:
+        return n_bytes * self.bits_per_byte / self.baudrate
+
+    def transfer(self, n_bytes: int):
+        time.sleep(self.transfer_time(n_bytes))
+
+    def command(self, n_bytes_out: int, n_bytes_in: int = 0):
+        """
+        A command and its response: the time of a full round trip.
+        """
+        time.sleep(
+            self.transfer_time(n_bytes_out + n_bytes_in) + self.turnaround_time
+        )
+
+
+class SimulatedAxis:
+    """
+    One axis of a simulated device. A motion starts immediately from the
+    current position; a new target given during a motion replaces the
+    previous one (the axis is retargeted from where it is).
+    """
+
+    def __init__(self, profile: MotionProfile, position: float = 0.0):
+        self.profile = profile
+        self._origin = position
+        self._target = position
+        self._start_time = -math.inf
+        self._lock = Lock()
+
+    def _position_at(self, now) -> float:
+        distance = self._target - self._origin
+        travelled = self.profile.travelled(distance, now - self._start_time)
+        return self._origin + math.copysign(travelled, distance)
+
+    @property
+    def position(self) -> float:
+        with self._lock:
+            return self._position_at(time.monotonic())
+
+    @property
+    def target(self) -> float:
+        return self._target
+
+    def move_to(self, target: float):
+        with self._lock:
+            now = time.monotonic()
+            self._origin = self._position_at(now)
+            self._target = target
+            self._start_time = now
+
+    def stop(self):
+        self.move_to(self.position)
+
+    @property
+    def remaining_time(self) -> float:
+        """
+        Time until the axis has reached its target and settled.
+        """
+        with self._lock:
+            distance = self._target - self._origin
+            end_time = self._start_time + self.profile.duration(distance)
+            return max(0.0, end_time - time.monotonic())
+
+    @property
+    def is_moving(self) -> bool:
+        return self.remaining_time > 0
+
+    def wait(self):
+        remaining = self.remaining_time
+        while remaining > 0:
+            time.sleep(remaining)
+            remaining = self.remaining_time
+
+
+class SimulatedKinesisMotor:
+    """
+    Stand-in for pylablib's KinesisMotor with the subset of its interface
+    used by KinesisDevice. Positions are in native steps. The defaults are
+    those of a Z825 actuator (2.6 mm/s, 4 mm/s²) with 128 steps per micron,
+    on the 115200 baud link of the controller.
+    """
+
+    message_size = 6  # Header of an APT message, parameters excluded
+
+    def __init__(
+        self,
+        profile: MotionProfile = None,
+        link: SerialLink = None,
+        *args,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        if profile is None:
+            steps_per_micron = 128
+            profile = MotionProfile(
+                max_speed=2600 * steps_per_micron,
+                acceleration=4000 * steps_per_micron,
+                settle_time=0.02,
+            )
+        if link is None:
+            link = SerialLink(baudrate=115200, turnaround_time=0.001)
+
+        self.link = link
+        self.axis = SimulatedAxis(profile)
+        self.is_opened = False
+        self.channels = None
+        self._reference = 0.0
+
+    def open(self):
+        self.is_opened = True
+
+    def close(self):
+        self.is_opened = False
+
+    def set_supported_channels(self, channels):
+        self.channels = channels
+
+    def set_position_reference(self, position=0):
+        self._reference = self.axis.position - position
+
+    def get_position(self, channel=None):
+        self.link.command(self.message_size, self.message_size + 6)
+        return round(self.axis.position - self._reference)
+
+    def move_to(self, position, channel=None, scale=True):
+        self.link.command(self.message_size + 6)
+        self.axis.move_to(position + self._reference)
+
+    def move_by(self, distance, channel=None, scale=True):
+        self.link.command(self.message_size + 6)
+        self.axis.move_to(self.axis.target + distance)
+
+    def home(self, channel=None):
+        self.move_to(0)
+
+    def stop(self, channel=None):
+        self.link.command(self.message_size)
+        self.axis.stop()
+
+    def is_moving(self, channel=None) -> bool:
+        self.link.command(self.message_size, self.message_size + 14)
+        return self.axis.is_moving
+
+    def wait_move(self, channel=None, timeout=None):
+        self.axis.wait()
+
+    def wait_for_stop(self, channel=None, timeout=None):
+        self.axis.wait()
+
+
+class SimulatedLinearMotionDevice(LinearMotionDevice):
+    """
+    A 3-axis stage with the timing of a Sutter MP-285: the axes move
+    together and a motion blocks until the slowest axis has settled. Every
+    command is sent on a 128000 baud serial link.
+    """
+
+    classIdProduct = 0xFFFC
+    classIdVendor = debugClassIdVendor
+
+    def __init__(
+        self,
+        profile: MotionProfile = None,
+        link: SerialLink = None,
+        nativeStepsPerMicrons: int = 16,
+    ):
+        super().__init__(
+            "debug",
+            SimulatedLinearMotionDevice.classIdProduct,
+            SimulatedLinearMotionDevice.classIdVendor,
+        )
+        self.nativeStepsPerMicrons = nativeStepsPerMicrons
+        if profile is None:
+            profile = MotionProfile(
+                max_speed=3000 * nativeStepsPerMicrons,
+                acceleration=10000 * nativeStepsPerMicrons,
+                settle_time=0.01,
+            )
+        if link is None:
+            link = SerialLink(baudrate=128000, turnaround_time=0.001)
+
+        self.profile = profile
+        self.link = link
+        self.axes = [SimulatedAxis(profile) for _ in range(3)]
+
+    def doInitializeDevice(self):
+        pass
+
+    def doShutdownDevice(self):
+        pass
+
+    def doGetPosition(self) -> tuple:
+        # 'c' + CR, answered by three int32 and CR
+        self.link.command(2, 13)
+        return tuple(round(axis.position) for axis in self.axes)
+
+    def doMoveTo(self, position):
+        # 'm' + three int32 + CR, acknowledged by CR when the move is done
+        self.link.command(14)
+        for axis, target in zip(self.axes, position):
+            axis.move_to(target)
+        for axis in self.axes:
+            axis.wait()
+        self.link.transfer(1)
+
+    def doMoveBy(self, displacement):
+        position = self.doGetPosition()
+        self.doMoveTo([x + dx for x, dx in zip(position, displacement)])
+
+    def doHome(self):
+        self.doMoveTo((0, 0, 0))
+
+
+class SimulatedVMSPort:
+    """
+    Stand-in for the serial.Serial port of the VMS controller. It decodes
+    the commands of VMSController.commands, keeps the values written to the
+    registers and answers the reads, with the latency of the 19200 baud
+    link. Several commands can be sent in a single write.
+    """
+
+    firmware_version = (4, 0, 0)
+    constants = {
+        "READ_FIRMWARE_VERSION": firmware_version,
+        "READ_CID": (0, 0),
+        "READ_CPN": (522,),
+        "READ_SN": (0, 0),
+        "READ_STATE_OF_SWITCHES_AND_TTL_IOS": (3,),
+        "READ_BUILD_TIME": tuple(bytes([c]) for c in b"15:18:41"),
+        "READ_BUILD_DATE": tuple(bytes([c]) for c in b"Feb 06 2012"),
+    }
+
+    def __init__(self, commands: dict, link: SerialLink = None):
+        if link is None:
+            link = SerialLink(baudrate=19200, turnaround_time=0.001)
+        self.link = link
+        self.commands = commands
+        self.commands_by_code = {
+            command["command_code"]: (name, command)
+            for name, command in commands.items()
+        }
+        self.registers = {
+            name.replace("WRITE_", "READ_"): command["parameter"]
+            for name, command in commands.items()
+            if name.startswith("WRITE_")
+        }
+        self.is_open = True
+        self.writes = 0
+        self._input = bytearray()
+
+    @property
+    def in_waiting(self) -> int:
+        return len(self._input)
+
+    def reset_input_buffer(self):
+        self._input.clear()
+
+    def write(self, payload: bytes) -> int:
+        """
+        Receive one or several concatenated commands.
+        """
+        self.link.transfer(len(payload))
+        self.writes += 1
+
+        offset = 0
+        while offset < len(payload):
+            name, command = self.commands_by_code[payload[offset]]
+            request_format = command["command_bytes_format"]
+            size = struct.calcsize(request_format)
+            values = struct.unpack(
+                request_format, payload[offset : offset + size]
+            )
+            offset += size
+
+            if name.startswith("WRITE_"):
+                self.registers[name.replace("WRITE_", "READ_")] = values[1]
+            else:
+                response = self.constants.get(name)
+                if response is None:
+                    response = (self.registers[name],)
+                self._input.extend(
+                    struct.pack(command["response_bytes_format"], *response)
+                )
+            time.sleep(self.link.turnaround_time)
+
+        return len(payload)
+
+    def flush(self):
+        pass
+
+    def read(self, size: int = 1) -> bytes:
+        data = bytes(self._input[:size])
+        del self._input[:size]
+        self.link.transfer(len(data))
+        return data
+
+    def close(self):
+        self.is_open = False
@@ -2,6 +2,7 @@ from mytk import *
 from mytk import __version__ as mytk_version
 from mytk.notificationcenter import NotificationCenter, Notification
 import signal
+import hashlib
 from contextlib import suppress
 import numpy as np
 from queue import Queue as TQueue, Empty, Full
@@ -15,20 +16,36 @@ from pymicroscope.utils.configurable import (
     ConfigurationDialog,
 )
 
-from PIL import Image as PILImage
 from pymicroscope.acquisition.imageprovider import DebugImageProvider, ImageProvider
 from pymicroscope.acquisition.cameraprovider import OpenCVImageProvider
+from pymicroscope.acquisition.lsmprovider import LSMImageProvider
 from pymicroscope.base.mapcontroller import MapController
+from pymicroscope.base.focusmap import FocusMap
 from pymicroscope.experiment.actions import *
-from pymicroscope.experiment.experiments import Experiment, ExperimentStep
+from pymicroscope.experiment.experiments import (
+    Experiment,
+    ExperimentNotification,
+    ExperimentStep,
+)
+from pymicroscope.experiment.journal import ExperimentJournal
+from pymicroscope.experiment.sweeps import WavelengthSweep
 from pymicroscope.app_notifications import MicroscopeAppNotification
 from pymicroscope.base.save_history import SaveHistory
+from pymicroscope.base.pyramid import PyramidBuilder, PyramidReader
+from pymicroscope.base.pyramidviewer import PyramidViewer
+from pymicroscope.base.mosaicpreview import MosaicCanvas, MosaicPreview
+from pymicroscope.base.display import DisplayMapping, pil_image_for_display
 from pymicroscope.utils.thread_utils import is_main_thread
 from pymicroscope.plugins.delay_line import DelaysController
+from pymicroscope.plugins.analysis import AnalysisPool
 
 from hardwarelibrary.physicaldevice import PhysicalDevice
 from hardwarelibrary.motion import SutterDevice
 from pymicroscope.hardware.kinesisdevice import KinesisDevice
+from pymicroscope.hardware.devicestate import (
+    DeviceStateService,
+    DeviceStateNotification,
+)
 
 class MicroscopeApp(App):
     def __init__(self, *args, **kwargs):
@@ -42,7 +59,10 @@ class MicroscopeApp(App):
         self.images_directory:Path = Path("~/Desktop").expanduser()
         self.images_template:str = "Image-{date}-{time}-{i}.tif"
 
+        # Of the last image received: providers are not all 8-bit RGB
         self.shape:tuple = (480, 640, 3)
+        self.dtype:np.dtype = np.dtype(np.uint8)
+        self.display_mapping:DisplayMapping = DisplayMapping()
         self.provider:ImageProvider = None
         
         # Do not modify outside of main thread
@@ -71,12 +91,31 @@ class MicroscopeApp(App):
             
         self.delay_controller = DelaysController()
 
+        # Positions are polled in the background: the interface reads them
+        # without a round trip on the serial port.
+        self.device_state = DeviceStateService(poll_interval=0.2)
+        self.device_state.add_device(self.sample_position_device)
+        if self.delay_device_is_ready:
+            self.device_state.add_device(
+                self.delay_device, read_position=self.delay_device.position
+            )
+        self.position_max_age = 0.5
+
         self.map_controller = MapController(self.sample_position_device)
 
         self.can_start_map = False
+        self.experiment:Experiment = None
+        self.map_experiment:Experiment = None
+        self.map_pyramid_directory:Path = None
+        self.map_viewer:PyramidViewer = None
+        self.mosaic_preview:MosaicPreview = None
+        self.map_autofocus_range = 20
+        # Workers are started with the first frame a plugin wants
+        self.analysis_pool:AnalysisPool = AnalysisPool()
 
         self.app_setup()
         self.build_interface()
+        self.device_state.start()
         self.after(100, self.microscope_run_loop)
         self.root.protocol("WM_DELETE_WINDOW", self.quit)
 
@@ -136,6 +175,12 @@ class MicroscopeApp(App):
             notification_name=MicroscopeAppNotification.did_save_file,
         )
 
+        NotificationCenter().add_observer(
+            self,
+            method=self.handle_notification,
+            notification_name=DeviceStateNotification.did_update_position,
+        )
+
     def background_get_providers(self):
         providers = {
             "Debug": {
@@ -145,6 +190,12 @@ class MicroscopeApp(App):
             }
         }
 
+        providers["Simulated LSM"] = {
+            "type": LSMImageProvider,
+            "args": (),
+            "kwargs": {},
+        }
+
         devices = OpenCVImageProvider.available_devices()
         for device in devices:
             providers[f"OpenCV camera #{device}"] = {
@@ -177,12 +228,17 @@ class MicroscopeApp(App):
         self.build_cameras_menu()
         self.build_delay_interface()
 
+    @property
+    def channels(self) -> int:
+        if len(self.shape) == 2:
+            return 1
+        return self.shape[2]
+
     def build_imageview_interface(self):
         assert is_main_thread()
 
         array = np.zeros(self.shape, dtype=np.uint8)
-        pil_image = PILImage.fromarray(array, mode="RGB")
-        self.image = Image(pil_image=pil_image)
+        self.image = Image(pil_image=pil_image_for_display(array))
 
         self.image.grid_into(
             self.window,
@@ -211,7 +267,7 @@ class MicroscopeApp(App):
         assert is_main_thread()
 
         self.save_controls = Box(
-            label="Image Acquisition", width=500, height=150
+            label="Image Acquisition", width=500, height=180
         )
 
         self.save_controls.grid_into(
@@ -273,6 +329,11 @@ class MicroscopeApp(App):
             self.save_controls, row=2, column=2, pady=10, padx=10, sticky="w"
         )
 
+        self.auto_contrast_checkbox = Checkbox(label="Auto contrast")
+        self.auto_contrast_checkbox.grid_into(
+            self.save_controls, row=1, column=0, pady=2, padx=10, sticky="w"
+        )
+
         self.choose_directory_button = Button(
             "Directory …",
             user_event_callback=self.user_clicked_choose_directory,
@@ -308,6 +369,7 @@ class MicroscopeApp(App):
             self.start_stop_button.label = "Start"
 
         if notification.name == MicroscopeAppNotification.new_image_received:
+            self.analysis_pool.submit_frame(notification.user_info["img_array"])
             with suppress(Full):
                 self.preview_queue.put_nowait(
                     notification.user_info["img_array"]
@@ -316,6 +378,12 @@ class MicroscopeApp(App):
         if notification.name == MicroscopeAppNotification.did_save_file:
             filepath = notification.user_info['filepath']
             self.schedule_on_main_thread(self.history.add, (filepath, ))
+
+        if notification.name == DeviceStateNotification.did_update_position:
+            self.schedule_on_main_thread(
+                self.update_position_labels,
+                (notification.user_info["device"], notification.user_info["position"]),
+            )
                 
         if (
             notification.name
@@ -377,10 +445,30 @@ class MicroscopeApp(App):
             ending2,
         ]
 
+    def interface_cleanup_actions(self) -> list[Action]:
+        # Performed even if the experiment is cancelled half-way. The
+        # experiment starts the capture: the live preview is restored to
+        # what it is now.
+        return [
+            ActionProviderRun(app=self, start=self.is_camera_running),
+            ActionChangeProperty(self.save_button, "is_disabled", False),
+            ActionChangeProperty(
+                self.number_of_images_average, "is_disabled", False
+            ),
+            ActionChangeProperty(self.start_map_aquisition, "label", "Start Map"),
+        ]
+
     def save(self):
         actions = self.save_actions_current_settings()
 
-        Experiment.from_actions(actions).perform_in_background_thread()
+        self.experiment = Experiment.from_actions(actions)
+        for action in self.interface_cleanup_actions():
+            self.experiment.add_cleanup_action(action)
+        self.experiment.perform_in_background_thread()
+
+    def cancel_experiment(self):
+        if self.experiment is not None and self.experiment.is_running:
+            self.experiment.cancel()
 
     def user_changed_camera(self, popup, index):
         self.change_provider()
@@ -388,7 +476,7 @@ class MicroscopeApp(App):
     def build_position_interface(self):
         # assert is_main_thread()
 
-        self.position = Box(label="Position", width=500, height=310)
+        self.position = Box(label="Position", width=500, height=345)
         self.position.grid_into(
             self.window, column=1, row=2, pady=10, padx=10, sticky="nse"
         )
@@ -406,19 +494,22 @@ class MicroscopeApp(App):
         Label("x :").grid_into(
             self.position, row=1, column=0, pady=10, padx=10, sticky="e"
         )
-        Label("0").grid_into(
+        self.x_position_label = Label("0")
+        self.x_position_label.grid_into(
             self.position, row=1, column=1, pady=10, padx=10, sticky="w"
         )
         Label("y :").grid_into(
             self.position, row=1, column=2, pady=10, padx=10, sticky="e"
         )
-        Label("0").grid_into(
+        self.y_position_label = Label("0")
+        self.y_position_label.grid_into(
             self.position, row=1, column=3, pady=10, padx=10, sticky="w"
         )
         Label("z :").grid_into(
             self.position, row=1, column=4, pady=10, padx=10, sticky="e"
         )
-        Label("0").grid_into(
+        self.z_position_label = Label("0")
+        self.z_position_label.grid_into(
             self.position, row=1, column=5, pady=10, padx=10, sticky="w"
         )
 
@@ -642,10 +733,49 @@ class MicroscopeApp(App):
             "can_start_map", self.clear_map_aquisition, "is_enabled"
         )
 
+        self.add_focus_point_button = Button(
+            "Add focus point",
+            user_event_callback=self.user_clicked_add_focus_point,
+        )
+        self.add_focus_point_button.grid_into(
+            self.position,
+            row=8,
+            column=0,
+            columnspan=2,
+            pady=2,
+            padx=2,
+            sticky="w",
+        )
+
+        self.map_autofocus_checkbox = Checkbox(label="Autofocus")
+        self.map_autofocus_checkbox.grid_into(
+            self.position,
+            row=8,
+            column=2,
+            columnspan=2,
+            pady=2,
+            padx=2,
+            sticky="w",
+        )
+
+        self.view_map_button = Button(
+            "View map…",
+            user_event_callback=self.user_clicked_view_map,
+        )
+        self.view_map_button.grid_into(
+            self.position,
+            row=8,
+            column=4,
+            columnspan=2,
+            pady=2,
+            padx=2,
+            sticky="ns",
+        )
+
     def build_delay_interface(self):
 
         self.delay_controls = Box(
-            label="Delay", width=370, height=250
+            label="Delay", width=370, height=330
         )
 
         self.delay_controls.grid_into(
@@ -656,7 +786,8 @@ class MicroscopeApp(App):
         Label("Position in encoder steps").grid_into(
             self.delay_controls, row=1, column=0, columnspan=2, pady=4, padx=4, sticky="w"
         )
-        Label(self.delay_position).grid_into(
+        self.delay_position_label = Label(self.delay_position)
+        self.delay_position_label.grid_into(
             self.delay_controls, row=1, column=1, columnspan=2, pady=4, padx=4, sticky="e"
         )
         Label("Tunable Wavelenght").grid_into(
@@ -764,10 +895,86 @@ class MicroscopeApp(App):
             "has_delay_device", self.start_homing, "is_enabled"
         )
 
+        Label("Sweep from").grid_into(
+            self.delay_controls, row=7, column=0, pady=4, padx=4, sticky="w"
+        )
+        self.sweep_start_entry = IntEntry(value=700, width=5)
+        self.sweep_start_entry.grid_into(
+            self.delay_controls, row=7, column=1, pady=4, padx=4, sticky="e"
+        )
+        Label("to").grid_into(
+            self.delay_controls, row=7, column=2, pady=4, padx=4, sticky="w"
+        )
+        self.sweep_stop_entry = IntEntry(value=900, width=5)
+        self.sweep_stop_entry.grid_into(
+            self.delay_controls, row=7, column=3, pady=4, padx=4, sticky="w"
+        )
+        Label("step").grid_into(
+            self.delay_controls, row=8, column=2, pady=4, padx=4, sticky="w"
+        )
+        self.sweep_step_entry = IntEntry(value=10, width=5)
+        self.sweep_step_entry.grid_into(
+            self.delay_controls, row=8, column=3, pady=4, padx=4, sticky="w"
+        )
+
+        self.start_sweep_button = Button(
+            "Start sweep",
+            user_event_callback=self.user_clicked_start_sweep,
+        )
+        self.start_sweep_button.grid_into(
+            self.delay_controls,
+            row=8,
+            column=0,
+            columnspan=2,
+            pady=4,
+            padx=4,
+            sticky="nsw",
+        )
+        self.bind_properties(
+            "has_delay_device", self.start_sweep_button, "is_enabled"
+        )
+
     def user_clicked_ajustement_placement(self, even, button):
         delay_position = self.delay_controller.linear_relation_delays_and_wavelength(self.wavelenght_entry.value) #modifier l'équation de la relation en fct de la nouvelle implémentation
         ActionMove(position=(delay_position,), linear_motion_device=self.delay_device).perform()
 
+    def user_clicked_start_sweep(self, event, button):
+        if self.experiment is not None and self.experiment.is_running:
+            return
+
+        step = self.sweep_step_entry.value
+        if step <= 0:
+            return
+        wavelengths = np.arange(
+            self.sweep_start_entry.value,
+            self.sweep_stop_entry.value + step / 2,
+            step,
+        )
+
+        # The delay line position is in native steps, the delays in microns
+        current_delay = (
+            self.device_state.position(self.delay_device)
+            / self.delay_device.nativeStepsPerMicrons
+        )
+        sweep = WavelengthSweep(
+            wavelengths,
+            delays_controller=self.delay_controller,
+            delay_device=self.delay_device,
+            n_images=self.number_of_images_average.value,
+            root_dir=self.images_directory,
+            current_delay=current_delay,
+        )
+
+        exp = sweep.create_experiment()
+        exp.steps[0].prepare_actions.insert(
+            0, ActionProviderRun(app=self, start=True)
+        )
+        for action in self.interface_cleanup_actions():
+            exp.add_cleanup_action(action)
+
+        self.experiment = exp
+        exp.perform_in_background_thread()
+
     def user_clicked_homing(self, even, button):
         ActionHome(linear_motion_device=self.delay_device).do_perform()
 
@@ -777,39 +984,193 @@ class MicroscopeApp(App):
     def user_clicked_right_direction(self, even, button):
         ActionMoveBy(d_position=(-5,), linear_motion_device=self.delay_device).do_perform()
 
+    def update_position_labels(self, device, position):
+        assert is_main_thread()
+
+        if device is self.sample_position_device:
+            x, y, z = position
+            self.x_position_label.text = f"{x:.1f}"
+            self.y_position_label.text = f"{y:.1f}"
+            self.z_position_label.text = f"{z:.1f}"
+        elif device is self.delay_device:
+            self.delay_position = position
+            self.delay_position_label.text = str(position)
+
     def user_clicked_saving_position(self, even, button):
         corner_label = button.label
         self.map_controller.parameters[
             corner_label
-        ] = self.sample_position_device.positionInMicrons()
+        ] = self.device_state.position(
+            self.sample_position_device, max_age=self.position_max_age
+        )
 
         if self.map_controller.corners_are_set:
             self.can_start_map = True
 
+    def user_clicked_add_focus_point(self, event, button):
+        if self.map_controller.focus_map is None:
+            self.map_controller.focus_map = FocusMap()
+
+        x, y, z = self.device_state.position(
+            self.sample_position_device, max_age=self.position_max_age
+        )
+        self.map_controller.focus_map.add_point(x, y, z)
+
     def user_clicked_clear(self, even, button):
         for corner in self.map_controller.parameters:
             self.map_controller.parameters[corner] = None
+        self.map_controller.focus_map = None
             
         self.can_start_map = None
 
+    def user_clicked_view_map(self, event, button):
+        directory = self.map_pyramid_directory
+        if directory is None:
+            directory = filedialog.askdirectory(
+                title="Select a map pyramid directory",
+                initialdir=self.images_directory,
+            )
+            if not directory:
+                return
+
+        self.map_viewer = PyramidViewer(directory)
+
     def user_clicked_map_aquisition_image(self, event, button):
-        self.save_map_experience()
+        if self.experiment is not None and self.experiment.is_running:
+            # Another experiment is not stopped by the map button
+            if self.experiment is self.map_experiment:
+                self.cancel_experiment()
+        else:
+            self.save_map_experience()
 
     def save_map_experience(self):
-        positions = self.map_controller.create_positions_for_map()
-        exp = Experiment()
+        grid = self.map_controller.create_position_grid(traversal="serpentine")
+
+        # Same plan in the same directory: resume after a crash instead of
+        # re-imaging the tiles that were already saved.
+        plan = hashlib.sha256(grid.tobytes())
+        plan.update(f"{self.number_of_images_average.value}-{self.images_template}".encode())
+        # Tiles of another depth or number of channels cannot be resumed
+        plan.update(f"{self.channels}-{np.dtype(self.dtype).str}".encode())
+        plan_id = plan.hexdigest()
+        journal = ExperimentJournal(
+            Path(self.images_directory) / "map-journal.jsonl", plan_id=plan_id
+        )
+        exp = Experiment(journal=journal)
+
+        # One pyramid per plane, filled as the tiles are acquired. Tiles of
+        # rotated maps can be left of or below the first corner.
+        pyramids = {}
+        microstep_pixel = self.map_controller.microstep_pixel
+        rows = (grid["y"] - grid["y"].min()) / microstep_pixel
+        columns = (grid["x"] - grid["x"].min()) / microstep_pixel
+
+        canvas = MosaicCanvas.for_positions(
+            np.column_stack([rows, columns]),
+            tile_shape=self.shape[:2],
+            channels=self.channels,
+        )
+        self.mosaic_preview = MosaicPreview(canvas)
+        # (pyramid, position) of the tile of every step, to show the tiles
+        # of the steps skipped when resuming
+        self.map_tiles = []
+
+        # Autofocus once per (x, y) tile, at the center of its z-stack: all
+        # the planes of the tile are placed relative to the focused z.
+        stack_centers = {}
+        for tile in grid:
+            stack_centers.setdefault(
+                (int(tile["tile_ix"]), int(tile["tile_iy"])), []
+            ).append(float(tile["z"]))
+        stack_centers = {
+            key: float(np.mean(z_values)) for key, z_values in stack_centers.items()
+        }
+        autofocus_actions = {}
 
-        for position in positions:
+        for index, tile in enumerate(grid):
+            position = (float(tile["x"]), float(tile["y"]), float(tile["z"]))
+            tile_xy = (int(tile["tile_ix"]), int(tile["tile_iy"]))
+            z_offset = position[2] - stack_centers[tile_xy]
+            # The stage travels while the capture is being prepared
             prepare_actions = []
-            move = ActionMove(
-                position=position,
-                linear_motion_device=self.sample_position_device,
-            )
-            beep1 = ActionSound()
-            prepare_actions.extend([move, beep1])
+            if not self.map_autofocus_checkbox.value:
+                move = ActionMoveAsync(
+                    position=position,
+                    linear_motion_device=self.sample_position_device,
+                )
+                prepare_actions.extend([move, ActionSound()])
+            elif tile_xy not in autofocus_actions:
+                autofocus = ActionAutofocus(
+                    linear_motion_device=self.sample_position_device,
+                    z_range=self.map_autofocus_range,
+                )
+                autofocus_actions[tile_xy] = autofocus
+                center = (position[0], position[1], stack_centers[tile_xy])
+                prepare_actions.extend(
+                    [
+                        ActionMoveAsync(
+                            position=center,
+                            linear_motion_device=self.sample_position_device,
+                        ),
+                        ActionSound(),
+                        ActionProviderRun(app=self, start=True),
+                        ActionWaitForMotion(self.sample_position_device),
+                        autofocus,
+                        ActionMoveToFocusAsync(
+                            position=position,
+                            linear_motion_device=self.sample_position_device,
+                            source=autofocus,
+                            z_offset=z_offset,
+                        ),
+                    ]
+                )
+            else:
+                move = ActionMoveToFocusAsync(
+                    position=position,
+                    linear_motion_device=self.sample_position_device,
+                    source=autofocus_actions[tile_xy],
+                    z_offset=z_offset,
+                )
+                prepare_actions.extend([move, ActionSound()])
 
             save_actions = self.save_actions_current_settings(sound_bell=False)
 
+            plane = int(tile["tile_iz"])
+            if plane not in pyramids:
+                pyramids[plane] = PyramidBuilder(
+                    # One pyramid per plan: another map never merges into it
+                    Path(self.images_directory)
+                    / f"map-pyramid-{plan_id[:12]}-z{plane}",
+                    channels=self.channels,
+                    dtype=self.dtype,
+                )
+            capture = next(
+                action for action in save_actions if isinstance(action, ActionAccumulate)
+            )
+            save_actions.insert(
+                save_actions.index(capture),
+                ActionWaitForMotion(self.sample_position_device),
+            )
+            mean = next(
+                action for action in save_actions if isinstance(action, ActionMean)
+            )
+            tile_position = (float(rows[index]), float(columns[index]))
+            self.map_tiles.append((pyramids[plane], tile_position))
+            save_actions.insert(
+                save_actions.index(mean) + 1,
+                ActionAddToPyramid(
+                    builder=pyramids[plane], source=mean, position=tile_position
+                ),
+            )
+            save_actions.insert(
+                save_actions.index(mean) + 1,
+                ActionAddToMosaic(
+                    preview=self.mosaic_preview,
+                    source=mean,
+                    position=tile_position,
+                ),
+            )
+
             exp_step = ExperimentStep(
                 prepare=prepare_actions,
                 perform=save_actions,
@@ -817,9 +1178,40 @@ class MicroscopeApp(App):
             )
             exp.add_step(experiment_step=exp_step)
 
+        for action in self.interface_cleanup_actions():
+            exp.add_cleanup_action(action)
+
+        if len(pyramids) > 0:
+            self.map_pyramid_directory = next(iter(pyramids.values())).directory
+
+        NotificationCenter().remove_observer(
+            self, notification_name=ExperimentNotification.did_skip_experiment_step
+        )
+        NotificationCenter().add_observer(
+            self,
+            method=self.handle_skipped_map_step,
+            notification_name=ExperimentNotification.did_skip_experiment_step,
+            observed_object=exp,
+        )
+
+        self.experiment = exp
+        self.map_experiment = exp
+        self.start_map_aquisition.label = "Stop Map"
         exp.perform_in_background_thread()
 
 
+    def handle_skipped_map_step(self, notification):
+        """
+        The tile of a step completed before the map was resumed is not
+        acquired again: it is read back from its pyramid into the preview.
+        """
+        builder, (top, left) = self.map_tiles[notification.user_info["current_step"]]
+        top, left = int(round(top)), int(round(left))
+        height, width = self.shape[:2]
+        reader = PyramidReader(builder.directory)
+        tile = reader.read_region(0, top, left, height, width)
+        self.mosaic_preview.add_tile(tile, top, left)
+
     def user_clicked_configure_button(self, event, button):
         restart_after = False
 
@@ -914,6 +1306,9 @@ class MicroscopeApp(App):
         img_array = None
         try:
             img_array = self.image_queue.get(timeout=0.001)
+            if img_array is not None:
+                self.shape = img_array.shape
+                self.dtype = img_array.dtype
 
             NotificationCenter().post_notification(
                 MicroscopeAppNotification.new_image_received,
@@ -929,7 +1324,9 @@ class MicroscopeApp(App):
     def update_preview(self):
         try:
             img_array = self.preview_queue.get_nowait()
-            pil_image = PILImage.fromarray(img_array, mode="RGB")
+            # The only conversion to 8 bits, for the screen
+            self.display_mapping.auto_contrast = self.auto_contrast_checkbox.value
+            pil_image = pil_image_for_display(img_array, self.display_mapping)
             self.image.update_display(pil_image)
         except Empty:
             pass
@@ -941,14 +1338,20 @@ class MicroscopeApp(App):
             
         self.retrieve_new_image()
         self.update_preview()
+        if self.mosaic_preview is not None:
+            self.mosaic_preview.refresh()
         
         self.after(20, self.microscope_run_loop)
 
     def delay_return_home(self):
-        if self.delay_device.position() != 0:
-            ActionHome(linear_motion_device=self.delay_device).perform()
+        # The delay device is only polled when it initialized
+        if self.delay_device in self.device_state.devices:
+            position = self.device_state.position(self.delay_device, max_age=0)
         else:
-            pass
+            position = self.delay_device.position()
+
+        if position != 0:
+            ActionHome(linear_motion_device=self.delay_device).perform()
 
     def about(self):
         Dialog.showinfo(
@@ -962,8 +1365,13 @@ class MicroscopeApp(App):
         webbrowser.open("https://www.dccmlab.ca/")
 
     def quit(self):
+        self.device_state.stop()
         try:
+            self.cancel_experiment()
+            if self.experiment is not None:
+                self.experiment.finalize()
             self.release_provider()
+            self.analysis_pool.close()
             self.delay_return_home()
         except Exception as err:
             pass
@@ -0,0 +1,379 @@
+"""
+Image analysis plugins fed from the frame stream.
+
+An AnalysisPlugin declares what it takes from the stream: one frame out of
+'decimation' and a region of interest. An AnalysisPool runs the plugins in
+a pool of worker processes. Every frame is copied once into a slot of
+shared memory that the workers read in place: only the plugin, the slot
+and the shape of the frame are pickled, never the pixels.
+
+A plugin has at most one frame in analysis. A frame arriving while it is
+busy replaces the frame waiting for it (drop to latest): a slow plugin
+analyzes fewer frames but never stalls the acquisition. The results are
+posted as AnalysisNotification.did_analyze_frame (from a thread of the
+pool: observers updating the interface must schedule it on the main
+thread) and the latency of every plugin is kept in its PluginMetrics.
+"""
+
+from __future__ import annotations
+
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from enum import Enum
+from functools import partial
+from multiprocessing import shared_memory
+from threading import RLock
+
+import numpy as np
+from mytk.notificationcenter import NotificationCenter
+
+from pymicroscope.base.focusmetrics import focus_metrics, region_of_interest
+
+
+class AnalysisNotification(Enum):
+    """
+    Attributes:
+        did_analyze_frame: A plugin analyzed a frame. user_info: 'plugin', 'result', 'frame_index' and 'latency'
+    """
+
+    did_analyze_frame = "did_analyze_frame"
+
+
+class AnalysisPlugin:
+    """
+    Base class of the analysis plugins: subclasses implement analyze(),
+    which is called in a worker process with the region of interest of the
+    frame and returns a dict of results. Plugins are pickled for every
+    frame: they must be small and hold no open resources.
+
+    Args:
+        name: Name of the plugin in the notifications (the class name by
+            default).
+        decimation: Analyze one frame out of decimation.
+        roi: (top, left, height, width), or None for the whole frame.
+    """
+
+    def __init__(self, name=None, decimation: int = 1, roi=None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if decimation < 1:
+            raise ValueError("decimation must be at least 1")
+        self.name = name
+        if name is None:
+            self.name = type(self).__name__
+        self.decimation = decimation
+        self.roi = roi
+
+    def wants_frame(self, frame_index: int) -> bool:
+        return frame_index % self.decimation == 0
+
+    def region(self, img_array: np.ndarray) -> np.ndarray:
+        if self.roi is None:
+            return img_array
+        top, left, height, width = self.roi
+        return img_array[top : top + height, left : left + width]
+
+    def analyze(self, img_array: np.ndarray) -> dict:
+        raise RuntimeError(
+            "You must implement the analyze method in your class"
+        )
+
+
+class IntensityPlugin(AnalysisPlugin):
+    """
+    Intensity statistics, with the fraction of saturated pixels for
+    integer frames.
+    """
+
+    def analyze(self, img_array: np.ndarray) -> dict:
+        result = {
+            "mean": float(img_array.mean()),
+            "min": float(img_array.min()),
+            "max": float(img_array.max()),
+        }
+        if img_array.dtype.kind in "ui":
+            saturation = np.iinfo(img_array.dtype).max
+            result["saturated"] = float(np.mean(img_array == saturation))
+        return result
+
+
+class FocusPlugin(AnalysisPlugin):
+    """
+    A sharpness metric of base.focusmetrics on the region, keeping one
+    pixel out of subsampling.
+    """
+
+    def __init__(self, metric: str = "laplacian", subsampling: int = 2, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if metric not in focus_metrics:
+            raise ValueError(
+                f"metric must be one of {list(focus_metrics)}, got {metric}"
+            )
+        self.metric = metric
+        self.subsampling = subsampling
+
+    def analyze(self, img_array: np.ndarray) -> dict:
+        image = region_of_interest(img_array, decimation=self.subsampling)
+        return {self.metric: focus_metrics[self.metric](image)}
+
+
+class PluginMetrics:
+    """
+    Counters of a plugin: latency is measured from the time a frame is
+    submitted to the pool to the time its result is received, including
+    the time it waited for the plugin.
+    """
+
+    def __init__(self):
+        self.frames_submitted = 0
+        self.frames_analyzed = 0
+        self.frames_dropped = 0
+        self.errors = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.last_latency = 0.0
+        self.last_result = None
+        self.last_error = None
+
+    @property
+    def mean_latency(self) -> float:
+        if self.frames_analyzed == 0:
+            return 0.0
+        return self.total_latency / self.frames_analyzed
+
+    def as_dict(self) -> dict:
+        return {
+            "frames_submitted": self.frames_submitted,
+            "frames_analyzed": self.frames_analyzed,
+            "frames_dropped": self.frames_dropped,
+            "errors": self.errors,
+            "mean_latency": self.mean_latency,
+            "max_latency": self.max_latency,
+            "last_latency": self.last_latency,
+        }
+
+
+class PluginState:
+    def __init__(self):
+        self.metrics = PluginMetrics()
+        self.is_busy = False
+        # ((slot, shape, dtype), frame_index, submit_time) of the frame waiting
+        self.pending = None
+
+
+# The shared memory of the pool, in the worker processes
+_worker_memory = None
+
+
+def _attach_worker(memory_name: str):
+    global _worker_memory
+    _worker_memory = shared_memory.SharedMemory(name=memory_name)
+
+
+def _analyze_in_worker(plugin: AnalysisPlugin, offset: int, shape, dtype):
+    img_array = np.ndarray(shape, dtype, _worker_memory.buf, offset)
+    return plugin.analyze(plugin.region(img_array))
+
+
+class AnalysisPool:
+    """
+    Runs the plugins on the frames given to submit_frame() in max_workers
+    processes. The shared memory and the workers are created with the
+    first frame, and again (when no analysis is running) for frames
+    larger than the slots or when plugins are added.
+    """
+
+    def __init__(self, plugins=(), max_workers: int = 2, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_workers = max_workers
+        self.plugins = []
+        self.states = {}
+        self.frame_index = 0
+
+        self.memory = None
+        self.executor = None
+        # A worker died: the pool is allocated again with the next frame
+        self.is_broken = False
+        self.slot_size = 0
+        self.n_slots = 0
+        self._free_slots = []
+        self._references = []
+        self._lock = RLock()
+
+        for plugin in plugins:
+            self.add_plugin(plugin)
+
+    def add_plugin(self, plugin: AnalysisPlugin):
+        with self._lock:
+            self.plugins.append(plugin)
+            self.states[plugin] = PluginState()
+
+    def remove_plugin(self, plugin: AnalysisPlugin):
+        with self._lock:
+            self.plugins.remove(plugin)
+            state = self.states.pop(plugin)
+            if state.pending is not None:
+                self.release_slot(state.pending[0][0])
+
+    def metrics(self, plugin: AnalysisPlugin) -> PluginMetrics:
+        return self.states[plugin].metrics
+
+    @property
+    def is_idle(self) -> bool:
+        return all(not state.is_busy for state in self.states.values())
+
+    def slots_needed(self) -> int:
+        # One running and one pending frame per plugin, and the new frame
+        return 2 * len(self.plugins) + 1
+
+    def allocate(self, slot_size: int):
+        self.close()
+        self.slot_size = slot_size
+        self.n_slots = self.slots_needed()
+        self.memory = shared_memory.SharedMemory(
+            create=True, size=self.n_slots * slot_size
+        )
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            initializer=_attach_worker,
+            initargs=(self.memory.name,),
+        )
+        self._free_slots = list(range(self.n_slots))
+        self._references = [0] * self.n_slots
+        self.is_broken = False
+
+    def slot_array(self, slot: int, shape, dtype) -> np.ndarray:
+        return np.ndarray(shape, dtype, self.memory.buf, slot * self.slot_size)
+
+    def release_slot(self, slot: int):
+        self._references[slot] -= 1
+        if self._references[slot] == 0:
+            self._free_slots.append(slot)
+
+    def submit_frame(self, img_array: np.ndarray):
+        """
+        Give the frame to the plugins that want it: it is copied to shared
+        memory and this returns without waiting for any analysis.
+        """
+        if img_array is None:
+            return
+
+        frame_index = self.frame_index
+        self.frame_index += 1
+        submit_time = time.perf_counter()
+
+        with self._lock:
+            plugins = [p for p in self.plugins if p.wants_frame(frame_index)]
+            if len(plugins) == 0:
+                return
+
+            if (
+                self.memory is None
+                or img_array.nbytes > self.slot_size
+                or self.n_slots < self.slots_needed()
+                or self.is_broken
+            ):
+                if not self.is_idle:
+                    for plugin in plugins:
+                        self.states[plugin].metrics.frames_dropped += 1
+                    return
+                self.allocate(max(img_array.nbytes, self.slot_size))
+
+            slot = self._free_slots.pop()
+            self._references[slot] = 1
+
+        frame = (slot, img_array.shape, img_array.dtype)
+        np.copyto(self.slot_array(*frame), img_array)
+
+        with self._lock:
+            for plugin in plugins:
+                state = self.states[plugin]
+                state.metrics.frames_submitted += 1
+                self._references[slot] += 1
+                if not state.is_busy:
+                    self.dispatch(plugin, frame, frame_index, submit_time)
+                else:
+                    if state.pending is not None:
+                        state.metrics.frames_dropped += 1
+                        self.release_slot(state.pending[0][0])
+                    state.pending = (frame, frame_index, submit_time)
+            self.release_slot(slot)
+
+    def dispatch(self, plugin, frame, frame_index, submit_time):
+        slot, shape, dtype = frame
+        state = self.states[plugin]
+        try:
+            future = self.executor.submit(
+                _analyze_in_worker, plugin, slot * self.slot_size, shape, dtype.str
+            )
+        except BrokenProcessPool as err:
+            # Not reallocated here: the slots of the other plugins are in use
+            self.is_broken = True
+            state.metrics.errors += 1
+            state.metrics.last_error = err
+            self.release_slot(slot)
+            return
+
+        state.is_busy = True
+        future.add_done_callback(
+            partial(self.did_analyze, plugin, slot, frame_index, submit_time)
+        )
+
+    def did_analyze(self, plugin, slot, frame_index, submit_time, future):
+        latency = time.perf_counter() - submit_time
+        result = None
+        with self._lock:
+            self.release_slot(slot)
+            state = self.states.get(plugin)
+            if state is None or future.cancelled():
+                return
+            state.is_busy = False
+
+            metrics = state.metrics
+            if future.exception() is not None:
+                metrics.errors += 1
+                metrics.last_error = future.exception()
+                if isinstance(future.exception(), BrokenProcessPool):
+                    self.is_broken = True
+            else:
+                result = future.result()
+                metrics.frames_analyzed += 1
+                metrics.total_latency += latency
+                metrics.max_latency = max(metrics.max_latency, latency)
+                metrics.last_latency = latency
+                metrics.last_result = result
+
+            if state.pending is not None:
+                pending, state.pending = state.pending, None
+                self.dispatch(plugin, *pending)
+
+        if result is not None:
+            NotificationCenter().post_notification(
+                AnalysisNotification.did_analyze_frame,
+                notifying_object=self,
+                user_info={
+                    "plugin": plugin,
+                    "result": result,
+                    "frame_index": frame_index,
+                    "latency": latency,
+                },
+            )
+
+    def close(self):
+        """
+        Stop the workers (the analyses running are completed, the frames
+        waiting are dropped) and free the shared memory.
+        """
+        with self._lock:
+            for state in self.states.values():
+                state.pending = None
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
+        with self._lock:
+            for state in self.states.values():
+                state.is_busy = False
+        if self.memory is not None:
+            self.memory.close()
+            self.memory.unlink()
+            self.memory = None
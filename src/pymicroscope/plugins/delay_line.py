@@ -1,17 +1,71 @@
 from struct import *
 from mytk import *
+import numpy as np
 
 
 #for eventully automated
 class DelaysController(Bindable):
+    calibrations = ("linear", "polynomial", "table")
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.port = None
         self.a_value = -0.302
         self.b_value = 285
 
+        # 'linear': a_value * wavelength + b_value
+        # 'polynomial': np.polyval(polynomial_coefficients, wavelength)
+        # 'table': interpolated in (calibration_wavelengths, calibration_delays)
+        self.calibration = "linear"
+        self.polynomial_coefficients = None
+        self.calibration_wavelengths = None
+        self.calibration_delays = None
+
     def linear_relation_delays_and_wavelength(self, wavelength_value):
         '''By the value setting at the interface, the linear relation delays and wavelength fonction return the delay position at a certain wavelenght'''
         delay_position = (self.a_value)*wavelength_value + self.b_value
         return delay_position
 
+    def set_calibration_table(self, wavelengths, delays):
+        '''Use a measured table of delays: delays between the wavelengths of the table are interpolated linearly'''
+        wavelengths = np.asarray(wavelengths, dtype=float)
+        delays = np.asarray(delays, dtype=float)
+        if wavelengths.shape != delays.shape or wavelengths.size < 2:
+            raise ValueError("The calibration table needs at least two (wavelength, delay) pairs")
+
+        order = np.argsort(wavelengths)
+        self.calibration_wavelengths = wavelengths[order]
+        self.calibration_delays = delays[order]
+        self.calibration = "table"
+
+    def set_calibration_polynomial(self, coefficients):
+        '''Use a polynomial of the wavelength (coefficients from the highest degree, as for np.polyval)'''
+        self.polynomial_coefficients = np.asarray(coefficients, dtype=float)
+        self.calibration = "polynomial"
+
+    def delays_for_wavelengths(self, wavelengths) -> np.ndarray:
+        '''The delay for every wavelength, computed at once with the current calibration'''
+        wavelengths = np.asarray(wavelengths, dtype=float)
+
+        if self.calibration == "linear":
+            return self.a_value * wavelengths + self.b_value
+        elif self.calibration == "polynomial":
+            return np.polyval(self.polynomial_coefficients, wavelengths)
+        elif self.calibration == "table":
+            if np.any(wavelengths < self.calibration_wavelengths[0]) or np.any(
+                wavelengths > self.calibration_wavelengths[-1]
+            ):
+                raise ValueError("Wavelengths outside of the calibration table")
+            return np.interp(wavelengths, self.calibration_wavelengths, self.calibration_delays)
+
+        raise ValueError(f"calibration must be one of {self.calibrations}, got {self.calibration}")
+
+    @staticmethod
+    def sweep_order(delays, current_delay=None) -> np.ndarray:
+        '''Order in which to visit the delays with the least travel of the delay line: a single monotonic sweep, starting from the end closest to the current delay'''
+        delays = np.asarray(delays, dtype=float)
+        order = np.argsort(delays, kind="stable")
+        if current_delay is not None and len(order) > 0:
+            if abs(delays[order[-1]] - current_delay) < abs(delays[order[0]] - current_delay):
+                order = order[::-1]
+        return order
@@ -2,3 +2,21 @@ from threading import current_thread, main_thread
 
 def is_main_thread() -> bool:
     return current_thread() == main_thread()
+
+
+def call_when_done(widget, future, callback, interval: int = 20):
+    """
+    Call callback(future) on the main thread once the future is done. The
+    done callbacks of a future run on the thread that completes it, where
+    Tk must not be used: the future is checked every interval milliseconds
+    with the after() of the mytk widget instead.
+    """
+    assert is_main_thread()
+
+    def check_future():
+        if future.done():
+            callback(future)
+        else:
+            widget.after(interval, check_future)
+
+    check_future()
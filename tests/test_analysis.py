@@ -0,0 +1,186 @@
+import envtest  # setup environment for testing
+import os
+import time
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+from mytk.notificationcenter import NotificationCenter
+
+from pymicroscope.plugins.analysis import (
+    AnalysisNotification,
+    AnalysisPlugin,
+    AnalysisPool,
+    FocusPlugin,
+    IntensityPlugin,
+)
+
+
+class SlowPlugin(AnalysisPlugin):
+    def analyze(self, img_array):
+        time.sleep(0.2)
+        return {"value": int(img_array[0, 0])}
+
+
+class FailingPlugin(AnalysisPlugin):
+    def analyze(self, img_array):
+        raise RuntimeError("Analysis failed")
+
+
+class CrashingPlugin(AnalysisPlugin):
+    def analyze(self, img_array):
+        if img_array[0, 0] == 0:
+            os._exit(1)  # The worker dies
+        return {"value": int(img_array[0, 0])}
+
+
+class AnalysisPluginTestCase(envtest.CoreTestCase):
+    def test000_init(self):
+        plugin = IntensityPlugin()
+        self.assertEqual(plugin.name, "IntensityPlugin")
+        with self.assertRaises(ValueError):
+            IntensityPlugin(decimation=0)
+        with self.assertRaises(ValueError):
+            FocusPlugin(metric="sharpness")
+        with self.assertRaises(RuntimeError):
+            AnalysisPlugin().analyze(np.zeros((4, 4)))
+
+    def test010_decimation_and_roi(self):
+        plugin = IntensityPlugin(decimation=3, roi=(10, 20, 5, 6))
+        self.assertEqual(
+            [i for i in range(10) if plugin.wants_frame(i)], [0, 3, 6, 9]
+        )
+        img = np.zeros((100, 100), dtype=np.uint8)
+        img[10:15, 20:26] = 255
+        result = plugin.analyze(plugin.region(img))
+        self.assertEqual(result["min"], 255)
+        self.assertEqual(result["saturated"], 1.0)
+
+
+class AnalysisPoolTestCase(envtest.CoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.notifications = []
+        NotificationCenter().add_observer(
+            self,
+            method=self.handle_notification,
+            notification_name=AnalysisNotification.did_analyze_frame,
+        )
+        self.pool = AnalysisPool(max_workers=2)
+
+    def tearDown(self):
+        self.pool.close()
+        NotificationCenter().remove_observer(self)
+        super().tearDown()
+
+    def handle_notification(self, notification):
+        self.notifications.append(notification)
+
+    def wait_until_idle(self, timeout=5):
+        deadline = time.time() + timeout
+        while not self.pool.is_idle and time.time() < deadline:
+            time.sleep(0.01)
+
+    def test000_results_are_notified(self):
+        intensity = IntensityPlugin()
+        focus = FocusPlugin(decimation=2)
+        self.pool.add_plugin(intensity)
+        self.pool.add_plugin(focus)
+
+        for value in range(4):
+            self.pool.submit_frame(np.full((48, 64, 3), value, dtype=np.uint16))
+            self.wait_until_idle()
+
+        self.assertEqual(self.pool.metrics(intensity).frames_analyzed, 4)
+        self.assertEqual(self.pool.metrics(focus).frames_submitted, 2)
+        self.assertEqual(self.pool.metrics(intensity).last_result["mean"], 3)
+
+        user_info = self.notifications[-1].user_info
+        self.assertIn(user_info["plugin"], (intensity, focus))
+        self.assertGreater(user_info["latency"], 0)
+        self.assertEqual(len(self.notifications), 6)
+
+    def test010_slow_plugin_drops_to_latest(self):
+        plugin = SlowPlugin()
+        self.pool.add_plugin(plugin)
+
+        start_time = time.perf_counter()
+        for value in range(10):
+            self.pool.submit_frame(np.full((480, 640), value, dtype=np.uint8))
+        # The acquisition never waits for the analysis
+        self.assertLess(time.perf_counter() - start_time, 0.15)
+
+        time.sleep(0.1)
+        self.wait_until_idle()
+        metrics = self.pool.metrics(plugin)
+        self.assertEqual(metrics.frames_analyzed, 2)
+        self.assertEqual(metrics.frames_dropped, 8)
+        self.assertEqual(metrics.last_result, {"value": 9})
+        self.assertGreater(metrics.mean_latency, 0.2)
+        self.assertEqual(metrics.as_dict()["frames_submitted"], 10)
+
+    def test020_errors_are_counted(self):
+        plugin = FailingPlugin()
+        self.pool.add_plugin(plugin)
+        self.pool.submit_frame(np.zeros((10, 10)))
+        self.wait_until_idle()
+
+        metrics = self.pool.metrics(plugin)
+        self.assertEqual(metrics.errors, 1)
+        self.assertIsInstance(metrics.last_error, RuntimeError)
+        self.assertEqual(self.notifications, [])
+
+    def test030_larger_frames_reallocate(self):
+        plugin = IntensityPlugin()
+        self.pool.add_plugin(plugin)
+        self.pool.submit_frame(np.ones((10, 10), dtype=np.uint8))
+        self.wait_until_idle()
+        self.pool.submit_frame(np.full((100, 100), 2.0))
+        self.wait_until_idle()
+
+        self.assertEqual(self.pool.slot_size, 100 * 100 * 8)
+        self.assertEqual(self.pool.metrics(plugin).last_result["mean"], 2.0)
+
+    def test035_dead_worker_reallocates(self):
+        plugin = CrashingPlugin()
+        self.pool.add_plugin(plugin)
+        self.pool.submit_frame(np.zeros((10, 10), dtype=np.uint8))
+        self.wait_until_idle()
+
+        metrics = self.pool.metrics(plugin)
+        self.assertEqual(metrics.errors, 1)
+        self.assertIsInstance(metrics.last_error, BrokenProcessPool)
+        self.assertTrue(self.pool.is_broken)
+
+        self.pool.submit_frame(np.ones((10, 10), dtype=np.uint8))
+        self.wait_until_idle()
+        self.assertFalse(self.pool.is_broken)
+        self.assertEqual(metrics.last_result, {"value": 1})
+
+    def test037_broken_pool_at_dispatch(self):
+        plugin = IntensityPlugin()
+        self.pool.add_plugin(plugin)
+        self.pool.submit_frame(np.ones((10, 10), dtype=np.uint8))
+        self.wait_until_idle()
+
+        def submit(*args, **kwargs):
+            raise BrokenProcessPool("A worker died")
+
+        self.pool.executor.submit = submit
+        self.pool.submit_frame(np.ones((10, 10), dtype=np.uint8))
+        metrics = self.pool.metrics(plugin)
+        self.assertEqual(metrics.errors, 1)
+        self.assertTrue(self.pool.is_idle)
+        self.assertEqual(len(self.pool._free_slots), self.pool.n_slots)
+
+        self.pool.submit_frame(np.full((10, 10), 2, dtype=np.uint8))
+        self.wait_until_idle()
+        self.assertEqual(metrics.last_result["mean"], 2)
+
+    def test040_no_plugin_no_workers(self):
+        self.pool.submit_frame(np.zeros((10, 10)))
+        self.pool.submit_frame(None)
+        self.assertIsNone(self.pool.executor)
+
+
+if __name__ == "__main__":
+    envtest.main()
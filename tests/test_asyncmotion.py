@@ -0,0 +1,366 @@
+import envtest  # setup environment for testing
+import time
+from threading import Thread
+
+from pymicroscope.experiment.actions import *
+from pymicroscope.experiment.experiments import Experiment, ExperimentStep
+from pymicroscope.experiment.estimator import ExperimentEstimator
+from pymicroscope.experiment.cancellation import ActionCancelled
+from pymicroscope.hardware import asyncmotion
+from pymicroscope.hardware.simulated import MotionProfile, SimulatedAxis
+
+
+class SlowDevice:
+    def __init__(self, travel_time=0.1):
+        self.travel_time = travel_time
+        self.position = (0, 0, 0)
+        self.history = []
+
+    def moveInMicronsTo(self, position):
+        time.sleep(self.travel_time)
+        self.position = tuple(position)
+        self.history.append(("to", self.position))
+
+    def moveInMicronsBy(self, displacement):
+        time.sleep(self.travel_time)
+        self.position = tuple(
+            p + d for p, d in zip(self.position, displacement)
+        )
+        self.history.append(("by", self.position))
+
+    def home(self):
+        time.sleep(self.travel_time)
+        self.position = (0, 0, 0)
+        self.history.append(("home", self.position))
+
+
+class BrokenDevice(SlowDevice):
+    def moveInMicronsTo(self, position):
+        raise RuntimeError("unable to move the device.")
+
+
+class AsyncMotionTestCase(envtest.CoreTestCase):
+    def test000_init(self):
+        device = SlowDevice()
+        self.assertIsNone(asyncmotion.pending_motion(device))
+        self.assertFalse(asyncmotion.is_moving(device))
+
+    def test010_move_returns_immediately(self):
+        device = SlowDevice(travel_time=0.2)
+        start_time = time.time()
+        motion = asyncmotion.move_to(device, (1, 2, 3))
+        self.assertLess(time.time() - start_time, 0.1)
+        self.assertTrue(asyncmotion.is_moving(device))
+
+        motion.result()
+        self.assertEqual(device.position, (1, 2, 3))
+        self.assertFalse(asyncmotion.is_moving(device))
+
+    def test020_motions_of_a_device_are_in_order(self):
+        device = SlowDevice(travel_time=0.01)
+        asyncmotion.move_to(device, (1, 1, 1))
+        asyncmotion.move_by(device, (1, 0, 0))
+        asyncmotion.home(device)
+        asyncmotion.move_to(device, (5, 5, 5))
+        asyncmotion.pending_motion(device).result()
+
+        self.assertEqual(
+            device.history,
+            [
+                ("to", (1, 1, 1)),
+                ("by", (2, 1, 1)),
+                ("home", (0, 0, 0)),
+                ("to", (5, 5, 5)),
+            ],
+        )
+
+    def test030_devices_move_in_parallel(self):
+        devices = [SlowDevice(travel_time=0.2) for _ in range(3)]
+        start_time = time.time()
+        for device in devices:
+            asyncmotion.move_to(device, (1, 0, 0))
+        ActionWaitForMotion(devices).perform()
+        self.assertLess(time.time() - start_time, 0.5)
+
+
+class AsyncMotionActionsTestCase(envtest.CoreTestCase):
+    def test000_init(self):
+        device = SlowDevice()
+        self.assertIsNotNone(ActionMoveAsync((0, 0, 0), device))
+        self.assertIsNotNone(ActionMoveByAsync((0, 0, 0), device))
+        self.assertIsNotNone(ActionHomeAsync(device))
+        self.assertIsNotNone(ActionWaitForMotion(device))
+
+    def test010_work_during_travel(self):
+        device = SlowDevice(travel_time=0.2)
+        move = ActionMoveAsync((10, 0, 0), device)
+        work = ActionWait(delay=0.2)
+        barrier = ActionWaitForMotion(device)
+
+        start_time = time.time()
+        move.perform()
+        work.perform()
+        results = barrier.perform()
+        self.assertLess(time.time() - start_time, 0.35)
+        self.assertEqual(device.position, (10, 0, 0))
+        self.assertLess(results["wait_time"], 0.1)
+        self.assertTrue(move.output.done())
+
+    def test015_move_relative_to_focus(self):
+        device = SlowDevice(travel_time=0.01)
+        autofocus = Action()
+        move = ActionMoveToFocusAsync((10, 20, 30), device, source=autofocus, z_offset=-2)
+
+        # Autofocus not performed (e.g. skipped on resume): planned z
+        move.perform()
+        move.output.result()
+        self.assertEqual(device.position, (10, 20, 30))
+
+        autofocus.output = 52.5
+        results = move.perform()
+        move.output.result()
+        self.assertEqual(device.position, (10, 20, 50.5))
+        self.assertEqual(results["position"], (10, 20, 50.5))
+
+    def test020_barrier_without_motion(self):
+        ActionWaitForMotion(SlowDevice()).perform()
+
+    def test030_motion_error_raised_at_barrier(self):
+        device = BrokenDevice()
+        ActionMoveAsync((1, 0, 0), device).perform()
+        with self.assertRaises(RuntimeError):
+            ActionWaitForMotion(device).perform()
+
+    def test040_cancel_barrier(self):
+        device = SlowDevice(travel_time=1)
+        ActionMoveAsync((1, 0, 0), device).perform()
+        barrier = ActionWaitForMotion(device)
+        Thread(
+            target=lambda: (
+                time.sleep(0.1),
+                barrier.cancellation_token.cancel(),
+            )
+        ).start()
+
+        start_time = time.time()
+        with self.assertRaises(ActionCancelled):
+            barrier.perform()
+        self.assertLess(time.time() - start_time, 0.5)
+        asyncmotion.pending_motion(device).result()
+
+    def test050_experiment_step(self):
+        device = SlowDevice(travel_time=0.05)
+        exp = Experiment()
+        for x in range(3):
+            exp.add_step(
+                ExperimentStep(
+                    prepare=[ActionMoveAsync((x, 0, 0), device)],
+                    perform=[ActionWait(0.01), ActionWaitForMotion(device)],
+                )
+            )
+        exp.perform()
+        self.assertEqual(
+            [position for _, position in device.history],
+            [(0, 0, 0), (1, 0, 0), (2, 0, 0)],
+        )
+
+    def test060_estimator_overlaps_travel(self):
+        device = SlowDevice()
+        estimator = ExperimentEstimator()
+        estimator.device_speeds[device] = 100
+
+        exp = Experiment()
+        exp.add_step(
+            ExperimentStep(
+                prepare=[ActionMoveAsync((100, 0, 0), device)],
+                perform=[ActionWait(0.4), ActionWaitForMotion(device)],
+            )
+        )
+        estimate = estimator.estimate(exp)
+        self.assertAlmostEqual(estimate["duration"], 1.0)
+
+        exp = Experiment()
+        exp.add_step(
+            ExperimentStep(
+                prepare=[ActionMoveAsync((100, 0, 0), device)],
+                perform=[ActionWait(1.5), ActionWaitForMotion(device)],
+            )
+        )
+        estimate = estimator.estimate(exp)
+        self.assertAlmostEqual(estimate["duration"], 1.5)
+
+
+class StreamingDevice:
+    """
+    Accepts a new target while moving, like a Kinesis motor. The position
+    of the axis is recorded every time it is given a new target.
+    """
+
+    def __init__(self, speed=1000):
+        self.axis = SimulatedAxis(MotionProfile(max_speed=speed, acceleration=100 * speed))
+        self.targets = []
+        self.retarget_positions = []
+
+    @property
+    def position(self):
+        return (self.axis.position,)
+
+    def positionInMicrons(self):
+        return self.position
+
+    def moveInMicronsToWithoutWaiting(self, position):
+        self.retarget_positions.append(self.axis.position)
+        self.targets.append(tuple(position))
+        self.axis.move_to(position[0])
+
+    def waitUntilStopped(self):
+        self.axis.wait()
+
+    def moveInMicronsTo(self, position):
+        self.moveInMicronsToWithoutWaiting(position)
+        self.waitUntilStopped()
+
+
+class ImpreciseDevice(StreamingDevice):
+    """
+    Stops 1 µm short of every target, outside of any small blend radius.
+    """
+
+    def moveInMicronsToWithoutWaiting(self, position):
+        super().moveInMicronsToWithoutWaiting((position[0] - 1,))
+
+
+class FailingWaypointDevice(SlowDevice):
+    def moveInMicronsTo(self, position):
+        if position[0] == 2:
+            raise RuntimeError("unable to move the device.")
+        super().moveInMicronsTo(position)
+
+
+class CoordinatedMotionTestCase(envtest.CoreTestCase):
+    def test000_init(self):
+        device = SlowDevice()
+        self.assertIsNotNone(ActionCoordinatedMove([(device, (0, 0, 0))]))
+        self.assertIsNotNone(ActionTrajectory([(0, 0, 0)], device))
+        with self.assertRaises(ValueError):
+            ActionTrajectory([], device)
+
+    def test010_coordinated_move_is_concurrent(self):
+        sample = SlowDevice(travel_time=0.2)
+        delay = SlowDevice(travel_time=0.2)
+        action = ActionCoordinatedMove([(sample, (1, 2, 3)), (delay, (100,))])
+
+        start_time = time.time()
+        results = action.perform()
+        self.assertLess(time.time() - start_time, 0.35)
+        self.assertEqual(sample.position, (1, 2, 3))
+        self.assertEqual(delay.position, (100,))
+        self.assertEqual(results["positions"], [(1, 2, 3), (100,)])
+
+    def test020_coordinated_move_error(self):
+        action = ActionCoordinatedMove(
+            [(SlowDevice(), (1, 0, 0)), (BrokenDevice(), (1, 0, 0))]
+        )
+        with self.assertRaises(RuntimeError):
+            action.perform()
+
+    def test030_queued_trajectory(self):
+        device = SlowDevice(travel_time=0.01)
+        waypoints = [(x, 0, 0) for x in range(5)]
+        action = ActionTrajectory(waypoints, device)
+        results = action.perform()
+        self.assertEqual(results["waypoints"], 5)
+        self.assertEqual([p for _, p in device.history], waypoints)
+
+    def test035_queued_trajectory_error(self):
+        device = FailingWaypointDevice(travel_time=0.01)
+        waypoints = [(x, 0, 0) for x in range(5)]
+        motion = asyncmotion.stream_waypoints(device, waypoints)
+        with self.assertRaises(RuntimeError):
+            motion.result()
+        self.assertEqual([p for _, p in device.history], waypoints[:2])
+
+    def test040_streamed_trajectory(self):
+        device = StreamingDevice()
+        waypoints = [(x,) for x in range(10)]
+        action = ActionTrajectory(waypoints, device, wait=False, blend_radius=0.1)
+
+        start_time = time.time()
+        action.perform()
+        self.assertLess(time.time() - start_time, 0.05)
+        ActionWaitForMotion(device).perform()
+        self.assertEqual(device.targets, waypoints)
+        self.assertEqual(device.position, (9,))
+
+    def test045_blended_trajectory_reaches_every_waypoint(self):
+        # Not monotonic: retargeting at once would never reach 10
+        waypoints = [(10,), (2,), (8,)]
+        device = StreamingDevice()
+        ActionTrajectory(waypoints, device, blend_radius=0.5).perform()
+        self.assertEqual(device.position, (8,))
+        self.assertEqual(device.targets, waypoints)
+        self.assertAlmostEqual(device.retarget_positions[1], 10, delta=0.5)
+        self.assertAlmostEqual(device.retarget_positions[2], 2, delta=0.5)
+
+        # Without blend_radius, the device stops at every waypoint
+        device = StreamingDevice()
+        ActionTrajectory(waypoints, device).perform()
+        self.assertEqual(device.retarget_positions, [0, 10, 2])
+
+    def test047_blended_trajectory_stalled_device(self):
+        waypoints = [(10,), (20,), (30,)]
+        device = ImpreciseDevice()
+        start_time = time.time()
+        ActionTrajectory(waypoints, device, blend_radius=0.5).perform()
+        self.assertLess(time.time() - start_time, 5)
+        self.assertEqual(device.position, (29,))
+        self.assertEqual(device.retarget_positions, [0, 9, 19])
+
+    def test048_wait_until_near_timeout(self):
+        device = StreamingDevice(speed=1)
+        device.moveInMicronsToWithoutWaiting((100,))
+        start_time = time.time()
+        self.assertFalse(
+            asyncmotion.wait_until_near(device, (100,), 0.5, timeout=0.1)
+        )
+        self.assertLess(time.time() - start_time, 1)
+        device.axis.stop()
+
+    def test050_estimator(self):
+        sample, delay = SlowDevice(), SlowDevice()
+        estimator = ExperimentEstimator(settle_time=0)
+        estimator.device_speeds[sample] = 100
+        estimator.device_speeds[delay] = 10
+
+        exp = Experiment()
+        exp.add_step(
+            ExperimentStep(
+                perform=[
+                    ActionCoordinatedMove(
+                        [(sample, (100, 0, 0)), (delay, (20,))]
+                    ),
+                    ActionTrajectory([(10,), (30,), (20,)], delay),
+                ]
+            )
+        )
+        estimate = estimator.estimate(exp)
+        self.assertAlmostEqual(estimate["duration"], 2 + 4)
+
+    def test055_estimator_blends_only_retargetable_devices(self):
+        estimator = ExperimentEstimator(settle_time=1)
+        device = SlowDevice()
+        estimator.device_speeds[device] = 10
+        waypoints = [(10,), (20,), (30,)]
+
+        exp = Experiment()
+        exp.add_step(
+            ExperimentStep(
+                perform=[ActionTrajectory(waypoints, device, blend_radius=0.5)]
+            )
+        )
+        # SlowDevice cannot be retargeted: it settles at every waypoint
+        self.assertAlmostEqual(estimator.estimate(exp)["duration"], 3 + 3)
+
+
+if __name__ == "__main__":
+    envtest.main()
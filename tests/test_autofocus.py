@@ -0,0 +1,162 @@
+import envtest  # setup environment for testing
+from threading import Thread, Event
+
+import numpy as np
+from mytk.notificationcenter import NotificationCenter
+from hardwarelibrary.motion import SutterDevice
+
+from pymicroscope.app_notifications import MicroscopeAppNotification
+from pymicroscope.base.focusmap import FocusMap
+from pymicroscope.base.focusmetrics import (
+    brenner_gradient,
+    focus_metrics,
+    normalized_variance,
+    region_of_interest,
+    variance_of_laplacian,
+)
+from pymicroscope.experiment.actions import ActionAutofocus
+from pymicroscope.experiment.cancellation import ActionCancelled
+
+
+class DefocusedCamera:
+    """
+    Posts frames whose contrast decreases away from the best focus z.
+    """
+
+    def __init__(self, device, best_z, depth_of_field=10):
+        self.device = device
+        self.best_z = best_z
+        self.depth_of_field = depth_of_field
+        rng = np.random.default_rng(0)
+        self.pattern = rng.random((120, 160)) - 0.5
+        self.frames = 0
+        self.stop = Event()
+        self.thread = Thread(target=self.run, daemon=True)
+
+    def frame(self, z):
+        defocus = (z - self.best_z) / self.depth_of_field
+        contrast = 1 / (1 + defocus**2)
+        frame = 128 + 100 * contrast * self.pattern
+        return np.repeat(frame[:, :, np.newaxis], 3, axis=2).astype(np.uint8)
+
+    def run(self):
+        while not self.stop.wait(0.002):
+            z = self.device.positionInMicrons()[2]
+            self.frames += 1
+            NotificationCenter().post_notification(
+                MicroscopeAppNotification.new_image_received,
+                notifying_object=self,
+                user_info={"img_array": self.frame(z)},
+            )
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop.set()
+        self.thread.join()
+
+
+class FocusMetricsTestCase(envtest.CoreTestCase):
+    def setUp(self):
+        super().setUp()
+        rng = np.random.default_rng(0)
+        self.sharp = rng.random((100, 100)).astype(np.float32) * 100 + 50
+        self.blurred = (
+            self.sharp
+            + np.roll(self.sharp, 1, axis=0)
+            + np.roll(self.sharp, 1, axis=1)
+            + np.roll(self.sharp, (1, 1), axis=(0, 1))
+        ) / 4
+
+    def test000_metrics_prefer_sharp_images(self):
+        for metric in (
+            variance_of_laplacian,
+            brenner_gradient,
+            normalized_variance,
+        ):
+            self.assertGreater(metric(self.sharp), metric(self.blurred))
+
+    def test010_region_of_interest(self):
+        frame = np.arange(10 * 12 * 3).reshape(10, 12, 3)
+        region = region_of_interest(frame, roi=(2, 4, 6, 6), decimation=2)
+        self.assertEqual(region.shape, (3, 3))
+        self.assertEqual(region.dtype, np.float32)
+        self.assertEqual(region[0, 0], frame[2, 4].mean())
+
+    def test020_uniform_image(self):
+        uniform = np.zeros((10, 10), dtype=np.float32)
+        for metric in focus_metrics.values():
+            self.assertEqual(metric(uniform), 0)
+
+
+class AutofocusTestCase(envtest.CoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.device = SutterDevice(serialNumber="debug")
+        self.device.initializeDevice()
+        self.device.moveInMicronsTo((10, 20, 0))
+
+    def tearDown(self):
+        self.device.shutdownDevice()
+        super().tearDown()
+
+    def test000_init(self):
+        action = ActionAutofocus(self.device, z_range=50)
+        self.assertIsNotNone(action)
+        with self.assertRaises(ValueError):
+            ActionAutofocus(self.device, z_range=50, metric="entropy")
+        with self.assertRaises(ValueError):
+            ActionAutofocus(self.device, z_range=50, search="dense")
+
+    def test010_coarse_to_fine(self):
+        with DefocusedCamera(self.device, best_z=13.3):
+            action = ActionAutofocus(self.device, z_range=50, tolerance=1)
+            results = action.perform()
+
+        self.assertAlmostEqual(results["best_z"], 13.3, delta=1)
+        self.assertAlmostEqual(self.device.positionInMicrons()[2], 13.3, delta=1)
+        self.assertEqual(self.device.positionInMicrons()[:2], (10, 20))
+        # Much fewer frames than a dense sweep at the tolerance
+        self.assertLess(results["frames"], 25)
+
+    def test020_golden_section(self):
+        with DefocusedCamera(self.device, best_z=-21.7):
+            action = ActionAutofocus(
+                self.device,
+                z_range=50,
+                tolerance=0.5,
+                metric="brenner",
+                search="golden",
+            )
+            results = action.perform()
+
+        self.assertAlmostEqual(results["best_z"], -21.7, delta=1)
+        self.assertLess(results["frames"], 20)
+
+    def test030_adds_focus_point(self):
+        focus_map = FocusMap()
+        with DefocusedCamera(self.device, best_z=5):
+            action = ActionAutofocus(
+                self.device,
+                z_range=20,
+                metric="normalized_variance",
+                focus_map=focus_map,
+            )
+            action.perform()
+
+        self.assertEqual(len(focus_map), 1)
+        x, y, z = focus_map.points[0]
+        self.assertEqual((x, y), (10, 20))
+        self.assertAlmostEqual(z, 5, delta=1)
+
+    def test040_cancelled_without_frames(self):
+        action = ActionAutofocus(self.device, z_range=20)
+        action.cancellation_token.cancel("test")
+        with self.assertRaises(ActionCancelled):
+            action.perform()
+
+
+if __name__ == "__main__":
+    envtest.main()
@@ -0,0 +1,143 @@
+import envtest  # setup environment for testing
+import time
+from multiprocessing import Queue
+
+import numpy as np
+
+from pymicroscope.acquisition.averaging import FrameAverager, average_lines
+from pymicroscope.acquisition.imageprovider import ImageProvider
+from pymicroscope.acquisition.lsmprovider import LSMImageProvider
+
+
+class CountingImageProvider(ImageProvider):
+    """
+    Frames filled with the number of frames captured so far.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.frames_captured = 0
+
+    def capture_image(self) -> np.ndarray:
+        self.frames_captured += 1
+        return np.full((4, 5, 3), self.frames_captured, dtype=np.uint8)
+
+
+class SlowCountingImageProvider(CountingImageProvider):
+    def capture_image(self) -> np.ndarray:
+        time.sleep(0.01)
+        return super().capture_image()
+
+
+class FrameAveragerTestCase(envtest.CoreTestCase):
+    def frames(self, values, dtype=np.uint8):
+        return [np.full((4, 5), value, dtype=dtype) for value in values]
+
+    def test000_init(self):
+        averager = FrameAverager()
+        frame = np.ones((4, 5))
+        self.assertIs(averager.add(frame), frame)
+        with self.assertRaises(ValueError):
+            FrameAverager("median", 3)
+        with self.assertRaises(ValueError):
+            FrameAverager("mean", 0)
+
+    def test010_mean_emits_every_count_frames(self):
+        averager = FrameAverager("mean", 3)
+        emitted = [averager.add(frame) for frame in self.frames(range(1, 10))]
+        averaged = [frame for frame in emitted if frame is not None]
+
+        self.assertEqual([frame is None for frame in emitted[:3]], [True, True, False])
+        self.assertEqual(len(averaged), 3)
+        self.assertEqual([frame[0, 0] for frame in averaged], [2, 5, 8])
+        self.assertEqual(averaged[0].dtype, np.uint8)
+
+    def test020_mean_does_not_overflow(self):
+        averager = FrameAverager("mean", 30)
+        for frame in self.frames([255] * 29):
+            self.assertIsNone(averager.add(frame))
+        averaged = averager.add(self.frames([225])[0])
+        self.assertTrue(np.all(averaged == 254))
+
+    def test030_running_average(self):
+        averager = FrameAverager("running", 4)
+        emitted = [averager.add(frame) for frame in self.frames([8, 0, 4], np.float32)]
+        # Cumulative mean until count frames
+        self.assertEqual([frame[0, 0] for frame in emitted], [8, 4, 4])
+
+        for frame in self.frames([100] * 100):
+            averaged = averager.add(frame)
+        self.assertTrue(np.all(averaged == 100))
+        self.assertEqual(averaged.dtype, np.uint8)
+
+    def test040_restarts_on_new_shape(self):
+        averager = FrameAverager("mean", 2)
+        averager.add(np.zeros((4, 5)))
+        self.assertIsNone(averager.add(np.ones((8, 5))))
+        self.assertTrue(np.all(averager.add(np.ones((8, 5))) == 1))
+
+    def test050_average_lines(self):
+        frame = np.repeat(np.arange(6, dtype=np.uint16)[:, np.newaxis], 4, axis=1)
+        averaged = average_lines(frame, 2)
+        self.assertEqual(averaged.shape, (3, 4))
+        self.assertEqual(list(averaged[:, 0]), [0, 2, 4])  # 0.5, 2.5, 4.5 rounded to even
+        self.assertIs(average_lines(frame, 1), frame)
+
+
+class ImageProviderAveragingTestCase(envtest.CoreTestCase):
+    def test000_no_averaging(self):
+        provider = CountingImageProvider()
+        self.assertEqual(provider.capture_averaged_image()[0, 0, 0], 1)
+        self.assertEqual(provider.frames_captured, 1)
+
+    def test010_mean(self):
+        provider = CountingImageProvider(
+            configuration={"averaging_mode": "mean", "averaging_count": 30}
+        )
+        img = provider.capture_averaged_image()
+        self.assertEqual(provider.frames_captured, 30)
+        self.assertEqual(img[0, 0, 0], 16)  # round(15.5)
+
+    def test020_configuration_change_restarts(self):
+        provider = CountingImageProvider(
+            configuration={"averaging_mode": "mean", "averaging_count": 2}
+        )
+        averager = provider.frame_averager()
+        self.assertIs(provider.frame_averager(), averager)
+        provider.set_configuration({"averaging_count": 4})
+        self.assertEqual(provider.frame_averager().count, 4)
+
+    def test025_stop_capture_during_average(self):
+        # An average takes 3 s: stopping only waits for the current frame
+        provider = SlowCountingImageProvider(
+            queue=Queue(),
+            configuration={"averaging_mode": "mean", "averaging_count": 300},
+        )
+        provider.start_synchronously()
+        try:
+            provider.start_capture({})
+            time.sleep(0.2)
+            start_time = time.time()
+            provider.stop_capture()
+            self.assertLess(time.time() - start_time, 0.5)
+            self.assertFalse(provider.is_running)
+        finally:
+            provider.terminate_synchronously()
+
+    def test030_lsm_line_averaging(self):
+        provider = LSMImageProvider(
+            configuration={
+                "width": 100,
+                "height": 50,
+                "pixel_frequency": 1e9,
+                "line_averaging": 3,
+            }
+        )
+        img = provider.capture_image()
+        self.assertEqual(provider.assembler.geometry.height, 150)
+        self.assertEqual(img.shape, (50, 100, 1))
+        self.assertTrue(np.array_equal(img[:, :, 0], provider.digitizer.image[::3]))
+
+
+if __name__ == "__main__":
+    envtest.main()
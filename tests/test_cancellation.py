@@ -0,0 +1,101 @@
+import envtest  # setup environment for testing
+from threading import Timer
+
+from pymicroscope.experiment.actions import *
+from pymicroscope.experiment.experiments import Experiment, ExperimentStep
+from pymicroscope.experiment.cancellation import (
+    CancellationToken,
+    ActionCancelled,
+    ActionTimeout,
+)
+
+
+class CancellationTestCase(envtest.CoreTestCase):
+    def test000_init(self):
+        token = CancellationToken()
+        self.assertFalse(token.is_cancelled)
+        token.raise_if_cancelled()
+
+    def test010_cancel(self):
+        token = CancellationToken()
+        token.cancel("Stop")
+        self.assertTrue(token.is_cancelled)
+        self.assertTrue(token.wait(10))
+        with self.assertRaises(ActionCancelled):
+            token.raise_if_cancelled()
+
+    def test020_wait_is_interrupted(self):
+        token = CancellationToken()
+        Timer(0.1, token.cancel).start()
+
+        start_time = time.time()
+        with self.assertRaises(ActionCancelled):
+            ActionWait(delay=10).perform(cancellation_token=token)
+        self.assertTrue(time.time() - start_time < 0.5)
+
+    def test030_wait_timeout(self):
+        start_time = time.time()
+        with self.assertRaises(ActionTimeout):
+            ActionWait(delay=10, timeout=0.1).perform()
+        self.assertTrue(time.time() - start_time < 0.5)
+
+    def test040_accumulate_timeout_without_frames(self):
+        capture = ActionAccumulate(n_images=5, timeout=0.1)
+        with self.assertRaises(ActionTimeout):
+            capture.perform()
+
+    def test050_accumulate_cancelled(self):
+        token = CancellationToken()
+        capture = ActionAccumulate(n_images=5)
+        capture.queue.put(np.zeros(shape=(10, 10, 3), dtype=np.uint8))
+        Timer(0.1, token.cancel).start()
+
+        start_time = time.time()
+        with self.assertRaises(ActionCancelled):
+            capture.perform(cancellation_token=token)
+        self.assertTrue(time.time() - start_time < 0.5)
+
+    def test060_cancelled_action_is_not_performed(self):
+        token = CancellationToken()
+        token.cancel()
+        calls = []
+        with self.assertRaises(ActionCancelled):
+            ActionFunctionCall(calls.append, (1,)).perform(cancellation_token=token)
+        self.assertEqual(calls, [])
+
+    def test070_cancel_experiment_in_background(self):
+        calls = []
+        exp = Experiment()
+        for _ in range(100):
+            exp.add_single_action_step(ActionWait(delay=1))
+        exp.add_cleanup_action(ActionFunctionCall(calls.append, ("cleanup",)))
+
+        exp.perform_in_background_thread()
+        self.assertTrue(exp.is_running)
+        time.sleep(0.1)
+
+        start_time = time.time()
+        exp.cancel()
+        exp.finalize()
+        self.assertTrue(time.time() - start_time < 0.5)
+        self.assertFalse(exp.is_running)
+        self.assertEqual(calls, ["cleanup"])
+
+    def test080_timeout_aborts_experiment(self):
+        calls = []
+        exp = Experiment()
+        exp.add_step(
+            ExperimentStep(
+                perform=[ActionAccumulate(n_images=2, timeout=0.05)],
+            )
+        )
+        exp.add_step(ExperimentStep.from_function(calls.append, ("step",)))
+        exp.add_cleanup_action(ActionFunctionCall(calls.append, ("cleanup",)))
+
+        results = exp.perform()
+        self.assertIn("aborted", results)
+        self.assertEqual(calls, ["cleanup"])
+
+
+if __name__ == "__main__":
+    envtest.main()
@@ -0,0 +1,168 @@
+import envtest  # setup environment for testing
+import time
+from threading import Thread
+
+import numpy as np
+
+from mytk.notificationcenter import NotificationCenter
+
+from pymicroscope.hardware import asyncmotion
+from pymicroscope.hardware.devicestate import (
+    DeviceStateNotification,
+    DeviceStateService,
+    device_lock,
+)
+
+
+class CountingDevice:
+    def __init__(self, read_time=0.0, travel_time=0.0):
+        self.read_time = read_time
+        self.travel_time = travel_time
+        self.reads = 0
+        self.current = (0.0, 0.0, 0.0)
+
+    def positionInMicrons(self):
+        time.sleep(self.read_time)
+        self.reads += 1
+        return self.current
+
+    def position(self):
+        return self.positionInMicrons()[0]
+
+    def moveInMicronsTo(self, position):
+        time.sleep(self.travel_time)
+        self.current = tuple(position)
+
+
+class DeviceStateTestCase(envtest.CoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.device = CountingDevice()
+        self.service = DeviceStateService(poll_interval=0.01)
+        self.service.add_device(self.device)
+        self.notifications = []
+
+    def tearDown(self):
+        self.service.stop()
+        NotificationCenter().remove_observer(self)
+        super().tearDown()
+
+    def handle_notification(self, notification):
+        self.notifications.append(notification)
+
+    def test000_init(self):
+        self.assertIsNotNone(self.service)
+        self.assertFalse(self.service.is_running)
+        self.assertIsNone(self.service.cached_position(self.device))
+        self.assertEqual(self.service.devices, [self.device])
+
+    def test010_reads_are_cached(self):
+        self.assertEqual(self.service.position(self.device), (0, 0, 0))
+        self.assertEqual(self.device.reads, 1)
+        for _ in range(10):
+            self.service.position(self.device)
+        self.assertEqual(self.device.reads, 1)
+
+    def test020_max_age(self):
+        self.service.position(self.device)
+        self.device.current = (1.0, 2.0, 3.0)
+        self.assertEqual(
+            self.service.position(self.device, max_age=1), (0, 0, 0)
+        )
+        time.sleep(0.02)
+        self.assertEqual(
+            self.service.position(self.device, max_age=0.01), (1, 2, 3)
+        )
+        self.assertEqual(self.device.reads, 2)
+
+    def test030_polling(self):
+        self.service.start()
+        self.assertTrue(self.service.is_running)
+        self.device.current = (5.0, 0.0, 0.0)
+        time.sleep(0.1)
+        self.assertEqual(
+            self.service.position(self.device, max_age=0.05), (5, 0, 0)
+        )
+        self.assertTrue(self.device.reads > 2)
+        self.service.stop()
+        self.assertFalse(self.service.is_running)
+
+    def test040_notification_only_on_change(self):
+        NotificationCenter().add_observer(
+            self,
+            method=self.handle_notification,
+            notification_name=DeviceStateNotification.did_update_position,
+        )
+        self.service.refresh(self.device)
+        self.service.refresh(self.device)
+        self.device.current = (1.0, 0.0, 0.0)
+        self.service.refresh(self.device)
+
+        self.assertEqual(len(self.notifications), 2)
+        user_info = self.notifications[-1].user_info
+        self.assertIs(user_info["device"], self.device)
+        self.assertEqual(user_info["position"], (1, 0, 0))
+
+    def test045_notification_of_array_positions(self):
+        NotificationCenter().add_observer(
+            self,
+            method=self.handle_notification,
+            notification_name=DeviceStateNotification.did_update_position,
+        )
+        self.device.current = np.array([1.0, 0.0, 0.0])
+        self.service.refresh(self.device)
+        self.device.current = np.array([1.0, 0.0, 0.0])
+        self.service.refresh(self.device)
+        self.device.current = np.array([2.0, 0.0, 0.0])
+        self.service.refresh(self.device)
+        self.assertEqual(len(self.notifications), 2)
+
+    def test050_poller_skips_moving_device(self):
+        device = CountingDevice(travel_time=0.2)
+        self.service.add_device(device)
+        self.service.refresh(device)
+
+        motion = asyncmotion.move_to(device, (1.0, 1.0, 1.0))
+        time.sleep(0.05)
+        self.assertIsNone(self.service.refresh(device, blocking=False))
+        self.service.poll()
+        self.assertEqual(device.reads, 1)
+
+        motion.result()
+        self.assertEqual(
+            self.service.refresh(device, blocking=False), (1, 1, 1)
+        )
+
+    def test060_custom_reader(self):
+        device = CountingDevice()
+        self.service.add_device(device, read_position=device.position)
+        self.assertEqual(self.service.position(device), 0)
+
+    def test070_unknown_device(self):
+        with self.assertRaises(KeyError):
+            self.service.position(CountingDevice())
+
+    def test080_device_lock_is_per_device(self):
+        self.assertIs(device_lock(self.device), device_lock(self.device))
+        self.assertIsNot(
+            device_lock(self.device), device_lock(CountingDevice())
+        )
+
+    def test090_concurrent_readers_share_cache(self):
+        device = CountingDevice(read_time=0.05)
+        self.service.add_device(device)
+        self.service.refresh(device)
+
+        threads = [
+            Thread(target=self.service.position, args=(device,))
+            for _ in range(20)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(device.reads, 1)
+
+
+if __name__ == "__main__":
+    envtest.main()
@@ -0,0 +1,116 @@
+import envtest  # setup environment for testing
+import tempfile
+from pathlib import Path
+
+import numpy as np
+from PIL import Image as PILImage
+
+from pymicroscope.acquisition.lsmprovider import LSMImageProvider
+from pymicroscope.base.display import DisplayMapping, pil_image_for_display
+from pymicroscope.base.imagefile import save_image
+from pymicroscope.experiment.actions import Action, ActionMean
+
+
+class DisplayMappingTestCase(envtest.CoreTestCase):
+    def test000_identity_for_8_bits(self):
+        img = np.arange(256, dtype=np.uint8).reshape(16, 16)
+        self.assertIs(DisplayMapping().to_display(img), img)
+
+    def test010_16_bits_with_lookup_table(self):
+        mapping = DisplayMapping(high=4095)
+        img = np.array([[0, 2048, 4095, 65535]], dtype=np.uint16)
+        displayed = mapping.to_display(img)
+        self.assertEqual(displayed.dtype, np.uint8)
+        self.assertEqual(list(displayed[0]), [0, 128, 255, 255])
+
+        table = mapping._table
+        mapping.to_display(img)
+        self.assertIs(mapping._table, table)
+
+    def test020_auto_contrast(self):
+        img = np.linspace(1000, 2000, 640 * 480).reshape(480, 640).astype(np.uint16)
+        displayed = DisplayMapping(auto_contrast=True, saturation=0).to_display(img)
+        self.assertEqual(displayed.min(), 0)
+        self.assertEqual(displayed.max(), 255)
+
+    def test030_float(self):
+        img = np.array([[-10.0, 127.5, 300.0]], dtype=np.float32)
+        self.assertEqual(list(DisplayMapping().to_display(img)[0]), [0, 128, 255])
+
+    def test040_pil_image_modes(self):
+        mono = np.zeros((10, 20), dtype=np.uint16)
+        self.assertEqual(pil_image_for_display(mono).mode, "L")
+        self.assertEqual(pil_image_for_display(mono[:, :, np.newaxis]).mode, "L")
+        rgb = np.zeros((10, 20, 3), dtype=np.uint16)
+        image = pil_image_for_display(rgb)
+        self.assertEqual((image.mode, image.size), ("RGB", (20, 10)))
+
+
+class ImageFileTestCase(envtest.CoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+        self.filepath = Path(self.directory.name) / "Image.tif"
+
+    def tearDown(self):
+        self.directory.cleanup()
+        super().tearDown()
+
+    def test000_16_bit_mono_is_lossless(self):
+        img = np.arange(60000, step=100, dtype=np.uint16).reshape(20, 30)
+        save_image(img[:, :, np.newaxis], self.filepath)
+        self.assertTrue(np.array_equal(np.array(PILImage.open(self.filepath)), img))
+
+    def test010_16_bit_rgb_one_page_per_channel(self):
+        rng = np.random.default_rng(0)
+        img = rng.integers(0, 65536, (20, 30, 3), dtype=np.uint16)
+        save_image(img, self.filepath)
+
+        with PILImage.open(self.filepath) as tiff:
+            self.assertEqual(tiff.n_frames, 3)
+            for channel in range(3):
+                tiff.seek(channel)
+                self.assertTrue(np.array_equal(np.array(tiff), img[:, :, channel]))
+
+    def test020_8_bit_rgb(self):
+        img = np.full((20, 30, 3), 7, dtype=np.uint8)
+        save_image(img, self.filepath)
+        self.assertEqual(PILImage.open(self.filepath).mode, "RGB")
+
+
+class HighBitDepthPipelineTestCase(envtest.CoreTestCase):
+    def test000_mean_keeps_dtype(self):
+        class SourceAction(Action):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                self.output = [
+                    np.full((4, 5), value, dtype=np.uint16) for value in (4000, 4001)
+                ]
+
+        mean = ActionMean(source=SourceAction())
+        mean.perform()
+        self.assertEqual(mean.output.dtype, np.uint16)
+        self.assertTrue(np.all(mean.output == 4000))  # 4000.5 rounded to even
+
+    def test010_lsm_12_bits(self):
+        provider = LSMImageProvider(
+            configuration={
+                "width": 100,
+                "height": 50,
+                "pixel_frequency": 1e9,
+                "sample_bits": 12,
+            }
+        )
+        self.assertEqual(provider.channels, 1)
+        img = provider.capture_image()
+        self.assertEqual(img.shape, (50, 100, 1))
+        self.assertEqual(img.dtype, np.uint16)
+        self.assertGreater(img.max(), 255)
+        self.assertLessEqual(img.max(), 4095)
+
+        provider.set_channels(3)
+        self.assertEqual(provider.capture_image().shape, (50, 100, 3))
+
+
+if __name__ == "__main__":
+    envtest.main()
@@ -0,0 +1,132 @@
+import envtest  # setup environment for testing
+import tempfile
+
+from pymicroscope.experiment.actions import *
+from pymicroscope.experiment.experiments import Experiment, ExperimentStep
+from pymicroscope.experiment.estimator import ExperimentEstimator
+
+
+class TestDevice:
+    def moveInMicronsTo(self, position):
+        time.sleep(0.01 + sum(abs(x) for x in position) / 10_000)
+
+    def moveInMicronsBy(self, distance):
+        pass
+
+
+class EstimatorTestCase(envtest.CoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.device = TestDevice()
+
+    def map_experiment(self, positions, n_images=10):
+        exp = Experiment()
+        for position in positions:
+            capture = ActionAccumulate(n_images=n_images)
+            mean = ActionMean(source=capture)
+            save = ActionSave(source=mean, root_dir=Path("/tmp"))
+            exp.add_step(
+                ExperimentStep(
+                    prepare=[ActionMove(position, self.device)],
+                    perform=[capture, mean, save],
+                )
+            )
+        return exp
+
+    def test000_init(self):
+        self.assertIsNotNone(ExperimentEstimator())
+
+    def test010_dry_run_does_not_perform(self):
+        exp = Experiment()
+        exp.add_single_action_step(ActionWait(10))
+        exp.add_single_action_step(ActionWait(5))
+
+        start_time = time.time()
+        estimate = exp.dry_run()
+        self.assertTrue(time.time() - start_time < 1)
+        self.assertAlmostEqual(estimate["duration"], 15)
+        self.assertEqual(estimate["step_durations"], [10, 5])
+
+    def test020_map_estimate(self):
+        positions = [(0, 0, 0), (100, 0, 0), (100, 200, 0)]
+        estimator = ExperimentEstimator(
+            frame_shape=(10, 20, 3), frame_rate=10, default_speed=100
+        )
+        estimate = self.map_experiment(positions, n_images=5).dry_run(estimator)
+
+        # moves: 0 + 1 s + 2 s, accumulation: 3 x 0.5 s
+        self.assertAlmostEqual(estimate["action_durations"]["ActionMove"], 3)
+        self.assertAlmostEqual(estimate["action_durations"]["ActionAccumulate"], 1.5)
+        self.assertEqual(estimate["bytes_written"], 3 * 10 * 20 * 3)
+        self.assertEqual(estimate["peak_memory"], 3 * (5 * 600 + 600))
+
+    def test025_native_depth_volumes(self):
+        positions = [(0, 0, 0), (100, 0, 0)]
+        estimator = ExperimentEstimator(frame_shape=(10, 20, 1), frame_dtype=np.uint16)
+        estimate = self.map_experiment(positions, n_images=5).dry_run(estimator)
+        self.assertEqual(estimate["bytes_written"], 2 * 400)
+        self.assertEqual(estimate["peak_memory"], 2 * (5 * 400 + 400))
+
+        estimator = ExperimentEstimator(frame_shape=(10, 20), frame_dtype=np.float64)
+        self.assertEqual(estimator.saved_frame_bytes, 800)
+
+    def test030_move_by_and_home(self):
+        estimator = ExperimentEstimator(default_speed=10, settle_time=0.5)
+        estimator.initial_positions[self.device] = (100,)
+        exp = Experiment()
+        exp.add_single_action_step(ActionMoveBy((-50,), self.device))
+        exp.add_single_action_step(ActionHome(self.device))
+        estimate = exp.dry_run(estimator)
+        self.assertEqual(estimate["step_durations"], [5.5, 5.5])
+
+    def test040_calibrate_motion(self):
+        exp = Experiment()
+        for position in [(0, 0), (1000, 0), (3000, 0), (0, 0)]:
+            exp.add_single_action_step(ActionMove(position, self.device))
+        exp.perform()
+
+        estimator = ExperimentEstimator()
+        estimator.calibrate(exp)
+        self.assertIn(self.device, estimator.device_speeds)
+        self.assertTrue(estimator.device_speeds[self.device] > 0)
+
+        estimate = exp.dry_run(estimator)
+        measured = sum(
+            step.perform_actions[0].action_results["duration"]
+            for step in exp.steps
+        )
+        self.assertAlmostEqual(estimate["duration"], measured, delta=0.1)
+
+    def test050_calibrate_other_actions(self):
+        exp = Experiment()
+        exp.add_single_action_step(ActionFunctionCall(time.sleep, (0.05,)))
+        exp.perform()
+
+        estimator = ExperimentEstimator()
+        estimator.calibrate(exp)
+        estimate = exp.dry_run(estimator)
+        self.assertAlmostEqual(estimate["duration"], 0.05, delta=0.02)
+
+    def test060_disk_bandwidth(self):
+        with tempfile.TemporaryDirectory() as directory:
+            bandwidth = ExperimentEstimator.measure_disk_bandwidth(
+                directory, size=1_000_000
+            )
+        self.assertTrue(bandwidth > 0)
+
+    def test070_autofocus(self):
+        estimator = ExperimentEstimator(frame_rate=100)
+        coarse = ActionAutofocus(self.device, z_range=50, tolerance=1)
+        golden = ActionAutofocus(
+            self.device, z_range=50, tolerance=1, search="golden"
+        )
+        state = {"positions": {}}
+        coarse_cost = estimator.estimate_action(coarse, state)
+        golden_cost = estimator.estimate_action(golden, state)
+        self.assertEqual(coarse_cost["frames"], 5 + 5 * 2)
+        self.assertEqual(golden_cost["frames"], 2 + 10)
+        self.assertTrue(coarse_cost["duration"] > coarse_cost["frames"] / 100)
+
+
+if __name__ == "__main__":
+    envtest.main()
@@ -0,0 +1,192 @@
+import envtest  # setup environment for testing
+import tempfile
+import time
+import tracemalloc
+from unittest.mock import patch
+
+import numpy as np
+
+from pymicroscope.acquisition.flatfield import (
+    CalibrationCache,
+    FlatFieldCalibration,
+    FlatFieldCorrector,
+)
+from pymicroscope.acquisition.imageprovider import ImageProvider
+from pymicroscope.experiment.actions import Action, ActionFlatFieldCalibration
+
+
+class VignettedImageProvider(ImageProvider):
+    """
+    A uniform sample seen through a vignetted objective, with an offset.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.dark = np.full((30, 40, 1), 100, dtype=np.uint16)
+        y, x = np.ogrid[:30, :40]
+        self.vignetting = (1 - ((x - 20) ** 2 + (y - 15) ** 2) / 2000.0)[
+            :, :, np.newaxis
+        ]
+
+    def capture_image(self) -> np.ndarray:
+        return (self.dark + 2000 * self.vignetting).astype(np.uint16)
+
+
+class RingImageProvider(VignettedImageProvider):
+    """
+    Returns views into a buffer it reuses, like the assembler of a scanner.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.ring = np.stack([super().capture_image()] * 2)
+
+    def capture_image(self) -> np.ndarray:
+        return self.ring[0]
+
+
+class OutputAction(Action):
+    def __init__(self, output, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.output = output
+
+
+class FlatFieldTestCase(envtest.CoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+        self.provider = VignettedImageProvider()
+        self.flat = self.provider.capture_image()
+
+    def tearDown(self):
+        self.directory.cleanup()
+        super().tearDown()
+
+    def test000_calibration(self):
+        calibration = FlatFieldCalibration.from_frames(self.provider.dark, self.flat)
+        self.assertEqual(calibration.shape, (30, 40, 1))
+        self.assertEqual(calibration.gain.dtype, np.float32)
+        self.assertFalse(calibration.gain.flags.writeable)
+
+        with self.assertRaises(ValueError):
+            FlatFieldCalibration.from_frames(self.flat, self.flat)
+
+    def test010_correction_is_uniform(self):
+        calibration = FlatFieldCalibration.from_frames(self.provider.dark, self.flat)
+        corrected = FlatFieldCorrector(calibration).correct(self.flat)
+        self.assertEqual(corrected.dtype, np.uint16)
+        self.assertLessEqual(int(corrected.max()) - int(corrected.min()), 1)
+
+    def test020_dead_pixels_are_not_corrected(self):
+        flat = self.flat.copy()
+        flat[0, 0] = 100
+        calibration = FlatFieldCalibration.from_frames(self.provider.dark, flat)
+        self.assertEqual(calibration.gain[0, 0], 1)
+
+    def test030_no_allocation_per_frame(self):
+        dark = np.full((512, 512), 100, dtype=np.uint16)
+        flat = np.full((512, 512), 2100, dtype=np.uint16)
+        corrector = FlatFieldCorrector(FlatFieldCalibration.from_frames(dark, flat))
+        frame = flat.copy()
+        output = corrector.correct(frame)
+
+        tracemalloc.start()
+        for _ in range(100):
+            self.assertIs(corrector.correct(frame), output)
+            corrector.correct(frame, out=frame)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        # Only the bookkeeping of the calls, never a frame
+        self.assertLess(peak, frame.nbytes / 10)
+
+    def test040_throughput(self):
+        dark = np.full((1024, 1024), 100, dtype=np.uint16)
+        flat = np.full((1024, 1024), 2100, dtype=np.uint16)
+        corrector = FlatFieldCorrector(FlatFieldCalibration.from_frames(dark, flat))
+        frame = flat.copy()
+
+        start_time = time.perf_counter()
+        for _ in range(20):
+            corrector.correct(frame)
+        frames_per_second = 20 / (time.perf_counter() - start_time)
+        self.assertGreater(frames_per_second, 30)
+
+    def test050_cache(self):
+        cache = CalibrationCache(self.directory.name)
+        configuration = dict(self.provider.configuration)
+        key = CalibrationCache.key("VignettedImageProvider", configuration)
+
+        configuration["averaging_count"] = 30
+        self.assertEqual(CalibrationCache.key("VignettedImageProvider", configuration), key)
+        configuration["width"] = 1024
+        self.assertNotEqual(CalibrationCache.key("VignettedImageProvider", configuration), key)
+
+        self.assertIsNone(cache.load(key))
+        calibration = FlatFieldCalibration.from_frames(self.provider.dark, self.flat)
+        filepath = cache.store(key, calibration)
+        self.assertTrue(filepath.exists())
+        self.assertIs(cache.load(key), calibration)
+
+        reloaded = CalibrationCache(self.directory.name).load(key)
+        self.assertTrue(np.array_equal(reloaded.gain, calibration.gain))
+
+    def test060_calibration_action_and_provider(self):
+        cache = CalibrationCache(self.directory.name)
+        key = CalibrationCache.key("VignettedImageProvider", self.provider.configuration)
+        action = ActionFlatFieldCalibration(
+            dark_source=OutputAction(self.provider.dark),
+            flat_source=OutputAction(self.flat),
+            cache=cache,
+            key=key,
+        )
+        results = action.perform()
+        self.assertEqual(results["filepath"], cache.filepath(key))
+
+        self.provider.set_configuration({"flat_field_calibration": self.directory.name})
+        corrector = self.provider.flat_field_corrector()
+        self.assertIsNotNone(corrector)
+        self.assertIs(self.provider.flat_field_corrector(), corrector)
+
+        img = self.provider.capture_averaged_image()
+        self.assertLessEqual(int(img.max()) - int(img.min()), 1)
+
+        # Not calibrated for this configuration
+        self.provider.set_configuration({"frame_rate": 10})
+        self.assertIsNone(self.provider.flat_field_corrector())
+        self.provider.set_configuration({"frame_rate": 30})
+        self.assertIsNotNone(self.provider.flat_field_corrector())
+
+        self.provider.set_configuration({"flat_field_calibration": ""})
+        self.assertIsNone(self.provider.flat_field_corrector())
+
+    def test070_reused_buffers_are_not_corrected_in_place(self):
+        provider = RingImageProvider()
+        raw = provider.ring.copy()
+        calibration = FlatFieldCalibration.from_frames(provider.dark, self.flat)
+        key = CalibrationCache.key("RingImageProvider", provider.configuration)
+        CalibrationCache(self.directory.name).store(key, calibration)
+        provider.set_configuration({"flat_field_calibration": self.directory.name})
+
+        img = provider.capture_averaged_image()
+        self.assertLessEqual(int(img.max()) - int(img.min()), 1)
+        self.assertTrue(np.array_equal(provider.ring, raw))
+        corrector = provider.flat_field_corrector()
+        self.assertFalse(np.shares_memory(img, corrector.output))
+
+    def test080_shape_mismatch_is_skipped(self):
+        key = CalibrationCache.key("VignettedImageProvider", self.provider.configuration)
+        calibration = FlatFieldCalibration.from_frames(
+            self.provider.dark[:10], self.flat[:10]
+        )
+        CalibrationCache(self.directory.name).store(key, calibration)
+        self.provider.set_configuration({"flat_field_calibration": self.directory.name})
+
+        with patch("logging.Logger.warning") as warning:
+            for _ in range(3):
+                img = self.provider.capture_averaged_image()
+        self.assertEqual(warning.call_count, 1)
+        self.assertTrue(np.array_equal(img, self.flat))
+
+
+if __name__ == "__main__":
+    envtest.main()
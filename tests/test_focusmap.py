@@ -0,0 +1,65 @@
+import envtest  # setup environment for testing
+
+import numpy as np
+
+from pymicroscope.base.focusmap import FocusMap
+
+
+class FocusMapTestCase(envtest.CoreTestCase):
+    def test000_init(self):
+        focus_map = FocusMap()
+        self.assertEqual(len(focus_map), 0)
+        with self.assertRaises(ValueError):
+            focus_map.z_at(0, 0)
+
+    def test010_invalid_method(self):
+        with self.assertRaises(ValueError):
+            FocusMap(method="cubic")
+
+    def test020_few_points_are_flat(self):
+        focus_map = FocusMap()
+        focus_map.add_point(0, 0, 10)
+        self.assertEqual(focus_map.z_at(100, 200), 10)
+        focus_map.add_point(100, 0, 20)
+        self.assertEqual(focus_map.z_at(-50, 30), 15)
+
+    def test030_plane_recovers_tilt(self):
+        focus_map = FocusMap(method="plane")
+        for x, y in [(0, 0), (1000, 0), (0, 800), (1000, 800), (500, 400)]:
+            focus_map.add_point(x, y, 5 + 0.01 * x - 0.02 * y)
+
+        self.assertAlmostEqual(focus_map.z_at(250, 100), 5 + 2.5 - 2)
+        self.assertTrue(np.allclose(focus_map.residuals(), 0))
+
+    def test040_spline_interpolates_points(self):
+        focus_map = FocusMap(method="spline")
+        for x in np.linspace(0, 1000, 5):
+            for y in np.linspace(0, 1000, 5):
+                focus_map.add_point(x, y, 20 * np.sin(x / 300) + 0.01 * y)
+
+        self.assertTrue(np.allclose(focus_map.residuals(), 0, atol=1e-6))
+
+        x, y = np.meshgrid(np.linspace(200, 800, 5), np.linspace(200, 800, 5))
+        z = focus_map.z_at(x, y)
+        self.assertEqual(z.shape, (5, 5))
+        expected = 20 * np.sin(x / 300) + 0.01 * y
+        self.assertLess(np.abs(z - expected).max(), 1)
+
+    def test050_collinear_points_are_flat(self):
+        focus_map = FocusMap(method="spline")
+        for x in (0, 100, 200):
+            focus_map.add_point(x, 0, x)
+        self.assertEqual(focus_map.z_at(0, 500), 100)
+
+    def test060_adding_points_refits(self):
+        focus_map = FocusMap()
+        focus_map.add_point(0, 0, 1)
+        self.assertEqual(focus_map.z_at(0, 0), 1)
+        focus_map.add_point(10, 0, 3)
+        self.assertEqual(focus_map.z_at(0, 0), 2)
+        focus_map.clear()
+        self.assertEqual(len(focus_map), 0)
+
+
+if __name__ == "__main__":
+    envtest.main()
@@ -0,0 +1,150 @@
+import envtest  # setup environment for testing
+import time
+
+import numpy as np
+
+from pymicroscope.acquisition.digitizer import SyntheticDigitizer
+from pymicroscope.acquisition.frameassembler import FrameAssembler, ScanGeometry
+from pymicroscope.acquisition.lsmprovider import LSMImageProvider
+from pymicroscope.acquisition.vmscontroller import VMSController
+
+
+class ScanGeometryTestCase(envtest.CoreTestCase):
+    def test000_init(self):
+        geometry = ScanGeometry()
+        self.assertEqual(geometry.shape, (480, 640))
+        self.assertEqual(geometry.line_offset, 192)
+        self.assertEqual(geometry.lines_per_frame, 486)
+        self.assertEqual(geometry.samples_per_frame, 486 * 1024)
+
+    def test010_invalid(self):
+        with self.assertRaises(ValueError):
+            ScanGeometry(width=1000, samples_per_line=1024, line_offset=100)
+        with self.assertRaises(ValueError):
+            ScanGeometry(width=0)
+
+    def test020_from_vms_controller(self):
+        controller = VMSController(serial_path="debug")
+        controller.initialize()
+        geometry = ScanGeometry.from_vms_controller(controller, width=800)
+        controller.shutdown()
+
+        self.assertEqual(geometry.samples_per_line, 1024)
+        self.assertEqual(geometry.lines_for_vsync, 6)
+        self.assertEqual(geometry.height, 570)
+
+    def test030_equality(self):
+        self.assertEqual(ScanGeometry(), ScanGeometry())
+        self.assertNotEqual(ScanGeometry(), ScanGeometry(height=100))
+
+
+class FrameAssemblerTestCase(envtest.CoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.geometry = ScanGeometry(
+            width=40, height=30, samples_per_line=64, lines_for_vsync=3
+        )
+        self.digitizer = SyntheticDigitizer(
+            self.geometry, flyback_value=255, realtime=False
+        )
+
+    def assemble(self, assembler, block_sizes, use_vsync=True):
+        frames = []
+        for n_samples in block_sizes:
+            samples, hsync, vsync = self.digitizer.read(n_samples)
+            if not use_vsync:
+                vsync = None
+            frames.extend(f.copy() for f in assembler.push(samples, hsync, vsync))
+        return frames
+
+    def test000_init(self):
+        assembler = FrameAssembler(self.geometry)
+        self.assertEqual(assembler.buffers.shape, (3, 30, 40))
+        self.assertEqual(assembler.push([], []), [])
+
+    def test010_one_frame_per_block(self):
+        assembler = FrameAssembler(self.geometry)
+        frames = self.assemble(assembler, [self.geometry.samples_per_frame] * 3)
+        self.assertEqual(len(frames), 3)
+        for frame in frames:
+            self.assertTrue(np.array_equal(frame, self.digitizer.image))
+
+    def test020_blocks_across_lines(self):
+        # Block boundaries anywhere: in lines, in active pixels, in flyback
+        assembler = FrameAssembler(self.geometry)
+        rng = np.random.default_rng(0)
+        sizes = rng.integers(1, 300, size=2000)
+        frames = self.assemble(assembler, sizes)
+
+        self.assertEqual(len(frames), sizes.sum() // self.geometry.samples_per_frame)
+        # No flyback sample in the frames
+        for frame in frames:
+            self.assertTrue(np.array_equal(frame, self.digitizer.image))
+
+    def test030_synchronize_on_vsync(self):
+        # Start in the middle of a frame: the first partial frame is dropped
+        self.digitizer.read(1000)
+        assembler = FrameAssembler(self.geometry)
+        frames = self.assemble(assembler, [500] * 30)
+        self.assertGreater(len(frames), 0)
+        for frame in frames:
+            self.assertTrue(np.array_equal(frame, self.digitizer.image))
+
+    def test040_free_running_without_vsync(self):
+        assembler = FrameAssembler(self.geometry)
+        frames = self.assemble(assembler, [700] * 30, use_vsync=False)
+        self.assertGreater(len(frames), 0)
+        for frame in frames:
+            self.assertTrue(np.array_equal(frame, self.digitizer.image))
+
+    def test050_buffers_are_reused(self):
+        assembler = FrameAssembler(self.geometry, n_buffers=2)
+        samples, hsync, vsync = self.digitizer.read(
+            self.geometry.samples_per_frame * 3
+        )
+        frames = assembler.push(samples, hsync, vsync)
+        self.assertEqual(len(frames), 3)
+        self.assertIs(frames[0].base, assembler.buffers)
+        self.assertTrue(np.shares_memory(frames[0], frames[2]))
+        self.assertEqual(assembler.frames_assembled, 3)
+
+    def test060_throughput(self):
+        geometry = ScanGeometry()
+        digitizer = SyntheticDigitizer(geometry, realtime=False)
+        assembler = FrameAssembler(geometry)
+        blocks = [digitizer.read(262144) for _ in range(40)]
+
+        start_time = time.perf_counter()
+        for samples, hsync, vsync in blocks:
+            assembler.push(samples, hsync, vsync)
+        rate = 40 * 262144 / (time.perf_counter() - start_time)
+
+        self.assertGreater(assembler.frames_assembled, 15)
+        # Tens of MHz pixel clocks
+        self.assertGreater(rate, 20e6)
+
+
+class LSMImageProviderTestCase(envtest.CoreTestCase):
+    def test000_init(self):
+        provider = LSMImageProvider()
+        self.assertEqual(provider.scan_geometry(), ScanGeometry())
+
+    def test010_capture_image(self):
+        provider = LSMImageProvider(
+            configuration={"width": 100, "height": 50, "pixel_frequency": 1e9}
+        )
+        img = provider.capture_image()
+        self.assertEqual(img.shape, (50, 100, 1))
+        self.assertTrue(np.array_equal(img[:, :, 0], provider.digitizer.image))
+
+    def test020_captured_image_is_not_reused(self):
+        provider = LSMImageProvider(
+            configuration={"width": 100, "height": 50, "pixel_frequency": 1e9}
+        )
+        img = provider.capture_image()
+        self.assertFalse(np.shares_memory(img, provider.assembler.buffers))
+        self.assertTrue(img.flags.writeable)
+
+
+if __name__ == "__main__":
+    envtest.main()
@@ -0,0 +1,130 @@
+import envtest  # setup environment for testing
+import tempfile
+from pathlib import Path
+
+from pymicroscope.experiment.actions import *
+from pymicroscope.experiment.experiments import (
+    Experiment,
+    ExperimentNotification,
+    ExperimentStep,
+)
+from pymicroscope.experiment.journal import ExperimentJournal
+
+
+class JournalTestCase(envtest.CoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.directory = Path(self.tmpdir.name)
+        self.journal_path = self.directory / "journal.jsonl"
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+        super().tearDown()
+
+    def save_experiment(self, n_steps, calls, journal):
+        def save_tile(i):
+            calls.append(i)
+            filepath = self.directory / f"tile-{i}.bin"
+            filepath.write_bytes(bytes([i]) * 16)
+            return {"filepath": filepath}
+
+        exp = Experiment(journal=journal)
+        for i in range(n_steps):
+            exp.add_step(
+                ExperimentStep.from_function(save_tile, fct_kwargs={"i": i})
+            )
+        return exp
+
+    def test000_init(self):
+        journal = ExperimentJournal(self.journal_path)
+        self.assertIsNotNone(journal)
+        self.assertEqual(journal.records(), [])
+        self.assertIsNone(journal.last_completed_step())
+
+    def test010_record_step_with_checksum(self):
+        filepath = self.directory / "image.tif"
+        filepath.write_bytes(b"1234")
+
+        journal = ExperimentJournal(self.journal_path)
+        record = journal.record_step(0, {"perform-0": {"filepath": filepath}})
+        self.assertEqual(record["step"], 0)
+        self.assertEqual(len(record["files"]), 1)
+        self.assertEqual(
+            record["files"][0]["sha256"], ExperimentJournal.checksum(filepath)
+        )
+        self.assertEqual(journal.last_completed_step(), 0)
+
+    def test020_modified_output_invalidates_step(self):
+        filepath = self.directory / "image.tif"
+        filepath.write_bytes(b"1234")
+
+        journal = ExperimentJournal(self.journal_path)
+        record = journal.record_step(0, {"filepath": filepath})
+        self.assertTrue(journal.is_valid(record))
+
+        filepath.write_bytes(b"corrupted")
+        self.assertFalse(journal.is_valid(record))
+        filepath.unlink()
+        self.assertFalse(journal.is_valid(record))
+
+    def test030_truncated_line_is_ignored(self):
+        journal = ExperimentJournal(self.journal_path)
+        journal.record_step(0)
+        with open(self.journal_path, "a") as file:
+            file.write('{"step": 1, "fil')
+
+        self.assertEqual(list(journal.completed_steps().keys()), [0])
+
+    def test040_other_plan_is_ignored(self):
+        ExperimentJournal(self.journal_path, plan_id="a").record_step(0)
+        self.assertEqual(
+            ExperimentJournal(self.journal_path, plan_id="b").records(), []
+        )
+
+    def test050_experiment_resumes(self):
+        calls = []
+        journal = ExperimentJournal(self.journal_path, plan_id="map")
+        self.save_experiment(3, calls, journal).perform()
+        self.assertEqual(calls, [0, 1, 2])
+
+        # Simulate a crash after step 1: journal only knows steps 0 and 1
+        lines = self.journal_path.read_text().splitlines()
+        self.journal_path.write_text("\n".join(lines[:2]) + "\n")
+        (self.directory / "tile-0.bin").unlink()
+
+        calls = []
+        self.save_experiment(3, calls, journal).perform()
+        self.assertEqual(calls, [0, 2])
+
+    def test060_skipped_steps_are_notified(self):
+        journal = ExperimentJournal(self.journal_path, plan_id="map")
+        self.save_experiment(3, [], journal).perform()
+        self.journal_path.write_text(
+            "\n".join(self.journal_path.read_text().splitlines()[:2]) + "\n"
+        )
+
+        skipped = []
+        exp = self.save_experiment(3, [], journal)
+        NotificationCenter().add_observer(
+            self,
+            method=lambda notification: skipped.append(
+                notification.user_info["current_step"]
+            ),
+            notification_name=ExperimentNotification.did_skip_experiment_step,
+            observed_object=exp,
+        )
+        try:
+            exp.perform()
+        finally:
+            NotificationCenter().remove_observer(self)
+        # The map preview places the tiles of these steps from the pyramid
+        self.assertEqual(skipped, [0, 1])
+
+    def test070_journal_is_a_keyword_argument(self):
+        journal = ExperimentJournal(self.journal_path)
+        self.assertIs(Experiment(journal=journal).journal, journal)
+
+
+if __name__ == "__main__":
+    envtest.main()
@@ -8,9 +8,14 @@ Validates:
 - Overlap fraction behavior
 - Z-stack position generation
 - Validation of microstep_pixel
+- Z positions following a focus map
+- Structured position grid, traversal order and rotated sample areas
 """
 
 import envtest
+import math
+import numpy as np
+from pymicroscope.base.focusmap import FocusMap
 from pymicroscope.base.mapcontroller import MapController
 
 
@@ -118,6 +123,140 @@ class MapControllerTestCase(envtest.CoreTestCase):
         positions = self.controller.create_positions_for_map()
         self.assertEqual(positions[0], (0, 0, 0))
 
+    def set_corners(self):
+        self.controller.parameters["Upper left corner"] = (0.0, 200.0, 0.0)
+        self.controller.parameters["Upper right corner"] = (500.0, 200.0, 0.0)
+        self.controller.parameters["Lower left corner"] = (0.0, 0.0, 0.0)
+        self.controller.parameters["Lower right corner"] = (500.0, 0.0, 0.0)
+
+    def test120_z_follows_focus_map(self):
+        self.set_corners()
+        focus_map = FocusMap()
+        focus_map.add_point(0, 0, 10)
+        focus_map.add_point(1000, 0, 20)
+        focus_map.add_point(0, 1000, 10)
+        self.controller.focus_map = focus_map
+
+        positions = self.controller.create_positions_for_map()
+        x_image_dimension = self.controller.x_dimension * self.controller.microstep_pixel
+        y_image_dimension = self.controller.y_dimension * self.controller.microstep_pixel
+        for x, y, z in positions:
+            self.assertAlmostEqual(z, 10 + (x + x_image_dimension / 2) / 100)
+        self.assertEqual(positions[0][:2], (0, 0))
+
+    def test130_z_stack_centered_on_focus_map(self):
+        focus_map = FocusMap()
+        focus_map.add_point(0, 0, 50)
+        self.controller.focus_map = focus_map
+        self.controller.z_image_number = 3
+
+        z_values = [p[2] for p in self.controller.create_positions_for_map()]
+        z_step = self.controller.z_range * self.controller.microstep_pixel
+        self.assertEqual(z_values, [50 - z_step, 50, 50 + z_step])
+
+    def test140_empty_focus_map_is_ignored(self):
+        self.controller.focus_map = FocusMap()
+        positions = self.controller.create_positions_for_map()
+        self.assertEqual(positions[0], (0, 0, 0))
+
+    def test150_focus_sample_positions(self):
+        self.set_corners()
+        number_of_x_images, number_of_y_images = self.controller.number_of_images()
+        points = self.controller.focus_sample_positions(points_per_side=3)
+        self.assertEqual(
+            len(points), min(3, number_of_x_images) * min(3, number_of_y_images)
+        )
+        x_image_dimension = self.controller.x_dimension * self.controller.microstep_pixel
+        self.assertAlmostEqual(points[0][0], x_image_dimension / 2)
+
+    def test155_focus_map_in_stage_coordinates(self):
+        # Corners away from the stage origin
+        self.controller.parameters["Upper left corner"] = (1000.0, 3200.0, 0.0)
+        self.controller.parameters["Upper right corner"] = (1500.0, 3200.0, 0.0)
+        self.controller.parameters["Lower left corner"] = (1000.0, 3000.0, 0.0)
+        self.controller.parameters["Lower right corner"] = (1500.0, 3000.0, 0.0)
+        self.assertEqual(self.controller.stage_origin(), (1000.0, 3000.0))
+
+        # Focus points recorded at the stage positions: z = x / 100
+        focus_map = FocusMap()
+        for x, y in self.controller.focus_sample_positions(points_per_side=3):
+            focus_map.add_point(x, y, x / 100)
+        self.assertEqual(len(focus_map), 9)
+        self.controller.focus_map = focus_map
+
+        x_image_dimension = self.controller.x_dimension * self.controller.microstep_pixel
+        grid = self.controller.create_position_grid()
+        self.assertEqual((grid["x"][0], grid["y"][0]), (0, 0))
+        expected_z = (1000 + grid["x"] + x_image_dimension / 2) / 100
+        self.assertTrue(np.allclose(grid["z"], expected_z))
+
+    def test160_position_grid_is_structured(self):
+        self.set_corners()
+        self.controller.z_image_number = 2
+        grid = self.controller.create_position_grid()
+        self.assertEqual(grid.dtype, MapController.position_dtype)
+
+        positions = self.controller.create_positions_for_map()
+        self.assertEqual(len(grid), len(positions))
+        for record, position in zip(grid, positions):
+            self.assertEqual((record["x"], record["y"], record["z"]), position)
+
+        number_of_x_images, number_of_y_images = self.controller.number_of_images()
+        self.assertEqual(grid["tile_ix"].max(), number_of_x_images - 1)
+        self.assertEqual(grid["tile_iy"].max(), number_of_y_images - 1)
+        self.assertEqual(grid["tile_iz"].max(), 1)
+
+    def test170_raster_order(self):
+        self.set_corners()
+        grid = self.controller.create_position_grid(traversal="raster")
+        keys = list(zip(grid["tile_iz"], grid["tile_iy"], grid["tile_ix"]))
+        self.assertEqual(keys, sorted(keys))
+
+    def test180_serpentine_order(self):
+        self.set_corners()
+        self.controller.microstep_pixel = 0.05
+        grid = self.controller.create_position_grid(traversal="serpentine")
+        raster = self.controller.create_position_grid(traversal="raster")
+        self.assertEqual(sorted(grid.tolist()), sorted(raster.tolist()))
+
+        # Consecutive tiles are always neighbours
+        steps = np.abs(np.diff(grid["tile_ix"])) + np.abs(np.diff(grid["tile_iy"]))
+        self.assertTrue(np.all(steps == 1))
+
+        with self.assertRaises(ValueError):
+            self.controller.create_position_grid(traversal="spiral")
+
+    def test190_rotated_sample_area(self):
+        angle = math.radians(30)
+        c, s = math.cos(angle), math.sin(angle)
+        width, height = 500.0, 200.0
+        self.controller.parameters["Lower left corner"] = (0.0, 0.0, 0.0)
+        self.controller.parameters["Lower right corner"] = (width * c, width * s, 0.0)
+        self.controller.parameters["Upper left corner"] = (-height * s, height * c, 0.0)
+        self.controller.parameters["Upper right corner"] = (
+            width * c - height * s,
+            width * s + height * c,
+            0.0,
+        )
+
+        grid = self.controller.create_position_grid()
+        step_factor = 1.0 - self.controller.overlap_fraction
+        x_step = self.controller.x_dimension * self.controller.microstep_pixel * step_factor
+        y_step = self.controller.y_dimension * self.controller.microstep_pixel * step_factor
+
+        expected_x = grid["tile_ix"] * x_step * c - grid["tile_iy"] * y_step * s
+        expected_y = grid["tile_ix"] * x_step * s + grid["tile_iy"] * y_step * c
+        self.assertTrue(np.allclose(grid["x"], expected_x))
+        self.assertTrue(np.allclose(grid["y"], expected_y))
+
+    def test200_large_grid(self):
+        self.set_corners()
+        self.controller.microstep_pixel = 0.001
+        self.controller.z_image_number = 20
+        grid = self.controller.create_position_grid(traversal="serpentine")
+        self.assertTrue(len(grid) > 1_000_000)
+        self.assertEqual(grid.itemsize, 36)
+
 
 if __name__ == "__main__":
     envtest.main()
@@ -0,0 +1,85 @@
+import envtest  # setup environment for testing
+import time
+
+import numpy as np
+
+from pymicroscope.base.mosaicpreview import MosaicCanvas
+from pymicroscope.experiment.actions import ActionAddToMosaic, ActionMean
+
+
+class CanvasOnlyPreview:
+    def __init__(self, canvas):
+        self.canvas = canvas
+        self.regions = []
+
+    def add_tile(self, image, top, left):
+        self.regions.append(self.canvas.place_tile(image, top, left))
+
+
+class MosaicCanvasTestCase(envtest.CoreTestCase):
+    def setUp(self):
+        super().setUp()
+        rng = np.random.default_rng(0)
+        self.scene = rng.integers(0, 255, (300, 400, 3), dtype=np.uint8)
+
+    def test000_init(self):
+        canvas = MosaicCanvas((300, 400), step=4)
+        self.assertEqual(canvas.array.shape, (75, 100, 3))
+        self.assertTrue(np.all(canvas.array == 0))
+
+    def test010_for_positions(self):
+        positions = [(0, 0), (0, 90), (72, 0), (72, 90)]
+        canvas = MosaicCanvas.for_positions(positions, (80, 100), max_size=50)
+        self.assertEqual(canvas.step, 4)
+        self.assertEqual(canvas.array.shape, (38, 48, 3))
+
+    def test020_place_tile_returns_changed_region(self):
+        canvas = MosaicCanvas((300, 400), step=1)
+        region = canvas.place_tile(self.scene[:100, :120], 50, 60)
+        self.assertEqual(region, (50, 60, 150, 180))
+        self.assertTrue(
+            np.array_equal(canvas.array[50:150, 60:180], self.scene[:100, :120])
+        )
+        self.assertTrue(np.all(canvas.array[:50] == 0))
+
+    def test030_downsampled_tiles_match_downsampled_scene(self):
+        step = 3
+        canvas = MosaicCanvas((300, 400), step=step)
+        for top in range(0, 300, 100):
+            for left in range(0, 400, 100):
+                tile = self.scene[top : top + 100, left : left + 100]
+                canvas.place_tile(tile, top, left)
+
+        self.assertTrue(np.array_equal(canvas.array, self.scene[::step, ::step]))
+
+    def test040_tile_outside_or_clipped(self):
+        canvas = MosaicCanvas((100, 100), step=2)
+        self.assertIsNone(canvas.place_tile(self.scene[:10, :10], 200, 200))
+        region = canvas.place_tile(self.scene[:100, :100], 60, 60)
+        self.assertEqual(region, (30, 30, 50, 50))
+
+    def test050_grayscale_tile(self):
+        canvas = MosaicCanvas((100, 100), step=1)
+        canvas.place_tile(np.full((10, 10), 7.0), 0, 0)
+        self.assertTrue(np.all(canvas.array[:10, :10] == 7))
+
+    def test060_placing_is_fast(self):
+        canvas = MosaicCanvas((20000, 20000), step=25)
+        tile = np.zeros((480, 640, 3), dtype=np.uint8)
+        start = time.perf_counter()
+        for i in range(100):
+            canvas.place_tile(tile, 400 * (i // 10), 600 * (i % 10))
+        self.assertLess(time.perf_counter() - start, 0.5)
+
+    def test070_action_add_to_mosaic(self):
+        preview = CanvasOnlyPreview(MosaicCanvas((300, 400), step=2))
+        mean = ActionMean(source=None)
+        mean.output = self.scene[:100, :100]
+        action = ActionAddToMosaic(preview, source=mean, position=(100, 200))
+        results = action.perform()
+        self.assertEqual(results["position"], (100, 200))
+        self.assertEqual(preview.regions, [(50, 100, 100, 150)])
+
+
+if __name__ == "__main__":
+    envtest.main()
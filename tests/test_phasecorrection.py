@@ -0,0 +1,132 @@
+import envtest  # setup environment for testing
+import time
+
+import numpy as np
+
+from pymicroscope.acquisition.digitizer import SyntheticDigitizer
+from pymicroscope.acquisition.frameassembler import FrameAssembler, ScanGeometry
+from pymicroscope.acquisition.lsmprovider import LSMImageProvider
+from pymicroscope.acquisition.phasecorrection import (
+    PhaseCorrector,
+    estimate_phase_offset,
+)
+
+
+def textured_image(shape):
+    # Smoothed noise: a sample with details at all scales
+    rng = np.random.default_rng(1)
+    spectrum = np.fft.rfft2(rng.random(shape))
+    fy = np.fft.fftfreq(shape[0])[:, np.newaxis]
+    fx = np.fft.rfftfreq(shape[1])[np.newaxis, :]
+    spectrum *= np.exp(-(fx**2 + fy**2) / (2 * 0.05**2))
+    image = np.fft.irfft2(spectrum, s=shape)
+    image = (image - image.min()) / (image.max() - image.min())
+    return (image * 255).astype(np.uint8)
+
+
+def bidirectional_frame(phase_offset, shape=(200, 300)):
+    geometry = ScanGeometry(
+        width=shape[1],
+        height=shape[0],
+        samples_per_line=shape[1] + 100,
+        bidirectional=True,
+    )
+    digitizer = SyntheticDigitizer(
+        geometry,
+        image=textured_image(shape),
+        phase_offset=phase_offset,
+        realtime=False,
+    )
+    assembler = FrameAssembler(geometry)
+    frames = assembler.push(*digitizer.read(geometry.samples_per_frame * 2))
+    return frames[0].copy(), digitizer.image
+
+
+class PhaseEstimationTestCase(envtest.CoreTestCase):
+    def test000_aligned(self):
+        frame, image = bidirectional_frame(0)
+        self.assertTrue(np.array_equal(frame, image))
+        self.assertAlmostEqual(estimate_phase_offset(frame), 0, delta=0.1)
+
+    def test010_subpixel_offsets(self):
+        for phase_offset in (2.3, -1.6, 5.0):
+            frame, _ = bidirectional_frame(phase_offset)
+            self.assertAlmostEqual(
+                estimate_phase_offset(frame), phase_offset, delta=0.25
+            )
+
+    def test020_color_frames(self):
+        frame, _ = bidirectional_frame(3)
+        color = np.repeat(frame[:, :, np.newaxis], 3, axis=2)
+        self.assertAlmostEqual(estimate_phase_offset(color), 3, delta=0.25)
+
+
+class PhaseCorrectorTestCase(envtest.CoreTestCase):
+    def test000_init(self):
+        corrector = PhaseCorrector()
+        self.assertFalse(corrector.is_estimated)
+        self.assertEqual(corrector.offset, 0)
+
+    def test010_correct(self):
+        frame, image = bidirectional_frame(2.5)
+        corrector = PhaseCorrector(n_estimation_frames=2)
+        corrector.correct(frame)
+        corrected = corrector.correct(frame)
+        self.assertTrue(corrector.is_estimated)
+
+        error = np.abs(corrected[:, 10:-10].astype(int) - image[:, 10:-10])
+        raw_error = np.abs(frame[:, 10:-10].astype(int) - image[:, 10:-10])
+        self.assertLess(error.mean(), raw_error.mean() / 4)
+
+    def test020_estimated_once(self):
+        frame, _ = bidirectional_frame(2)
+        corrector = PhaseCorrector(n_estimation_frames=1, check_interval=1000)
+        corrector.correct(frame)
+        offset = corrector.offset
+
+        # Estimates on other frames are not used until a drift check
+        shifted, _ = bidirectional_frame(-3)
+        corrector.correct(shifted)
+        self.assertEqual(corrector.offset, offset)
+
+        corrector.correct(shifted, configuration_key="new geometry")
+        self.assertAlmostEqual(corrector.offset, -3, delta=0.25)
+
+    def test030_drift_is_detected(self):
+        frame, _ = bidirectional_frame(2)
+        corrector = PhaseCorrector(n_estimation_frames=1, check_interval=5)
+        corrector.correct(frame)
+
+        drifted, _ = bidirectional_frame(4)
+        for _ in range(5):
+            corrector.correct(drifted)
+        self.assertAlmostEqual(corrector.offset, 4, delta=0.25)
+
+    def test040_cost_of_correction(self):
+        frame = np.random.default_rng(0).integers(0, 255, (480, 640), dtype=np.uint8)
+        corrector = PhaseCorrector()
+        corrector.set_offset(1.5)
+        corrector.is_estimated = True
+
+        start_time = time.perf_counter()
+        for _ in range(10):
+            corrector.correct(frame)
+        duration = (time.perf_counter() - start_time) / 10
+        self.assertLess(duration, 0.25 / 30)
+
+    def test050_provider(self):
+        provider = LSMImageProvider(
+            configuration={
+                "width": 200,
+                "height": 100,
+                "pixel_frequency": 1e9,
+                "bidirectional": 1,
+                "simulated_phase_offset": 2.0,
+            }
+        )
+        provider.capture_image()
+        self.assertAlmostEqual(provider.phase_corrector.offset, 2, delta=0.25)
+
+
+if __name__ == "__main__":
+    envtest.main()
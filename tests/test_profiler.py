@@ -0,0 +1,76 @@
+import envtest  # setup environment for testing
+import json
+import tempfile
+
+from pymicroscope.experiment.actions import *
+from pymicroscope.experiment.experiments import Experiment, ExperimentStep
+from pymicroscope.experiment.profiler import ExperimentProfiler
+
+
+class ProfilerTestCase(envtest.CoreTestCase):
+    def performed_experiment(self):
+        def busy(duration):
+            end_time = time.time() + duration
+            while time.time() < end_time:
+                pass
+
+        exp = Experiment()
+        for _ in range(2):
+            exp.add_step(
+                ExperimentStep(
+                    prepare=[ActionWait(0.05)],
+                    perform=[ActionFunctionCall(busy, (0.05,))],
+                )
+            )
+        exp.perform()
+        return exp
+
+    def test000_init(self):
+        self.assertIsNotNone(ExperimentProfiler())
+
+    def test010_action_records_wait_and_cpu_time(self):
+        action = ActionWait(0.1)
+        results = action.perform()
+        self.assertAlmostEqual(results["wait_time"], 0.1, delta=0.05)
+        self.assertTrue(results["cpu_time"] < results["duration"])
+
+    def test020_collect(self):
+        profiler = ExperimentProfiler.from_experiment(self.performed_experiment())
+        self.assertEqual(len(profiler.records), 4)
+        self.assertEqual(
+            [record["phase"] for record in profiler.records],
+            ["prepare", "perform", "prepare", "perform"],
+        )
+
+    def test030_summary(self):
+        profiler = ExperimentProfiler.from_experiment(self.performed_experiment())
+        summary = profiler.summary()
+        self.assertEqual(summary["ActionWait"]["count"], 2)
+        self.assertTrue(summary["ActionWait"]["wait_time"] > 0.08)
+        self.assertTrue(summary["ActionFunctionCall"]["cpu_time"] > 0.05)
+        self.assertAlmostEqual(
+            sum(total["fraction"] for total in summary.values()), 1
+        )
+        self.assertIn("ActionWait", profiler.summary_table())
+
+    def test040_export_trace(self):
+        profiler = ExperimentProfiler.from_experiment(self.performed_experiment())
+        with tempfile.TemporaryDirectory() as directory:
+            filepath = profiler.export_trace(Path(directory) / "trace.json")
+            with open(filepath) as file:
+                trace = json.load(file)
+
+        events = trace["traceEvents"]
+        self.assertEqual(len(events), 4 + 2)
+        for event in events:
+            self.assertEqual(event["ph"], "X")
+            self.assertTrue(event["dur"] >= 0)
+
+    def test050_empty_experiment(self):
+        profiler = ExperimentProfiler.from_experiment(Experiment())
+        self.assertEqual(profiler.trace_events(), [])
+        self.assertEqual(profiler.summary(), {})
+
+
+if __name__ == "__main__":
+    envtest.main()
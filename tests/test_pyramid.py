@@ -0,0 +1,140 @@
+import envtest  # setup environment for testing
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from pymicroscope.base.pyramid import PyramidBuilder, PyramidReader
+from pymicroscope.experiment.actions import ActionAddToPyramid, ActionMean
+
+
+class PyramidTestCase(envtest.CoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.directory = Path(self.tmp.name) / "pyramid"
+        rng = np.random.default_rng(0)
+        self.scene = rng.integers(0, 255, (300, 420, 3), dtype=np.uint8)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+        super().tearDown()
+
+    def build_scene(self, chunk_size=64):
+        builder = PyramidBuilder(self.directory, chunk_size=chunk_size)
+        for top in range(0, 300, 100):
+            for left in range(0, 420, 140):
+                tile = self.scene[top : top + 100, left : left + 140]
+                builder.add_tile(tile, top, left)
+        return builder
+
+    def test000_init(self):
+        builder = PyramidBuilder(self.directory)
+        self.assertIsNotNone(builder)
+        self.assertEqual(builder.shape, (0, 0))
+        self.assertTrue((self.directory / "pyramid.json").exists())
+
+    def test010_levels_grow_with_mosaic(self):
+        builder = PyramidBuilder(self.directory, chunk_size=64)
+        self.assertEqual(builder.levels, 1)
+        builder.add_tile(np.zeros((64, 64, 3), dtype=np.uint8), 0, 0)
+        self.assertEqual(builder.levels, 1)
+        builder.add_tile(np.zeros((64, 64, 3), dtype=np.uint8), 0, 200)
+        self.assertEqual(builder.shape, (64, 264))
+        self.assertEqual(builder.levels, 4)
+
+    def test015_new_levels_include_earlier_tiles(self):
+        builder = PyramidBuilder(self.directory, chunk_size=256)
+        tile = np.full((256, 256, 3), 200, dtype=np.uint8)
+        builder.add_tile(tile, 0, 0)
+        builder.add_tile(tile, 0, 1024)
+        self.assertEqual(builder.levels, 4)
+
+        reader = PyramidReader(self.directory)
+        for level in range(1, 4):
+            size = 256 // 2**level
+            region = reader.read_region(level, 0, 0, size, size)
+            self.assertTrue(np.all(region == 200), f"level {level}")
+
+    def test016_every_level_of_a_growing_mosaic(self):
+        rng = np.random.default_rng(1)
+        scene = rng.integers(0, 255, (256, 512, 3), dtype=np.uint8)
+        builder = PyramidBuilder(self.directory, chunk_size=32)
+        for top in range(0, 256, 64):
+            for left in range(0, 512, 64):
+                tile = scene[top : top + 64, left : left + 64]
+                builder.add_tile(tile, top, left)
+        self.assertEqual(builder.levels, 5)
+
+        reader = PyramidReader(self.directory)
+        expected = scene
+        for level in range(1, builder.levels):
+            height, width = expected.shape[0] // 2, expected.shape[1] // 2
+            expected = np.rint(
+                expected.reshape(height, 2, width, 2, 3).mean(axis=(1, 3))
+            ).astype(np.uint8)
+            region = reader.read_region(level, 0, 0, height, width)
+            self.assertTrue(np.array_equal(region, expected), f"level {level}")
+
+    def test020_full_resolution_round_trip(self):
+        self.build_scene()
+        reader = PyramidReader(self.directory)
+        self.assertEqual(reader.shape, (300, 420))
+        region = reader.read_region(0, 0, 0, 300, 420)
+        self.assertTrue(np.array_equal(region, self.scene))
+
+        region = reader.read_region(0, 37, 91, 50, 200)
+        self.assertTrue(np.array_equal(region, self.scene[37:87, 91:291]))
+
+    def test030_levels_are_downsampled(self):
+        self.build_scene()
+        reader = PyramidReader(self.directory)
+        level1 = reader.read_region(1, 0, 0, 150, 210)
+        expected = self.scene.reshape(150, 2, 210, 2, 3).mean(axis=(1, 3))
+        self.assertTrue(np.abs(level1.astype(float) - expected).max() <= 0.5)
+
+    def test040_outside_is_fill_value(self):
+        self.build_scene()
+        reader = PyramidReader(self.directory)
+        region = reader.read_region(0, -10, -10, 20, 20)
+        self.assertTrue(np.all(region[:10, :] == 0))
+        self.assertTrue(np.array_equal(region[10:, 10:], self.scene[:10, :10]))
+
+    def test050_read_view_loads_only_needed_chunks(self):
+        builder = self.build_scene(chunk_size=32)
+        reader = PyramidReader(self.directory)
+        self.assertEqual(reader.level_for_zoom(1), 0)
+        self.assertEqual(reader.level_for_zoom(0.25), 2)
+        self.assertEqual(reader.level_for_zoom(1e-6), builder.levels - 1)
+
+        view = reader.read_view((150, 210), 1.0, (32, 32))
+        self.assertEqual(view.shape, (32, 32, 3))
+        self.assertTrue(np.array_equal(view, self.scene[134:166, 194:226]))
+        self.assertTrue(len(reader._cache) <= 4)
+
+        view = reader.read_view((150, 210), 0.1, (30, 42))
+        self.assertEqual(view.shape, (30, 42, 3))
+        self.assertTrue(all(key[0] == 3 for key in list(reader._cache)[-4:]))
+
+    def test060_resume_existing_pyramid(self):
+        self.build_scene()
+        builder = PyramidBuilder(self.directory, chunk_size=64)
+        self.assertEqual(builder.shape, (300, 420))
+        with self.assertRaises(ValueError):
+            PyramidBuilder(self.directory, chunk_size=128)
+
+    def test070_action_add_to_pyramid(self):
+        builder = PyramidBuilder(self.directory, chunk_size=64)
+        mean = ActionMean(source=None)
+        mean.output = self.scene[:100, :140]
+        action = ActionAddToPyramid(builder, source=mean, position=(10, 20))
+        results = action.perform()
+        self.assertEqual(results["position"], (10, 20))
+
+        reader = PyramidReader(self.directory)
+        region = reader.read_region(0, 10, 20, 100, 140)
+        self.assertTrue(np.array_equal(region, self.scene[:100, :140]))
+
+
+if __name__ == "__main__":
+    envtest.main()
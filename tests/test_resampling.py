@@ -0,0 +1,98 @@
+import envtest  # setup environment for testing
+import time
+
+import numpy as np
+
+from pymicroscope.acquisition.lsmprovider import LSMImageProvider
+from pymicroscope.acquisition.resampling import (
+    LineResampler,
+    resampling_table,
+    scan_models,
+)
+from pymicroscope.acquisition.vmscontroller import VMSController
+
+
+class ResamplingTableTestCase(envtest.CoreTestCase):
+    def test000_init(self):
+        indices, weights = resampling_table("polygon", 100, 80)
+        self.assertEqual(indices.shape, (80, 2))
+        self.assertEqual(weights.shape, (80, 2))
+        self.assertTrue(np.allclose(weights.sum(axis=1), 1))
+        self.assertTrue(np.all(indices >= 0))
+        self.assertTrue(np.all(indices < 100))
+
+    def test010_invalid(self):
+        with self.assertRaises(ValueError):
+            resampling_table("galvo", 100, 100)
+        with self.assertRaises(ValueError):
+            resampling_table("linear", 1, 100)
+
+    def test020_cached_and_read_only(self):
+        table = resampling_table("sinusoidal", 200, 150, duty_cycle=0.8)
+        self.assertIs(resampling_table("sinusoidal", 200, 150, duty_cycle=0.8), table)
+        with self.assertRaises(ValueError):
+            table[0][0, 0] = 1
+
+    def test030_positions_are_monotonic(self):
+        for model in scan_models.values():
+            positions = model(500, 36, 0.9)
+            self.assertTrue(np.all(np.diff(positions) > 0))
+
+
+class LineResamplerTestCase(envtest.CoreTestCase):
+    def test000_linear_is_identity(self):
+        resampler = LineResampler("linear", 64)
+        frame = np.arange(64 * 4, dtype=np.uint16).reshape(4, 64)
+        self.assertIs(resampler.resample(frame), frame)
+        with self.assertRaises(ValueError):
+            resampler.resample(frame[:, :10])
+
+    def test010_sinusoidal_scan_is_undistorted(self):
+        # A uniform ramp on the sample, seen by a resonant scanner
+        n_samples, duty_cycle = 800, 0.8
+        positions = scan_models["sinusoidal"](n_samples, 0, duty_cycle)
+        line = (positions - positions[0]) / (positions[-1] - positions[0])
+        frame = np.tile(line * 1000, (10, 1))
+
+        resampler = LineResampler("sinusoidal", n_samples, 400, duty_cycle=duty_cycle)
+        resampled = resampler.resample(frame)
+        self.assertEqual(resampled.shape, (10, 400))
+        self.assertTrue(np.allclose(resampled[0], np.linspace(0, 1000, 400), atol=0.1))
+
+    def test020_integer_frames(self):
+        resampler = LineResampler("polygon", 640)
+        frame = np.full((480, 640), 200, dtype=np.uint8)
+        resampled = resampler.resample(frame)
+        self.assertEqual(resampled.dtype, np.uint8)
+        self.assertTrue(np.all(resampled == 200))
+
+    def test030_for_vms_controller(self):
+        resampler = LineResampler.for_vms_controller(VMSController(), 640)
+        self.assertEqual(resampler.scan_model, "polygon")
+        self.assertEqual(resampler.n_pixels, 640)
+
+    def test040_fraction_of_frame_period(self):
+        resampler = LineResampler("polygon", 640)
+        frame = np.random.default_rng(0).integers(0, 255, (480, 640), dtype=np.uint8)
+        start_time = time.perf_counter()
+        for _ in range(10):
+            resampler.resample(frame)
+        duration = (time.perf_counter() - start_time) / 10
+        # 30 frames per second
+        self.assertLess(duration, 0.25 / 30)
+
+    def test050_provider(self):
+        provider = LSMImageProvider(
+            configuration={
+                "width": 100,
+                "height": 50,
+                "pixel_frequency": 1e9,
+                "scan_model": "polygon",
+            }
+        )
+        img = provider.capture_image()
+        self.assertEqual(img.shape, (50, 100, 1))
+
+
+if __name__ == "__main__":
+    envtest.main()
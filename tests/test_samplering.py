@@ -0,0 +1,177 @@
+import envtest  # setup environment for testing
+import time
+
+import numpy as np
+
+from pymicroscope.acquisition.digitizer import DigitizerProcess, SyntheticDigitizer
+from pymicroscope.acquisition.frameassembler import FrameAssembler, ScanGeometry
+from pymicroscope.acquisition.lsmprovider import LSMImageProvider
+from pymicroscope.acquisition.samplering import SampleRing
+from pymicroscope.acquisition.vmscontroller import VMSController
+
+
+class SyntheticDigitizerTestCase(envtest.CoreTestCase):
+    def test000_noise(self):
+        geometry = ScanGeometry(width=40, height=30, samples_per_line=64)
+        image = np.full(geometry.shape, 100, dtype=np.uint8)
+        digitizer = SyntheticDigitizer(
+            geometry, image=image, flyback_value=100, realtime=False, noise=5, seed=0
+        )
+        samples, _, _ = digitizer.read(100000)
+        self.assertEqual(samples.dtype, np.uint8)
+        self.assertAlmostEqual(samples.mean(), 100, delta=0.1)
+        self.assertAlmostEqual(samples.std(), 5, delta=0.1)
+
+    def test010_noise_is_clipped(self):
+        geometry = ScanGeometry(width=40, height=30, samples_per_line=64)
+        image = np.full(geometry.shape, 250, dtype=np.uint8)
+        digitizer = SyntheticDigitizer(
+            geometry, image=image, flyback_value=250, realtime=False, noise=20
+        )
+        samples, _, _ = digitizer.read(10000)
+        self.assertEqual(samples.max(), 255)
+
+    def test020_from_vms_controller(self):
+        controller = VMSController(serial_path="debug")
+        controller.initialize()
+        digitizer = SyntheticDigitizer.from_vms_controller(controller, width=800)
+        pixel_frequency = controller.pixel_frequency
+        hsync_frequency = controller.hsync_frequency
+        controller.shutdown()
+
+        self.assertEqual(digitizer.pixel_frequency, pixel_frequency)
+        self.assertAlmostEqual(
+            pixel_frequency / digitizer.geometry.samples_per_line,
+            hsync_frequency,
+            delta=hsync_frequency * 0.01,
+        )
+
+
+class SampleRingTestCase(envtest.CoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.geometry = ScanGeometry(
+            width=40, height=30, samples_per_line=64, lines_for_vsync=3
+        )
+        self.digitizer = SyntheticDigitizer(self.geometry, realtime=False)
+        self.ring = SampleRing(self.geometry, capacity=5000)
+
+    def tearDown(self):
+        self.ring.close()
+        super().tearDown()
+
+    def test000_init(self):
+        self.assertEqual(self.ring.samples.shape, (5000,))
+        self.assertEqual(self.ring.samples_written, 0)
+        ring = SampleRing(self.geometry)
+        self.assertEqual(ring.capacity, 4 * 33 * 64)
+        ring.close()
+
+    def test010_round_trip_across_the_end(self):
+        reference = SyntheticDigitizer(self.geometry, realtime=False)
+        for _ in range(20):
+            self.ring.write(*self.digitizer.read(1500))
+            samples, hsync, vsync = self.ring.read(1500)
+            expected_samples, expected_hsync, expected_vsync = reference.read(1500)
+            self.assertTrue(np.array_equal(samples, expected_samples))
+            self.assertTrue(np.array_equal(hsync, expected_hsync))
+            self.assertTrue(np.array_equal(vsync, expected_vsync))
+        self.assertEqual(self.ring.overruns, 0)
+
+    def test020_overrun_skips_to_oldest(self):
+        for _ in range(5):
+            self.ring.write(*self.digitizer.read(1500))
+        samples, _, _ = self.ring.read(1000)
+        self.assertEqual(self.ring.overruns, 1)
+        self.assertEqual(self.ring.samples_lost, 7500 - 5000)
+        self.assertTrue(
+            np.array_equal(
+                samples,
+                np.take(self.digitizer.frame_samples, np.arange(2500, 3500) % 2112),
+            )
+        )
+
+    def test030_read_timeout(self):
+        with self.assertRaises(TimeoutError):
+            self.ring.read(100, timeout=0.05)
+        with self.assertRaises(ValueError):
+            self.ring.read(10000)
+
+    def test035_provider_keeps_ring_of_other_geometry(self):
+        provider = LSMImageProvider(
+            digitizer=self.ring, configuration={"width": 80, "height": 30}
+        )
+        with self.assertRaises(ValueError):
+            provider.capture_image()
+        self.assertIs(provider.digitizer, self.ring)
+
+    def test040_assemble_from_ring(self):
+        assembler = FrameAssembler(self.geometry)
+        frames = []
+        for _ in range(30):
+            self.ring.write(*self.digitizer.read(700))
+            frames.extend(assembler.push(*self.ring.read(700)))
+        self.assertGreater(len(frames), 5)
+        for frame in frames:
+            self.assertTrue(np.array_equal(frame, self.digitizer.image))
+
+
+class DigitizerProcessTestCase(envtest.CoreTestCase):
+    def test000_stream_at_pixel_frequency(self):
+        geometry = ScanGeometry()
+        pixel_frequency = 20e6
+        ring = SampleRing(geometry)
+        process = DigitizerProcess(
+            ring, digitizer_kwargs={"pixel_frequency": pixel_frequency}
+        )
+        process.start()
+        try:
+            ring.read(65536, timeout=5)
+            start_time = time.perf_counter()
+            written = ring.samples_written
+            time.sleep(0.5)
+            rate = (ring.samples_written - written) / (
+                time.perf_counter() - start_time
+            )
+        finally:
+            process.terminate_synchronously()
+            ring.close()
+
+        self.assertAlmostEqual(rate, pixel_frequency, delta=0.2 * pixel_frequency)
+
+    def test010_provider_on_ring(self):
+        # End to end: process -> ring -> assembly -> resampling
+        geometry = ScanGeometry(
+            width=200, height=100, samples_per_line=512, line_offset=192
+        )
+        ring = SampleRing(geometry)
+        process = DigitizerProcess(
+            ring,
+            block_size=16384,
+            digitizer_kwargs={"pixel_frequency": 5e6, "noise": 2},
+        )
+        provider = LSMImageProvider(
+            digitizer=ring,
+            configuration={
+                "width": 200,
+                "height": 100,
+                "samples_per_line": 512,
+                "block_size": 16384,
+                "scan_model": "polygon",
+            },
+        )
+        process.start()
+        try:
+            images = [provider.capture_image() for _ in range(5)]
+        finally:
+            process.terminate_synchronously()
+            ring.close()
+
+        self.assertIs(provider.digitizer, ring)
+        self.assertEqual(ring.overruns, 0)
+        for image in images:
+            self.assertEqual(image.shape, (100, 200, 1))
+
+
+if __name__ == "__main__":
+    envtest.main()
@@ -0,0 +1,195 @@
+import envtest  # setup environment for testing
+import asyncio
+import os
+import struct
+import time
+import unittest
+from threading import Thread
+
+import serial
+
+from pymicroscope.acquisition.vmscontroller import VMSController
+from pymicroscope.hardware.serialtransport import (
+    SerialTimeout,
+    SerialTransport,
+    transport_for,
+)
+from pymicroscope.hardware.simulated import SerialLink, SimulatedVMSPort
+
+
+class EchoPort:
+    """
+    Answers every byte written with the same byte, after latency seconds.
+    Drops the first `lost` responses.
+    """
+
+    def __init__(self, latency=0.0, lost=0):
+        self.latency = latency
+        self.lost = lost
+        self.buffer = bytearray()
+        self.writes = []
+
+    def write(self, payload):
+        time.sleep(self.latency)
+        self.writes.append(bytes(payload))
+        if self.lost > 0:
+            self.lost -= 1
+        else:
+            self.buffer.extend(payload)
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        self.buffer.clear()
+
+    def read(self, size=1):
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+
+class PtyVMSDevice:
+    """
+    A simulated VMS controller on the master side of a pseudo-terminal:
+    the controller opens the slave like a real serial port.
+    """
+
+    def __init__(self):
+        self.master, self.slave = os.openpty()
+        self.path = os.ttyname(self.slave)
+        self.simulated = SimulatedVMSPort(
+            VMSController().commands, link=SerialLink(baudrate=10**9)
+        )
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        buffer = b""
+        while True:
+            try:
+                buffer += os.read(self.master, 1024)
+            except OSError:
+                return
+
+            # Only complete commands are given to the simulated controller
+            while len(buffer) > 0:
+                _, command = self.simulated.commands_by_code[buffer[0]]
+                size = struct.calcsize(command["command_bytes_format"])
+                if len(buffer) < size:
+                    break
+                self.simulated.write(buffer[:size])
+                buffer = buffer[size:]
+
+            response = self.simulated.read(self.simulated.in_waiting)
+            if len(response) > 0:
+                os.write(self.master, response)
+
+    def close(self):
+        os.close(self.slave)
+        os.close(self.master)
+
+
+class SerialTransportTestCase(envtest.CoreTestCase):
+    def test000_init(self):
+        transport = SerialTransport(EchoPort())
+        self.assertTrue(transport.is_running)
+        transport.close()
+        self.assertFalse(transport.is_running)
+        with self.assertRaises(RuntimeError):
+            transport.submit(b"a", 1)
+
+    def test010_transact(self):
+        transport = SerialTransport(EchoPort())
+        self.assertEqual(transport.transact(b"abc", 3), b"abc")
+        self.assertEqual(transport.transact(b"abc", 0), b"")
+        transport.close()
+
+    def test020_submit_does_not_block(self):
+        port = EchoPort(latency=0.1)
+        transport = SerialTransport(port)
+        start_time = time.time()
+        futures = [transport.submit(bytes([i]), 1) for i in range(3)]
+        self.assertLess(time.time() - start_time, 0.05)
+
+        self.assertEqual([f.result() for f in futures], [b"\0", b"\1", b"\2"])
+        self.assertEqual(port.writes, [b"\0", b"\1", b"\2"])
+        transport.close()
+
+    def test030_timeout_and_retries(self):
+        transport = SerialTransport(EchoPort(lost=1), retries=1)
+        self.assertEqual(transport.transact(b"a", 1), b"a")
+        self.assertEqual(transport.metrics.retries, 1)
+
+        with self.assertRaises(SerialTimeout):
+            transport.transact(b"a", 2, retries=0)
+        self.assertEqual(transport.metrics.errors, 1)
+        transport.close()
+
+    def test040_metrics(self):
+        transport = SerialTransport(EchoPort(latency=0.01))
+        for _ in range(5):
+            transport.transact(b"abcd", 4)
+
+        metrics = transport.metrics.as_dict()
+        self.assertEqual(metrics["transactions"], 5)
+        self.assertEqual(metrics["bytes_written"], 20)
+        self.assertEqual(metrics["bytes_read"], 20)
+        self.assertGreaterEqual(metrics["mean_latency"], 0.01)
+        self.assertGreaterEqual(metrics["max_latency"], metrics["mean_latency"])
+        self.assertGreater(metrics["throughput"], 0)
+        transport.close()
+
+    def test050_asyncio(self):
+        transport = SerialTransport(EchoPort(latency=0.01))
+
+        async def exchange():
+            return await asyncio.gather(
+                transport.transact_async(b"a", 1),
+                transport.transact_async(b"b", 1),
+            )
+
+        self.assertEqual(asyncio.run(exchange()), [b"a", b"b"])
+        transport.close()
+
+    def test060_shared_transport(self):
+        port = EchoPort()
+        transport = transport_for(port)
+        self.assertIs(transport_for(port), transport)
+        transport.close()
+        self.assertIsNot(transport_for(port), transport)
+        transport_for(port).close()
+
+
+@unittest.skipUnless(hasattr(os, "openpty"), "Needs a pseudo-terminal")
+class PtyVMSControllerTestCase(envtest.CoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.device = PtyVMSDevice()
+        self.controller = VMSController(serial_path=self.device.path)
+        self.controller.initialize()
+
+    def tearDown(self):
+        self.controller.shutdown()
+        self.device.close()
+        super().tearDown()
+
+    def test000_init(self):
+        self.assertTrue(self.controller.is_accessible)
+        self.assertIsInstance(self.controller.port, serial.Serial)
+
+    def test010_registers(self):
+        self.controller.lines_per_frame = 512
+        self.assertEqual(self.controller.lines_per_frame, 512)
+        self.assertIn("Feb 06 2012", self.controller.build_info())
+
+    def test020_async_commands(self):
+        future = self.controller.send_commands_async(
+            [("WRITE_DAC_START", 18000), ("READ_DAC_START", None)]
+        )
+        self.assertEqual(future.result(timeout=3), [None, (18000,)])
+        self.assertEqual(self.controller.transport.metrics.transactions, 2)
+
+
+if __name__ == "__main__":
+    envtest.main()
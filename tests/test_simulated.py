@@ -0,0 +1,145 @@
+import envtest  # setup environment for testing
+import time
+
+from pymicroscope.experiment.actions import *
+from pymicroscope.hardware.kinesisdevice import KinesisDevice
+from pymicroscope.hardware.simulated import (
+    MotionProfile,
+    SerialLink,
+    SimulatedAxis,
+    SimulatedLinearMotionDevice,
+)
+
+
+class MotionProfileTestCase(envtest.CoreTestCase):
+    def test000_init(self):
+        self.assertIsNotNone(MotionProfile(max_speed=10, acceleration=100))
+        with self.assertRaises(ValueError):
+            MotionProfile(max_speed=0, acceleration=100)
+
+    def test010_triangular_profile(self):
+        profile = MotionProfile(max_speed=10, acceleration=100)
+        # Never reaches max_speed: d = a t^2 / 4
+        self.assertAlmostEqual(profile.travel_time(1), 0.2)
+        self.assertAlmostEqual(profile.travel_time(-1), 0.2)
+        self.assertAlmostEqual(profile.travelled(1, 0.1), 0.5)
+
+    def test020_trapezoidal_profile(self):
+        profile = MotionProfile(max_speed=10, acceleration=100, settle_time=1)
+        self.assertAlmostEqual(profile.ramp_distance, 0.5)
+        # 0.1 s up, 0.1 s down and 9 units at 10 units/s
+        self.assertAlmostEqual(profile.travel_time(10), 1.1)
+        self.assertAlmostEqual(profile.duration(10), 2.1)
+        self.assertAlmostEqual(profile.travelled(10, 0.1), 0.5)
+        self.assertAlmostEqual(profile.travelled(10, 0.6), 5.5)
+        self.assertAlmostEqual(profile.travelled(10, 1.1), 10)
+
+    def test030_travelled_is_monotonic(self):
+        profile = MotionProfile(max_speed=10, acceleration=100)
+        previous = 0
+        for i in range(121):
+            travelled = profile.travelled(10, i / 100)
+            self.assertGreaterEqual(travelled, previous)
+            previous = travelled
+
+    def test040_serial_link(self):
+        link = SerialLink(baudrate=19200)
+        self.assertAlmostEqual(link.transfer_time(192), 0.1)
+
+
+class SimulatedAxisTestCase(envtest.CoreTestCase):
+    def test000_init(self):
+        axis = SimulatedAxis(MotionProfile(max_speed=10, acceleration=100))
+        self.assertEqual(axis.position, 0)
+        self.assertFalse(axis.is_moving)
+
+    def test010_move(self):
+        axis = SimulatedAxis(MotionProfile(max_speed=100, acceleration=1000))
+        start_time = time.time()
+        axis.move_to(-10)
+        self.assertTrue(axis.is_moving)
+        axis.wait()
+        self.assertAlmostEqual(time.time() - start_time, 0.2, delta=0.05)
+        self.assertEqual(axis.position, -10)
+
+    def test020_retarget(self):
+        axis = SimulatedAxis(MotionProfile(max_speed=100, acceleration=1000))
+        axis.move_to(10)
+        time.sleep(0.05)
+        axis.move_to(0)
+        axis.wait()
+        self.assertEqual(axis.position, 0)
+
+
+class SimulatedKinesisTestCase(envtest.CoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.device = KinesisDevice(serialNumber="debug")
+        self.device.initializeDevice()
+
+    def tearDown(self):
+        self.device.shutdownDevice()
+        super().tearDown()
+
+    def test000_init(self):
+        self.assertEqual(self.device.position(), 0)
+
+    def test010_move_takes_time(self):
+        # 100 µm with 4 mm/s^2 never reaches 2.6 mm/s, and settles 20 ms
+        start_time = time.time()
+        self.device.moveInMicronsTo((100,))
+        self.assertAlmostEqual(time.time() - start_time, 0.336, delta=0.05)
+        self.assertEqual(self.device.position(), 100 * 128)
+
+        self.device.moveInMicronsBy((-10,))
+        self.assertEqual(self.device.position(), 90 * 128)
+        self.device.home()
+        self.assertEqual(self.device.position(), 0)
+
+    def test020_streamed_waypoints(self):
+        waypoints = [(x,) for x in (10, 20, 30)]
+        ActionTrajectory(waypoints, self.device).perform()
+        self.assertEqual(self.device.position(), 30 * 128)
+
+        waypoints = [(x,) for x in (50, 20, 40)]
+        ActionTrajectory(waypoints, self.device, blend_radius=1).perform()
+        self.assertEqual(self.device.positionInMicrons(), (40,))
+
+
+class SimulatedLinearMotionDeviceTestCase(envtest.CoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.device = SimulatedLinearMotionDevice()
+        self.device.initializeDevice()
+
+    def tearDown(self):
+        self.device.shutdownDevice()
+        super().tearDown()
+
+    def test000_init(self):
+        self.assertEqual(self.device.position(), (0, 0, 0))
+
+    def test010_axes_move_together(self):
+        profile = self.device.profile
+        expected = profile.duration(1000 * self.device.nativeStepsPerMicrons)
+
+        start_time = time.time()
+        self.device.moveInMicronsTo((1000, 500, 10))
+        self.assertAlmostEqual(time.time() - start_time, expected, delta=0.05)
+        self.assertEqual(self.device.positionInMicrons(), (1000, 500, 10))
+
+        self.device.moveInMicronsBy((-500, 0, 0))
+        self.assertEqual(self.device.positionInMicrons(), (500, 500, 10))
+
+    def test020_motion_overlaps_work(self):
+        # About 0.3 s of travel overlapping 0.3 s of work
+        move = ActionMoveAsync((200, 0, 0), self.device)
+        start_time = time.time()
+        move.perform()
+        ActionWait(0.3).perform()
+        ActionWaitForMotion(self.device).perform()
+        self.assertLess(time.time() - start_time, 0.45)
+
+
+if __name__ == "__main__":
+    envtest.main()
@@ -0,0 +1,140 @@
+import envtest  # setup environment for testing
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from pymicroscope.base.mapcontroller import MapController
+from pymicroscope.base.stitching import (
+    TileStitcher,
+    phase_correlation,
+    register_tile_pair,
+)
+
+
+class StitchingTestCase(envtest.CoreTestCase):
+    def setUp(self):
+        super().setUp()
+        rng = np.random.default_rng(0)
+        # Smooth random scene with features at all scales
+        noise = rng.random((400, 500))
+        kernel = np.ones(5) / 5
+        scene = np.apply_along_axis(np.convolve, 0, noise, kernel, "same")
+        scene = np.apply_along_axis(np.convolve, 1, scene, kernel, "same")
+        self.scene = (255 * (scene - scene.min()) / np.ptp(scene)).astype(np.uint8)
+
+        self.tile_size = (120, 160)
+        self.true_positions = []
+        self.tiles = []
+        for row in range(3):
+            for column in range(3):
+                x = 10 + column * 140 + rng.integers(-4, 5)
+                y = 10 + row * 100 + rng.integers(-4, 5)
+                self.true_positions.append((x, y))
+                self.tiles.append(
+                    self.scene[y : y + self.tile_size[0], x : x + self.tile_size[1]]
+                )
+        self.true_positions = np.array(self.true_positions, dtype=float)
+        self.prior_positions = np.array(
+            [(10 + c * 140, 10 + r * 100) for r in range(3) for c in range(3)],
+            dtype=float,
+        )
+
+    def test000_init(self):
+        stitcher = TileStitcher(self.tiles, self.prior_positions)
+        self.assertIsNotNone(stitcher)
+        self.assertEqual(stitcher.tile_shape, (120, 160, 1))
+
+    def test010_mismatched_tiles_and_positions(self):
+        with self.assertRaises(ValueError):
+            TileStitcher(self.tiles, self.prior_positions[:-1])
+
+    def test020_phase_correlation(self):
+        reference = self.scene[100:200, 100:200].astype(np.float32)
+        moving = self.scene[103:203, 95:195].astype(np.float32)
+        shift, peak = phase_correlation(reference, moving)
+        self.assertTrue(np.allclose(shift, (3, -5), atol=0.5))
+        self.assertTrue(peak > 0.3)
+
+    def test030_register_pair(self):
+        offset = self.true_positions[1] - self.true_positions[0]
+        _, _, measured, peak = register_tile_pair(
+            (0, 1, self.tiles[0], self.tiles[1], np.array([0.0, 140.0]))
+        )
+        self.assertTrue(np.allclose(measured, offset[::-1], atol=0.5))
+
+    def test040_adjacent_pairs(self):
+        stitcher = TileStitcher(self.tiles, self.prior_positions)
+        pairs = stitcher.adjacent_pairs()
+        # 6 horizontal, 6 vertical and 8 diagonal neighbours
+        self.assertEqual(len(pairs), 20)
+
+    def test050_optimize_recovers_positions(self):
+        stitcher = TileStitcher(self.tiles, self.prior_positions, max_workers=2)
+        stitcher.register()
+        positions = stitcher.optimize()
+
+        expected = self.true_positions[:, ::-1] - self.true_positions[:, ::-1].min(axis=0)
+        self.assertTrue(np.allclose(positions, expected, atol=1))
+
+    def test060_blend_to_file(self):
+        stitcher = TileStitcher(self.tiles, self.prior_positions, max_workers=0)
+        with tempfile.TemporaryDirectory() as directory:
+            filepath = Path(directory) / "mosaic.npy"
+            mosaic = stitcher.stitch(filepath, chunk_size=64)
+            self.assertTrue(filepath.exists())
+            self.assertEqual(mosaic.shape, stitcher.mosaic_shape)
+
+            origin = self.true_positions.min(axis=0).astype(int)
+            expected = self.scene[
+                origin[1] : origin[1] + mosaic.shape[0],
+                origin[0] : origin[0] + mosaic.shape[1],
+            ]
+            error = np.abs(mosaic[50:200, 50:300, 0].astype(int) - expected[50:200, 50:300])
+            self.assertTrue(np.median(error) <= 1)
+            del mosaic
+
+    def test070_tiles_from_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            paths = []
+            for i, tile in enumerate(self.tiles):
+                path = Path(directory) / f"tile-{i}.npy"
+                np.save(path, tile)
+                paths.append(path)
+
+            stitcher = TileStitcher(paths, self.prior_positions, max_workers=2)
+            mosaic = stitcher.stitch()
+            self.assertEqual(mosaic.dtype, np.uint8)
+
+    def test080_from_map_controller(self):
+        controller = MapController(device=None)
+        controller.microstep_pixel = 0.5
+        positions = [(0, 0, 0), (70, 0, 0)]
+        stitcher = TileStitcher.from_map_controller(
+            controller, self.tiles[:2], positions=positions
+        )
+        self.assertTrue(np.allclose(stitcher.prior_positions, [(0, 0), (0, 140)]))
+
+    def test090_from_map_controller_plane(self):
+        controller = MapController(device=None)
+        controller.microstep_pixel = 0.5
+        controller.parameters["Upper left corner"] = (0.0, 200.0, 0.0)
+        controller.parameters["Upper right corner"] = (500.0, 200.0, 0.0)
+        controller.parameters["Lower left corner"] = (0.0, 0.0, 0.0)
+        controller.parameters["Lower right corner"] = (500.0, 0.0, 0.0)
+        controller.z_image_number = 2
+
+        grid = controller.create_position_grid()
+        plane = grid[grid["tile_iz"] == 1]
+        tiles = [self.tiles[0]] * len(plane)
+        stitcher = TileStitcher.from_map_controller(controller, tiles, plane=1)
+
+        expected = np.stack([plane["y"], plane["x"]], axis=1) / 0.5
+        self.assertTrue(np.allclose(stitcher.prior_positions, expected))
+        with self.assertRaises(ValueError):
+            # All the planes are not the tiles of one plane
+            TileStitcher.from_map_controller(controller, [self.tiles[0]] * len(grid))
+
+
+if __name__ == "__main__":
+    envtest.main()
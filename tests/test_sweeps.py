@@ -0,0 +1,154 @@
+import envtest  # setup environment for testing
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from pymicroscope.experiment.actions import *
+from pymicroscope.experiment.sweeps import WavelengthSweep
+from pymicroscope.plugins.delay_line import DelaysController
+
+
+class DelayLine:
+    def __init__(self, travel_time=0.01):
+        self.travel_time = travel_time
+        self.position = (0,)
+        self.history = []
+
+    def moveInMicronsTo(self, position):
+        time.sleep(self.travel_time)
+        self.position = tuple(position)
+        self.history.append(self.position)
+
+
+class DelayTableTestCase(envtest.CoreTestCase):
+    def test000_init(self):
+        controller = DelaysController()
+        self.assertEqual(controller.calibration, "linear")
+
+    def test010_linear(self):
+        controller = DelaysController()
+        wavelengths = np.array([700, 800, 900])
+        delays = controller.delays_for_wavelengths(wavelengths)
+        for wavelength, delay in zip(wavelengths, delays):
+            self.assertAlmostEqual(
+                delay,
+                controller.linear_relation_delays_and_wavelength(wavelength),
+            )
+
+    def test020_polynomial(self):
+        controller = DelaysController()
+        controller.set_calibration_polynomial([0.001, -1, 500])
+        delays = controller.delays_for_wavelengths([0, 100])
+        self.assertTrue(np.allclose(delays, [500, 410]))
+
+    def test030_table(self):
+        controller = DelaysController()
+        controller.set_calibration_table([900, 700, 800], [10, 30, 20])
+        self.assertEqual(controller.calibration, "table")
+        delays = controller.delays_for_wavelengths([700, 750, 900])
+        self.assertTrue(np.allclose(delays, [30, 25, 10]))
+
+        with self.assertRaises(ValueError):
+            controller.delays_for_wavelengths([650])
+        with self.assertRaises(ValueError):
+            controller.set_calibration_table([700], [10])
+        with self.assertRaises(ValueError):
+            controller.set_calibration_table([700, 800], [10])
+
+    def test040_sweep_order(self):
+        delays = np.array([5, 1, 3, 2, 4])
+        order = DelaysController.sweep_order(delays)
+        self.assertEqual(list(delays[order]), [1, 2, 3, 4, 5])
+
+        order = DelaysController.sweep_order(delays, current_delay=10)
+        self.assertEqual(list(delays[order]), [5, 4, 3, 2, 1])
+
+
+class WavelengthSweepTestCase(envtest.CoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.controller = DelaysController()
+        self.controller.set_calibration_table([700, 900], [100, 40])
+        self.device = DelayLine()
+
+    def test000_init(self):
+        sweep = WavelengthSweep([700, 800, 900], self.controller, self.device)
+        self.assertEqual(len(sweep), 3)
+        with self.assertRaises(ValueError):
+            WavelengthSweep([], self.controller, self.device)
+
+    def test010_points_are_monotonic(self):
+        sweep = WavelengthSweep(
+            [800, 700, 900, 750], self.controller, self.device
+        )
+        self.assertTrue(np.all(np.diff(sweep.points["delay"]) > 0))
+        self.assertEqual(list(sweep.points["wavelength"]), [900, 800, 750, 700])
+        self.assertAlmostEqual(sweep.travel, 60)
+
+        sweep = WavelengthSweep(
+            [800, 700, 900, 750],
+            self.controller,
+            self.device,
+            current_delay=100,
+        )
+        self.assertEqual(list(sweep.points["wavelength"]), [700, 750, 800, 900])
+
+    def test020_experiment_steps(self):
+        sweep = WavelengthSweep(
+            [700, 800, 900], self.controller, self.device, settle_time=0.1
+        )
+        exp = sweep.create_experiment()
+        self.assertEqual(len(exp.steps), 3)
+
+        first, last = exp.steps[0], exp.steps[-1]
+        self.assertIsInstance(first.prepare_actions[0], ActionMoveAsync)
+        self.assertEqual(
+            [type(action) for action in first.perform_actions],
+            [
+                ActionWaitForMotion,
+                ActionWait,
+                ActionAccumulate,
+                ActionMoveAsync,
+                ActionMean,
+                ActionSave,
+            ],
+        )
+        # Nothing to move to after the last point
+        self.assertNotIn(
+            ActionMoveAsync, [type(a) for a in last.perform_actions]
+        )
+
+    def test030_perform_sweep(self):
+        tuned = []
+        with tempfile.TemporaryDirectory() as root_dir:
+            sweep = WavelengthSweep(
+                [700, 800, 900],
+                self.controller,
+                self.device,
+                n_images=2,
+                root_dir=Path(root_dir),
+                tune_laser=tuned.append,
+            )
+            exp = sweep.create_experiment()
+            for step in exp.steps:
+                for action in step.perform_actions:
+                    if isinstance(action, ActionAccumulate):
+                        for _ in range(action.n_images):
+                            action.queue.put(
+                                np.zeros(shape=(10, 10, 3), dtype=np.uint8)
+                            )
+            exp.perform()
+
+            filenames = sorted(path.name for path in Path(root_dir).iterdir())
+
+        self.assertEqual(tuned, [900, 800, 700])
+        self.assertEqual(self.device.position, (100,))
+        self.assertEqual(len(filenames), 3)
+        for wavelength in ("700.0nm", "800.0nm", "900.0nm"):
+            self.assertTrue(any(wavelength in name for name in filenames))
+
+
+if __name__ == "__main__":
+    envtest.main()
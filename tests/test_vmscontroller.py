@@ -78,6 +78,86 @@ class TestController(unittest.TestCase):
 
 
 
+class TestSimulatedController(TestController):
+    def setUp(self):
+        self.controller = VMSController(serial_path="debug")
+        self.controller.initialize()
+
+    def test170_write_latency(self):
+        # 3 bytes at 19200 baud
+        start_time = time.time()
+        self.controller.dac_start = 19000
+        self.assertGreater(time.time() - start_time, 0.0015)
+        self.assertEqual(self.controller.dac_start, 19000)
+
+    def test180_build_info_in_one_transaction(self):
+        writes = self.controller.port.writes
+        self.controller.register_cache.clear()
+        self.controller.build_info()
+        self.assertEqual(self.controller.port.writes, writes + 1)
+
+    def test190_register_cache(self):
+        self.assertEqual(self.controller.lines_per_frame, 576)
+        writes = self.controller.port.writes
+        for _ in range(10):
+            self.controller.vsync_frequency
+        self.assertEqual(self.controller.port.writes, writes)
+
+        self.controller.lines_per_frame = 512
+        self.assertNotIn(
+            "READ_NUMBER_OF_LINES_PER_FRAME", self.controller.register_cache
+        )
+        self.assertEqual(self.controller.lines_per_frame, 512)
+
+    def test200_batched_commands(self):
+        writes = self.controller.port.writes
+        responses = self.controller.send_commands(
+            [
+                ("WRITE_DAC_START", 18000),
+                ("READ_DAC_START", None),
+                ("WRITE_DAC_INCREMENT", 16),
+                ("READ_DAC_INCREMENT", None),
+                ("READ_FIRMWARE_VERSION", None),
+            ]
+        )
+        self.assertEqual(responses, [None, (18000,), None, (16,), (4, 0, 0)])
+        self.assertEqual(self.controller.port.writes, writes + 1)
+
+    def test210_refresh_registers(self):
+        writes = self.controller.port.writes
+        registers = self.controller.refresh_registers()
+        self.assertEqual(self.controller.port.writes, writes + 1)
+        self.assertEqual(registers["READ_NUMBER_OF_LINES_FOR_VSYNC"], (6,))
+
+        self.controller.dac_start
+        self.controller.dac_increment
+        self.controller.lines_for_vsync
+        self.controller.build_info()
+        self.assertEqual(self.controller.port.writes, writes + 1)
+
+    def test220_refresh_registers_async(self):
+        writes = self.controller.port.writes
+        future = self.controller.refresh_registers_async()
+        registers = future.result(timeout=5)
+        self.assertEqual(self.controller.port.writes, writes + 1)
+        self.assertEqual(registers["READ_FIRMWARE_VERSION"], (4, 0, 0))
+        self.assertEqual(
+            self.controller.register_cache["READ_DAC_START"],
+            registers["READ_DAC_START"],
+        )
+
+    def test230_volatile_registers_are_not_cached(self):
+        name = "READ_STATE_OF_SWITCHES_AND_TTL_IOS"
+        self.controller.refresh_registers()
+        self.assertNotIn(name, self.controller.register_cache)
+        self.assertIn("READ_SN", self.controller.register_cache)
+
+        state = self.controller.read_register(name)
+        self.controller.port.constants = dict(
+            self.controller.port.constants, **{name: (state[0] ^ 1,)}
+        )
+        self.assertEqual(self.controller.read_register(name), (state[0] ^ 1,))
+
 
 if __name__ == "__main__":
     unittest.main()